@@ -1069,6 +1069,22 @@ class service:
             print("\t%s = %s" % (element, info['info'][element]))
         return 0, ''
 
+    def getVolumesInfo(self, args):
+        sdUUID = args[0]
+        spUUID = args[1]
+        if len(args) > 2:
+            imgUUID = args[2]
+        else:
+            imgUUID = BLANK_UUID
+        res = self.s.getVolumesInfo(sdUUID, spUUID, imgUUID)
+        if res['status']['code']:
+            return res['status']['code'], res['status']['message']
+        for volUUID, info in res['info'].iteritems():
+            print(volUUID)
+            for element in info.keys():
+                print("\t%s = %s" % (element, info[element]))
+        return 0, ''
+
     def getVolumeSize(self, args):
         sdUUID = args[0]
         spUUID = args[1]
@@ -1820,7 +1836,10 @@ class service:
                     self.__domain_status(d, res["baddomains"][d])
 
     def repoStats(self, args):
-        stats = self.s.repoStats()
+        options = {}
+        if 'latency' in args:
+            options['latency'] = True
+        stats = self.s.repoStats(options)
         if stats['status']['code']:
             print("count not get repo stats")
             return int(stats['status']['code'])
@@ -2484,6 +2503,11 @@ if __name__ == '__main__':
                             'Returns list of volumes of imgUUID or sdUUID if '
                             'imgUUID absent'
                             )),
+        'getVolumesInfo': (serv.getVolumesInfo,
+                           ('<sdUUID> <spUUID> [imgUUID]',
+                            'Returns the details of all the volumes of '
+                            'imgUUID or sdUUID if imgUUID absent'
+                            )),
         'getVolumeSize': (serv.getVolumeSize,
                           ('<sdUUID> <spUUID> <imgUUID> <volUUID>',
                            'Returns the apparent size and the true size of the'
@@ -2742,8 +2766,10 @@ if __name__ == '__main__':
                        'send a fencing command to a remote node'
                        )),
         'repoStats': (serv.repoStats,
-                      ('',
-                       'Get the health status of the monitored domains'
+                      ('[latency]',
+                       'Get the health status of the monitored domains',
+                       'latency: add read delay and selftest latency '
+                       'statistics'
                        )),
         'startMonitoringDomain': (serv.startMonitoringDomain,
                                   ('<sdUUID> <hostID>',
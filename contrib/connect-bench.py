@@ -0,0 +1,153 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Measure the time to connect a host to many iSCSI targets and NFS exports,
+like connectStorageServer during host activation, connecting one connection
+at a time and connecting concurrently with storageServer.connectAll.
+
+The storage commands are fake scripts: iscsiadm sleeps --login-delay seconds
+on login, mount sleeps --mount-delay seconds, and udevadm settle sleeps
+--settle-delay seconds. Nothing is mounted or logged in, so the mount
+checks and access validation are skipped. Run as root, since iscsiadm runs
+with sudo:
+
+    python connect-bench.py --iscsi 16 --nfs 10 --workers 10
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, "/usr/share/vdsm")
+
+from vdsm import constants
+from vdsm import udevadm
+from vdsm import utils
+from storage import iscsi
+from storage import mount
+from storage import storageServer
+
+FAKE_ISCSIADM = """#!/bin/sh
+case "$*" in
+*"-m iface -I "*)
+    echo "iface.net_ifacename = <empty>"
+    ;;
+*" -l")
+    sleep %(delay)s
+    ;;
+esac
+"""
+
+FAKE_SLEEP = """#!/bin/sh
+sleep %(delay)s
+"""
+
+
+def createScript(dir, name, template, delay):
+    path = os.path.join(dir, name)
+    with open(path, "w") as f:
+        f.write(template % {"delay": delay})
+    os.chmod(path, 0o755)
+    return path
+
+
+def fakeRecord(self):
+    return mount.MountRecord(self.fs_spec, self.fs_file, "nfs", "", 0, 0)
+
+
+def createConnections(options):
+    connections = []
+    for i in range(options.iscsi):
+        portal = iscsi.IscsiPortal("10.0.0.%d" % (i % options.portals + 1),
+                                   3260)
+        target = iscsi.IscsiTarget(portal, 1, "iqn.2015-01.com.example:%d" % i)
+        connections.append(storageServer.IscsiConnection(target))
+    for i in range(options.nfs):
+        connections.append(
+            storageServer.NFSConnection("server%d:/export/%d" % (i, i)))
+    return connections
+
+
+def bench(connections, workers):
+    jobs = [(con, con.connect) for con in connections]
+    start = time.time()
+    results = storageServer.connectAll(jobs, workers)
+    elapsed = time.time() - start
+    failed = [r.value for r in results if not r.succeeded]
+    return elapsed, failed
+
+
+def report(name, count, elapsed, failed):
+    print("%-10s %3d connections in %7.3f seconds, %d failed" %
+          (name, count, elapsed, len(failed)))
+    for error in failed[:5]:
+        print("    %s" % error)
+
+
+op = optparse.OptionParser()
+op.add_option('--iscsi', dest='iscsi', type='int',
+              help='number of iSCSI targets')
+op.add_option('--portals', dest='portals', type='int',
+              help='number of iSCSI portals serving the targets')
+op.add_option('--nfs', dest='nfs', type='int',
+              help='number of NFS exports')
+op.add_option('--workers', dest='workers', type='int',
+              help='number of concurrent connect workers')
+op.add_option('--login-delay', dest='loginDelay', type='float',
+              help='seconds fake iscsiadm takes to login')
+op.add_option('--mount-delay', dest='mountDelay', type='float',
+              help='seconds fake mount takes to mount')
+op.add_option('--settle-delay', dest='settleDelay', type='float',
+              help='seconds fake udevadm settle takes')
+op.set_defaults(iscsi=16, portals=4, nfs=10, workers=10, loginDelay=0.5,
+                mountDelay=1, settleDelay=0.1)
+
+options, args = op.parse_args()
+
+tmpdir = tempfile.mkdtemp()
+try:
+    constants.EXT_ISCSIADM = createScript(tmpdir, "iscsiadm", FAKE_ISCSIADM,
+                                          options.loginDelay)
+    constants.EXT_MOUNT = createScript(tmpdir, "mount", FAKE_SLEEP,
+                                       options.mountDelay)
+    udevadm._UDEVADM = utils.CommandPath(
+        "udevadm", createScript(tmpdir, "udevadm", FAKE_SLEEP,
+                                options.settleDelay))
+    mount.Mount.isMounted = lambda self: False
+    mount.Mount.getRecord = fakeRecord
+    storageServer.fileSD.validateDirAccess = lambda path: True
+
+    mountDir = os.path.join(tmpdir, "mnt")
+    storageServer.MountConnection.setLocalPathBase(mountDir)
+    os.mkdir(mountDir)
+
+    count = options.iscsi + options.nfs
+
+    elapsed, failed = bench(createConnections(options), 1)
+    report("serial", count, elapsed, failed)
+
+    elapsed, failed = bench(createConnections(options), options.workers)
+    report("concurrent", count, elapsed, failed)
+finally:
+    shutil.rmtree(tmpdir)
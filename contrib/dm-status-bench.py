@@ -0,0 +1,155 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Measure collecting multipath paths status for many devices, using a fake
+sysfs tree with synthetic multipath devices, so it does not require root or
+real multipath devices.
+
+Compares parsing "dmsetup status" output (without running dmsetup), reading
+the status with device mapper ioctls (with a fake ioctl returning the same
+status), and concurrent getPathsStatus callers sharing the cached status
+(with a fake supervdsm call taking --rtt seconds):
+
+    python dm-status-bench.py --devices 1000 --paths 4 --threads 8
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, "/usr/share/vdsm")
+
+from storage import devicemapper as dm
+
+
+def createSysfs(root, devices, paths):
+    """
+    Create a fake sysfs tree and return the status of the multipath devices,
+    {uuid: status}.
+    """
+    block = os.path.join(root, "block")
+    devBlock = os.path.join(root, "dev", "block")
+    os.makedirs(devBlock)
+    statuses = {}
+    for i in range(devices):
+        uuid = "mpath-3600a0b80005ad%010d" % i
+        dmInfo = os.path.join(block, "dm-%d" % i, "dm")
+        os.makedirs(dmInfo)
+        with open(os.path.join(dmInfo, "uuid"), "w") as f:
+            f.write(uuid + "\n")
+        devnums = []
+        for j in range(paths):
+            n = i * paths + j
+            physdev = "sd%d" % n
+            devnum = "%d:%d" % (8 + n // 256, n % 256)
+            os.mkdir(os.path.join(block, physdev))
+            os.symlink(os.path.join("..", "..", "block", physdev),
+                       os.path.join(devBlock, devnum))
+            devnums.append(devnum)
+        statuses[uuid] = ("2 0 0 0 1 1 A 0 %d 0 " % paths +
+                          " ".join("%s A 0 0" % d for d in devnums))
+    return statuses
+
+
+def timeit(func, count):
+    start = time.time()
+    for i in range(count):
+        res = func()
+    return (time.time() - start) / count, res
+
+
+def benchCached(threads, seconds, rtt):
+    calls = [0]
+    updates = [0]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    class Proxy(object):
+        def getPathsStatus(self):
+            updates[0] += 1
+            time.sleep(rtt)
+            return dm._getPathsStatus()
+
+    dm.getProxy = Proxy
+
+    def worker():
+        while not done.is_set():
+            dm.getPathsStatus()
+            with lock:
+                calls[0] += 1
+
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    for t in workers:
+        t.start()
+    time.sleep(seconds)
+    done.set()
+    for t in workers:
+        t.join()
+    return calls[0], updates[0]
+
+
+op = optparse.OptionParser()
+op.add_option('--devices', dest='devices', type='int',
+              help='number of multipath devices')
+op.add_option('--paths', dest='paths', type='int',
+              help='number of paths per device')
+op.add_option('--count', dest='count', type='int',
+              help='number of times to collect the status')
+op.add_option('--threads', dest='threads', type='int',
+              help='number of concurrent getPathsStatus callers')
+op.add_option('--seconds', dest='seconds', type='float',
+              help='seconds to run concurrent callers')
+op.add_option('--rtt', dest='rtt', type='float',
+              help='seconds the fake supervdsm call takes')
+op.set_defaults(devices=1000, paths=4, count=5, threads=8, seconds=5,
+                rtt=0.01)
+
+options, args = op.parse_args()
+
+root = tempfile.mkdtemp()
+try:
+    statuses = createSysfs(root, options.devices, options.paths)
+    dm._SYS_BLOCK = os.path.join(root, "block")
+    dm._SYS_DEV_BLOCK = os.path.join(root, "dev", "block")
+    dm._DM_CONTROL = os.path.join(root, "control")
+    open(dm._DM_CONTROL, "w").close()
+    dm._tableStatus = lambda control, uuid: [("multipath", statuses[uuid])]
+
+    out = ["%s: 0 100 multipath %s" % (uuid[6:], status)
+           for uuid, status in sorted(statuses.items())]
+    elapsed, res = timeit(lambda: dm._parseDmsetupStatus(out), options.count)
+    print("dmsetup output: %d paths in %.3f seconds" % (len(res), elapsed))
+
+    elapsed, res = timeit(dm._getPathsStatus, options.count)
+    print("ioctl:          %d paths in %.3f seconds" % (len(res), elapsed))
+
+    calls, updates = benchCached(options.threads, options.seconds,
+                                 options.rtt)
+    print("cached:         %d calls from %d threads in %.1f seconds "
+          "(%.1f calls/sec), %d updates" %
+          (calls, options.threads, options.seconds,
+           calls / options.seconds, updates))
+finally:
+    shutil.rmtree(root)
@@ -0,0 +1,115 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Compare the throughput of running lvm commands in a new lvm process for every
+command, with running them in persistent lvm shells (irs:lvm_shell_pool_size).
+
+Run as root on a host with lvm2 2.02.158 or later, using read only commands:
+
+    python lvm-bench.py --count 500 --threads 4 -- lvs -o tags vgname
+
+The lvm shell backend requires the "lastlog" shell command; if lvm does not
+support it, only the exec results are reported.
+"""
+
+import optparse
+import sys
+import threading
+import time
+
+sys.path.insert(0, "/usr/share/vdsm")
+
+from vdsm import constants
+from vdsm import utils
+from storage import lvmshell
+
+
+def execRunner():
+    def run(args):
+        return utils.execCmd([constants.EXT_LVM] + args, sudo=True)
+    return run, lambda: None
+
+
+def shellRunner(threads, timeout):
+    pool = lvmshell.ShellPool(threads, timeout)
+    return pool.run, pool.close
+
+
+def bench(run, args, count, threads):
+    lock = threading.Lock()
+    remaining = [count]
+    failures = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            rc, out, err = run(args)
+            if rc != 0:
+                with lock:
+                    failures[0] += 1
+
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    start = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return time.time() - start, failures[0]
+
+
+def report(name, count, elapsed, failures):
+    print("%-6s %6d commands in %8.3f seconds, %8.2f ops/sec, %d failed" %
+          (name, count, elapsed, count / elapsed, failures))
+
+
+op = optparse.OptionParser(usage='%prog [options] -- lvm-command [args]')
+op.add_option('-c', '--count', dest='count', type='int',
+              help='number of commands to run with each backend')
+op.add_option('-t', '--threads', dest='threads', type='int',
+              help='number of concurrent threads (and lvm shells)')
+op.add_option('--timeout', dest='timeout', type='int',
+              help='lvm shell command timeout in seconds')
+op.set_defaults(count=100, threads=1, timeout=60)
+
+options, args = op.parse_args()
+
+if len(args) == 0:
+    op.error('lvm command is required')
+
+run, close = execRunner()
+elapsed, failures = bench(run, args, options.count, options.threads)
+report("exec", options.count, elapsed, failures)
+
+try:
+    run, close = shellRunner(options.threads, options.timeout)
+    # Start the shells before measuring
+    bench(run, args, options.threads, options.threads)
+except lvmshell.StartError as e:
+    sys.exit("Cannot use lvm shell: %s" % e)
+
+try:
+    elapsed, failures = bench(run, args, options.count, options.threads)
+    report("shell", options.count, elapsed, failures)
+finally:
+    close()
@@ -0,0 +1,257 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Simulate a storage pool mailbox with many hosts, and measure the throughput
+and round-trip latency of extend requests, from sending the request on the
+HSM side until the reply callback runs, and the CPU time used by vdsm and its
+child processes.
+
+The SPM and the simulated HSM hosts run in this process. Every host sends
+its requests at once, so with the default options there are 1000 concurrent
+requests. The SPM handles requests with a fake processRequest, replying after
+--delay seconds without extending anything.
+
+The mailbox is backed by sparse files in a temporary directory, which must
+support direct I/O (e.g. not tmpfs). With --loop (requires root), the files
+are attached to loop devices, like the inbox and outbox LVs of a block
+storage domain:
+
+    python mailbox-bench.py --hosts 250 --requests 4
+    python mailbox-bench.py --hosts 250 --requests 4 --loop --direct
+
+Use --json to save the results for comparing runs.
+"""
+
+import Queue
+import json
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from functools import partial
+
+sys.path.insert(0, "/usr/share/vdsm")
+
+from vdsm.config import config
+from vdsm import utils
+from storage import sd
+from storage import storage_mailbox as sm
+
+
+class Pool(object):
+
+    def __init__(self, repository, maxHosts, loop=False):
+        self.spUUID = str(uuid.uuid4())
+        self.storage_repository = repository
+        self.mailboxDir = os.path.join(repository, self.spUUID, "mastersd",
+                                       sd.DOMAIN_META_DATA)
+        self._loopDevices = []
+        os.makedirs(self.mailboxDir)
+        for name in ("inbox", "outbox"):
+            path = os.path.join(self.mailboxDir, name)
+            with open(path, "w") as f:
+                f.truncate(sm.MAILBOX_SIZE * maxHosts)
+            if loop:
+                self._attachLoopDevice(path)
+
+    def close(self):
+        for device in self._loopDevices:
+            rc, out, err = utils.execCmd(["losetup", "-d", device])
+            if rc != 0:
+                print("cannot detach %s: %s" % (device, err))
+
+    def _attachLoopDevice(self, path):
+        backing = path + ".img"
+        os.rename(path, backing)
+        rc, out, err = utils.execCmd(["losetup", "--find", "--show", backing])
+        if rc != 0:
+            raise RuntimeError("cannot attach loop device: %s" % err)
+        device = out[0].strip()
+        self._loopDevices.append(device)
+        os.symlink(device, path)
+
+
+class Reply(object):
+
+    def __init__(self, payload):
+        self.payload = payload
+
+
+def processRequest(spm, delay, msgID, payload):
+    """
+    Reply to the request like a successful extend, without extending
+    anything.
+    """
+    if delay:
+        time.sleep(delay)
+    spm.sendReply(msgID, Reply(payload))
+    return {'status': {'code': 0, 'message': 'Done'}}
+
+
+class Results(object):
+
+    def __init__(self, count):
+        self._lock = threading.Lock()
+        self._remaining = count
+        self.done = threading.Event()
+        self.latencies = []
+
+    def add(self, elapsed):
+        with self._lock:
+            self.latencies.append(elapsed)
+            self._remaining -= 1
+            if self._remaining == 0:
+                self.done.set()
+
+
+def send(hosts, pool, results, requests):
+    for n in range(requests):
+        for queue in hosts:
+            volumeData = {"poolID": pool.spUUID,
+                          "domainID": str(uuid.uuid4()),
+                          "volumeID": str(uuid.uuid4())}
+            start = time.time()
+
+            def callback(volumeData, start=start):
+                results.add(time.time() - start)
+
+            queue.put(sm.SPM_Extend_Message(volumeData, 1024, callback))
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def summary(options, results, elapsed, cpu):
+    latencies = sorted(results.latencies)
+    res = {
+        "hosts": options.hosts,
+        "requests": options.hosts * options.requests,
+        "replies": len(latencies),
+        "direct": options.direct,
+        "loop": options.loop,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "cpu": cpu[0],
+        "childrenCpu": cpu[1],
+    }
+    if latencies:
+        res.update({
+            "avgLatency": sum(latencies) / len(latencies),
+            "p50Latency": percentile(latencies, 50),
+            "p99Latency": percentile(latencies, 99),
+            "maxLatency": latencies[-1],
+        })
+    return res
+
+
+def report(res):
+    print("%(replies)d/%(requests)d replies from %(hosts)d hosts in "
+          "%(elapsed).3f seconds, %(throughput).2f requests/sec" % res)
+    if res["replies"]:
+        print("latency: avg %(avgLatency).3f p50 %(p50Latency).3f "
+              "p99 %(p99Latency).3f max %(maxLatency).3f seconds" % res)
+    print("cpu: %(cpu).3f seconds (%(childrenCpu).3f in child processes)" %
+          res)
+
+
+op = optparse.OptionParser()
+op.add_option('--hosts', dest='hosts', type='int',
+              help='number of HSM hosts sending requests')
+op.add_option('--requests', dest='requests', type='int',
+              help='number of requests sent by every host')
+op.add_option('--interval', dest='interval', type='float',
+              help='maximum mailbox monitor interval in seconds')
+op.add_option('--min-interval', dest='minInterval', type='float',
+              help='minimum mailbox monitor interval in seconds')
+op.add_option('--delay', dest='delay', type='float',
+              help='seconds the fake SPM takes to process a request')
+op.add_option('--timeout', dest='timeout', type='float',
+              help='seconds to wait for all replies')
+op.add_option('--dir', dest='dir',
+              help='directory for the mailbox files')
+op.add_option('--direct', dest='direct', action='store_true',
+              help='use in-process direct I/O instead of dd')
+op.add_option('--loop', dest='loop', action='store_true',
+              help='back the mailbox with loop devices (requires root)')
+op.add_option('--json', dest='json',
+              help='write the results to this file in json format')
+op.set_defaults(hosts=250, requests=4, interval=2,
+                minInterval=config.getfloat('irs', 'mailbox_min_interval'),
+                delay=0, timeout=600, dir='/var/tmp', direct=False,
+                loop=False)
+
+options, args = op.parse_args()
+
+config.set('irs', 'mailbox_direct_io', str(options.direct).lower())
+config.set('irs', 'mailbox_min_interval', str(options.minInterval))
+
+repository = tempfile.mkdtemp(dir=options.dir)
+try:
+    # Mailbox 0 is not used, host ids start at 1
+    pool = Pool(repository, options.hosts + 1, options.loop)
+    try:
+        spm = sm.SPM_MailMonitor(pool, options.hosts + 1, options.interval)
+        spm.registerMessageType(sm.EXTEND_CODE, partial(
+            processRequest, spm, options.delay))
+
+        hosts = []
+        monitors = []
+        for hostID in range(1, options.hosts + 1):
+            queue = Queue.Queue()
+            monitors.append(sm.HSM_MailMonitor(
+                os.path.join(pool.mailboxDir, "outbox"),
+                os.path.join(pool.mailboxDir, "inbox"),
+                hostID, queue, options.interval))
+            hosts.append(queue)
+
+        results = Results(options.hosts * options.requests)
+        startTimes = os.times()
+        start = time.time()
+        send(hosts, pool, results, options.requests)
+        if not results.done.wait(options.timeout):
+            print("timeout waiting for replies")
+        elapsed = time.time() - start
+        endTimes = os.times()
+        cpu = (sum(endTimes[:4]) - sum(startTimes[:4]),
+               sum(endTimes[2:4]) - sum(startTimes[2:4]))
+
+        for monitor in monitors:
+            monitor.immStop()
+        spm.stop()
+        for monitor in monitors:
+            monitor.join()
+        while not spm.isStopped():
+            time.sleep(0.1)
+    finally:
+        pool.close()
+
+    res = summary(options, results, elapsed, cpu)
+    report(res)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(res, f, indent=4, sort_keys=True)
+finally:
+    shutil.rmtree(repository)
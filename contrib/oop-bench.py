@@ -0,0 +1,137 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Compare out of process operations on a file domain like tree, calling the
+oop helper once per path, with the bulk operations (statMany, readLinesMany,
+globStat and walkStat) calling the helper once.
+
+The tree is created in a temporary directory, with --images image
+directories, each holding --volumes volumes (volume, .meta and .lease). The
+default implementation is the one configured in irs:oop_impl (ioprocess
+unless configured otherwise):
+
+    python oop-bench.py --images 1000 --volumes 10
+    python oop-bench.py --images 1000 --volumes 10 --impl rfh
+
+ioprocess has no bulk operations, so with ioprocess the bulk operations make
+one call per path, and the single "*/*.meta" glob ("glob meta") is the
+cheapest way to list the volumes.
+"""
+
+import optparse
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, "/usr/share/vdsm")
+
+from vdsm.config import config
+from storage import outOfProcess as oop
+
+
+def createTree(top, images, volumes):
+    metas = []
+    for i in range(images):
+        imgDir = os.path.join(top, str(uuid.uuid4()))
+        os.mkdir(imgDir)
+        for j in range(volumes):
+            volPath = os.path.join(imgDir, str(uuid.uuid4()))
+            for suffix in ("", ".lease"):
+                open(volPath + suffix, "w").close()
+            with open(volPath + ".meta", "w") as f:
+                f.write("IMAGE=%s\nVOLTYPE=LEAF\nEOF\n" %
+                        os.path.basename(imgDir))
+            metas.append(volPath + ".meta")
+    return metas
+
+
+def statEach(proc, paths):
+    return [proc.os.stat(path) for path in paths]
+
+
+def readLinesEach(proc, paths):
+    return [proc.readLines(path) for path in paths]
+
+
+def globIsdir(proc, pattern):
+    return [path for path in proc.glob.glob(pattern)
+            if proc.os.path.isdir(path)]
+
+
+def globStatIsdir(proc, pattern):
+    return [path for path, st in proc.globStat(pattern)
+            if stat.S_ISDIR(st.st_mode)]
+
+
+def walkEach(proc, top):
+    return [(path, proc.os.stat(path)) for path in proc.simpleWalk(top)]
+
+
+def bench(name, func, *args):
+    start = time.time()
+    res = func(*args)
+    elapsed = time.time() - start
+    print("%-16s %6d results in %7.3f seconds" % (name, len(res), elapsed))
+
+
+op = optparse.OptionParser()
+op.add_option('--images', dest='images', type='int',
+              help='number of image directories')
+op.add_option('--volumes', dest='volumes', type='int',
+              help='number of volumes per image')
+op.add_option('--impl', dest='impl', type='choice',
+              choices=(oop.RFH, oop.IOPROC),
+              help='out of process implementation (rfh, ioprocess)')
+op.add_option('--dir', dest='dir',
+              help='directory for the temporary tree')
+op.set_defaults(images=1000, volumes=10, impl=config.get('irs', 'oop_impl'),
+                dir='/var/tmp')
+
+options, args = op.parse_args()
+
+# Falls back to rfh if ioprocess is not available
+oop.setDefaultImpl(options.impl)
+if oop.batchesBulkOperations():
+    print("implementation: rfh, bulk operations in one call")
+else:
+    print("implementation: ioprocess, bulk operations call once per path")
+
+top = tempfile.mkdtemp(dir=options.dir)
+try:
+    metas = createTree(top, options.images, options.volumes)
+    proc = oop.getProcessPool("oop-bench")
+    pattern = os.path.join(top, "*")
+
+    bench("stat", statEach, proc, metas)
+    bench("statMany", proc.statMany, metas)
+    bench("readLines", readLinesEach, proc, metas)
+    bench("readLinesMany", proc.readLinesMany, metas)
+    bench("glob meta", proc.glob.glob, os.path.join(pattern, "*.meta"))
+    bench("glob+isdir", globIsdir, proc, pattern)
+    bench("globStat", globStatIsdir, proc, pattern)
+    bench("simpleWalk+stat", walkEach, proc, top)
+    bench("walkStat", proc.walkStat, top)
+finally:
+    shutil.rmtree(top)
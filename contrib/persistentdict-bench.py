@@ -0,0 +1,126 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Measure pool metadata updates on the SPM, like master version bumps and
+domain map changes.
+
+With the file backend, the metadata is kept in a temporary directory:
+
+    python persistentdict-bench.py --count 200
+
+With the vg backend (requires root), the metadata is kept in the tags of an
+existing scratch volume group, which must not have metadata tags (e.g. not a
+storage domain). The benchmark removes its tags when done:
+
+    python persistentdict-bench.py --backend vg --vg vgname --count 50
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, "/usr/share/vdsm")
+
+from storage import blockSD
+from storage import fileSD
+from storage import sd
+from storage.persistentDict import PersistentDict
+
+
+def fileBackend(options):
+    tmpdir = tempfile.mkdtemp(dir=options.dir)
+    domainDir = os.path.join(tmpdir, str(uuid.uuid4()), sd.DOMAIN_META_DATA)
+    os.makedirs(domainDir)
+    metaRW = fileSD.FileMetadataRW(os.path.join(domainDir, sd.METADATA))
+    return metaRW, lambda: shutil.rmtree(tmpdir)
+
+
+def vgBackend(options):
+    if options.vg is None:
+        op.error("--vg is required with the vg backend")
+    metaRW = blockSD.VGTagMetadataRW(options.vg)
+    if metaRW.readlines():
+        op.error("volume group %s has metadata tags" % options.vg)
+    return metaRW, lambda: metaRW.writelines([])
+
+
+def createMetadata(domains):
+    domainsMap = dict((str(uuid.uuid4()), "Active") for i in range(domains))
+    return {
+        "POOL_DESCRIPTION": "persistentdict-bench",
+        "POOL_DOMAINS": ",".join("%s:%s" % item
+                                 for item in domainsMap.iteritems()),
+        "POOL_SPM_ID": "1",
+        "POOL_SPM_LVER": "1",
+        "MASTER_VERSION": "1",
+    }, domainsMap
+
+
+def bench(pd, domainsMap, count):
+    domains = domainsMap.keys()
+    start = time.time()
+    for i in range(count):
+        if i % 2:
+            pd["MASTER_VERSION"] = str(i)
+        else:
+            # Toggle a domain status, like deactivating and activating
+            domUUID = domains[i % len(domains)]
+            domainsMap[domUUID] = ("Attached" if domainsMap[domUUID] ==
+                                   "Active" else "Active")
+            with pd.transaction():
+                pd["POOL_DOMAINS"] = ",".join(
+                    "%s:%s" % item for item in domainsMap.iteritems())
+                pd["POOL_SPM_LVER"] = str(i)
+    return time.time() - start
+
+
+op = optparse.OptionParser()
+op.add_option('--backend', dest='backend', type='choice',
+              choices=('file', 'vg'),
+              help='metadata backend: file or vg')
+op.add_option('--vg', dest='vg',
+              help='volume group for the vg backend')
+op.add_option('--dir', dest='dir',
+              help='directory for the file backend')
+op.add_option('--domains', dest='domains', type='int',
+              help='number of domains in the pool')
+op.add_option('-c', '--count', dest='count', type='int',
+              help='number of metadata updates')
+op.set_defaults(backend='file', dir='/var/tmp', domains=10, count=100)
+
+options, args = op.parse_args()
+
+createBackend = fileBackend if options.backend == 'file' else vgBackend
+
+metaRW, cleanup = createBackend(options)
+try:
+    pd = PersistentDict(metaRW)
+    metadata, domainsMap = createMetadata(options.domains)
+    pd.update(metadata)
+    elapsed = bench(pd, domainsMap, options.count)
+    print("%6d updates in %8.3f seconds, %8.2f updates/sec" %
+          (options.count, elapsed, options.count / elapsed))
+finally:
+    cleanup()
@@ -0,0 +1,140 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Measure the throughput of persisting SPM tasks in a directory per task, and
+in the task journal (irs:task_journal), and the time to load the persisted
+tasks when starting the SPM.
+
+Every task is persisted on every state change, like a copy or snapshot task
+with one job and one recovery. Use a directory on the storage you want to
+test, e.g. an NFS mount:
+
+    python task-bench.py --dir /mnt/nfs --tasks 500 --threads 10
+
+The default out of process implementation is the one configured in
+irs:oop_impl (ioprocess unless configured otherwise). ioprocess cannot append
+to the journal, so with ioprocess tasks are persisted in task directories in
+both modes.
+"""
+
+import optparse
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, "/usr/share/vdsm")
+
+from vdsm.config import config
+from storage import outOfProcess as oop
+from storage import task
+from storage import taskJournal
+from storage import taskManager
+
+STATES = (task.State.preparing, task.State.acquiring, task.State.queued,
+          task.State.running, task.State.finished)
+
+
+def runTask(store):
+    t = task.Task(None, name="bench")
+    t.setPersistence(store, cleanPolicy=task.TaskCleanType.manual)
+    t.jobs.append(task.Job("job", None))
+    t.recoveries.append(task.Recovery("recovery", "mod", "obj", "fn", []))
+    for state in STATES:
+        t.state.moveto(state, force=True)
+        t.persist()
+    return t
+
+
+def bench(store, count, threads):
+    lock = threading.Lock()
+    remaining = [count]
+    done = []
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            t = runTask(store)
+            with lock:
+                done.append(t)
+
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    start = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return time.time() - start, done
+
+
+def load(store):
+    mng = taskManager.TaskManager(tpSize=1)
+    try:
+        start = time.time()
+        mng.loadDumpedTasks(store)
+        return time.time() - start
+    finally:
+        mng.prepareForShutdown()
+
+
+op = optparse.OptionParser()
+op.add_option('--dir', dest='dir',
+              help='directory for the tasks store')
+op.add_option('--tasks', dest='tasks', type='int',
+              help='number of tasks')
+op.add_option('--threads', dest='threads', type='int',
+              help='number of concurrent threads')
+op.add_option('--impl', dest='impl', type='choice',
+              choices=(oop.RFH, oop.IOPROC),
+              help='out of process implementation (rfh, ioprocess)')
+op.set_defaults(dir='/var/tmp', tasks=100, threads=10,
+                impl=config.get('irs', 'oop_impl'))
+
+options, args = op.parse_args()
+
+# Falls back to rfh if ioprocess is not available
+oop.setDefaultImpl(options.impl)
+print("implementation: %s" % (oop.RFH if oop.appendsInPlace() else
+                              oop.IOPROC))
+
+for mode in ("dir", "journal"):
+    config.set('irs', 'task_journal', str(mode == "journal").lower())
+    if mode == "journal" and not taskJournal.enabled():
+        print("journal not used, tasks are persisted in task directories")
+    store = tempfile.mkdtemp(dir=options.dir)
+    try:
+        elapsed, tasks = bench(store, options.tasks, options.threads)
+        persists = options.tasks * len(STATES)
+        print("%-7s %6d tasks in %8.3f seconds, %8.2f tasks/sec, "
+              "%8.2f persists/sec" %
+              (mode, options.tasks, elapsed, options.tasks / elapsed,
+               persists / elapsed))
+        elapsed = load(store)
+        print("%-7s %6d tasks loaded in %8.3f seconds" %
+              (mode, options.tasks, elapsed))
+        for t in tasks:
+            t.clean()
+    finally:
+        shutil.rmtree(store)
@@ -21,8 +21,12 @@
 import os
 import re
 import signal
+import stat
+import threading
+import time
 
 from . import utils
+from .compat import json
 
 _qemuimg = utils.CommandPath("qemu-img",
                              "/usr/bin/qemu-img",)  # Fedora, EL6
@@ -113,6 +117,144 @@ def info(image, format=None):
     return info
 
 
+def info_chain(image, format=None, cache=True):
+    """
+    Return the info of all the images in the backing chain of image, starting
+    with image itself, inspecting the whole chain with one qemu-img run.
+
+    Every item is a dict like the one returned by info(), with the image path
+    in 'filename'. The result of the last inspected images is kept, and used
+    while none of the images in the chain was modified.
+
+    A cached chain is validated only with stat(), which may return stale
+    attributes on NFS. Use cache=False when the chain may have been modified
+    by another host.
+    """
+    chain = _chainCache.get(image, format) if cache else None
+    if chain is None:
+        started = time.time()
+        chain = _info_chain(image, format)
+        _chainCache.put(image, format, chain, started)
+    return [dict(item) for item in chain]
+
+
+def _info_chain(image, format):
+    cmd = [_qemuimg.cmd, "info", "--backing-chain", "--output=json"]
+
+    if format:
+        cmd.extend(("-f", format))
+
+    cmd.append(image)
+    rc, out, err = utils.execCmd(cmd, raw=True, deathSignal=signal.SIGKILL)
+
+    if rc != 0:
+        raise QImgError(rc, out, err)
+
+    try:
+        chain = [_parse_json_info(node) for node in json.loads(out)]
+    except (ValueError, KeyError, TypeError):
+        raise QImgError(rc, out, err, "unable to parse qemu-img info output")
+
+    if not chain:
+        raise QImgError(rc, out, err, "empty qemu-img info output")
+
+    return chain
+
+
+def _parse_json_info(node):
+    info = {
+        'filename': str(node['filename']),
+        'format': str(node['format']),
+        'virtualsize': int(node['virtual-size']),
+    }
+    if 'cluster-size' in node:
+        info['clustersize'] = int(node['cluster-size'])
+    if 'backing-filename' in node:
+        info['backingfile'] = str(node['backing-filename'])
+    return info
+
+
+class _ChainCache(object):
+    """
+    Keep the backing chains of the last inspected images, evicting the least
+    recently used chain when full.
+
+    A chain is used only if every image in it has the same path, inode, mtime
+    and size as when the chain was inspected. A chain is not kept if one of
+    its images is not a regular file, since writing a block device changes
+    neither its mtime nor its size, or if one of its images was modified less
+    than RACY_INTERVAL seconds before the chain was inspected, since a file
+    system with one second timestamps may not show another change in the
+    same second.
+    """
+
+    RACY_INTERVAL = 1.0
+
+    def __init__(self, size):
+        self._size = size
+        self._lock = threading.Lock()
+        self._entries = {}  # {(image, format): (stat keys, chain)}
+        self._order = []  # (image, format), least recently used first
+
+    def get(self, image, format):
+        key = (image, format)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._order.remove(key)
+            self._order.append(key)
+
+        statKeys, chain = entry
+        if self._statKeys(chain) != statKeys:
+            self._discard(key, entry)
+            return None
+        return chain
+
+    def put(self, image, format, chain, started):
+        statKeys = self._statKeys(chain, started - self.RACY_INTERVAL)
+        if statKeys is None:
+            return
+
+        key = (image, format)
+        with self._lock:
+            if key in self._entries:
+                self._order.remove(key)
+            elif len(self._entries) >= self._size:
+                del self._entries[self._order.pop(0)]
+            self._entries[key] = (statKeys, chain)
+            self._order.append(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            del self._order[:]
+
+    def _discard(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+                self._order.remove(key)
+
+    def _statKeys(self, chain, modifiedBefore=None):
+        keys = []
+        for item in chain:
+            path = item['filename']
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            if not stat.S_ISREG(st.st_mode):
+                return None
+            if modifiedBefore is not None and st.st_mtime > modifiedBefore:
+                return None
+            keys.append((path, st.st_ino, st.st_mtime, st.st_size))
+        return tuple(keys)
+
+
+_chainCache = _ChainCache(size=32)
+
+
 def create(image, size=None, format=None, backing=None, backingFormat=None):
     cmd = [_qemuimg.cmd, "create"]
     cwdPath = None
@@ -119,31 +119,25 @@ def _parse_args(args):
     return parser.parse_args(args=args[1:])
 
 
-def _get_volume_info(server, vol_uuid, img_uuid, sd_uuid, sp_uuid):
-    res = _call_server(server.getVolumeInfo, sd_uuid, sp_uuid, img_uuid,
-                       vol_uuid)
+def _get_volumes_info(server, sd_uuid, sp_uuid):
+    res = _call_server(server.getVolumesInfo, sd_uuid, sp_uuid)
     return res['info']
 
 
 def _get_volumes_chains(server, sd_uuid):
     sp_uuid = _get_sp_uuid(server)
     images_uuids = _get_all_images(server, sd_uuid)
+    volumes_info = _get_volumes_info(server, sd_uuid, sp_uuid)
 
     image_chains = {}  # {image_uuid -> vol_chain}
-    volumes_info = {}  # {vol_uuid-> vol_info}
+    images_volumes = _get_images_volumes(volumes_info)
 
     for img_uuid in images_uuids:
-        volumes = _get_volumes_for_image(server, img_uuid, sd_uuid, sp_uuid)
-
         # to avoid 'double parent' bug here we don't use a dictionary
         volumes_children = []  # [(parent_vol_uuid, child_vol_uuid),]
 
-        for vol_uuid in volumes:
-            vol_info = _get_volume_info(server, vol_uuid, img_uuid, sd_uuid,
-                                        sp_uuid)
-            volumes_info[vol_uuid] = vol_info
-
-            parent_uuid = vol_info['parent']
+        for vol_uuid in images_volumes[img_uuid]:
+            parent_uuid = volumes_info[vol_uuid]['parent']
             volumes_children.append((parent_uuid, vol_uuid))
 
         try:
@@ -159,9 +153,22 @@ def _get_all_images(server, sd_uuid):
     return res['imageslist']
 
 
-def _get_volumes_for_image(server, img_uuid, sd_uuid, sp_uuid):
-    res = _call_server(server.getVolumesList, sd_uuid, sp_uuid, img_uuid)
-    return res['uuidlist']
+def _get_images_volumes(volumes_info):
+    """
+    Return {image_uuid -> [vol_uuid]} for volumes_info {vol_uuid -> vol_info}.
+    Like the volumes listed for an image, the volumes of an image include the
+    template volume the image is based on.
+    """
+    images_volumes = defaultdict(list)
+    for vol_uuid, vol_info in volumes_info.iteritems():
+        img_uuid = vol_info.get('image')
+        if img_uuid is None:
+            continue  # invalid volume
+        images_volumes[img_uuid].append(vol_uuid)
+        parent_info = volumes_info.get(vol_info['parent'])
+        if parent_info is not None and parent_info.get('image') != img_uuid:
+            images_volumes[img_uuid].append(vol_info['parent'])
+    return images_volumes
 
 
 def _build_volume_chain(volumes_children):
@@ -19,6 +19,8 @@
 #
 
 import logging
+import threading
+
 from . import utils
 
 _UDEVADM = utils.CommandPath("udevadm", "/sbin/udevadm", "/usr/sbin/udevadm")
@@ -66,3 +68,79 @@ def _run_command(args):
     rc, out, err = utils.execCmd(cmd, raw=True)
     if rc != 0:
         raise Error(rc, out, err)
+
+
+class Monitor(object):
+    """
+    Listens to udev events using "udevadm monitor", calling callback with
+    the properties dict of every event processed by udev.
+
+    The monitor runs in a daemon thread until stopped. If udevadm dies, it
+    is restarted after a short delay, since listeners must not silently
+    miss events.
+    """
+    log = logging.getLogger("Udevadm.Monitor")
+
+    def __init__(self, callback, subsystem=None, restartDelay=5):
+        self._callback = callback
+        self._subsystem = subsystem
+        self._restartDelay = restartDelay
+        self._stopEvent = threading.Event()
+        self._proc = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name="udev-monitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopEvent.set()
+        proc = self._proc
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+
+    def _command(self):
+        cmd = [_UDEVADM.cmd, "monitor", "--udev", "--property"]
+        if self._subsystem:
+            cmd.append("--subsystem-match=%s" % self._subsystem)
+        return cmd
+
+    def _run(self):
+        while not self._stopEvent.isSet():
+            try:
+                self._proc = utils.execCmd(self._command(), sync=False)
+                self._proc.blocking = True
+                for event in parseEvents(self._proc.stdout):
+                    try:
+                        self._callback(event)
+                    except Exception:
+                        self.log.exception("Error handling event %s", event)
+            except Exception:
+                self.log.exception("Error monitoring udev events")
+            if not self._stopEvent.isSet():
+                self.log.warning("udevadm monitor terminated, restarting in "
+                                 "%s seconds", self._restartDelay)
+                self._stopEvent.wait(self._restartDelay)
+
+
+def parseEvents(lines):
+    """
+    Parse "udevadm monitor --property" output, yielding a dict of properties
+    for every event. Events are separated by an empty line; lines that are
+    not KEY=VALUE (e.g. event headers) are ignored.
+    """
+    event = {}
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line:
+            if event:
+                yield event
+                event = {}
+            continue
+        key, sep, value = line.partition("=")
+        if sep:
+            event[key] = value
+    if event:
+        yield event
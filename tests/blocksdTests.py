@@ -22,11 +22,15 @@
 import collections
 import os
 
-from monkeypatch import MonkeyPatch
+from monkeypatch import MonkeyPatch, MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
 
 from storage import blockSD
+from storage import blockVolume
 from storage import lvm
+from storage import misc
+from storage.persistentDict import PersistentDict
+from storage import volume
 from vdsm import constants
 
 # Make it easy to test the values we care about
@@ -84,3 +88,96 @@ class GetAllVolumesTests(TestCaseBase):
         sdName = "3386c6f2-926f-42c4-839c-38287fac8998"
         allVols = blockSD.getAllVolumes(sdName)
         self.assertEqual(len(allVols), 23)
+
+
+class FakeBlockStorageDomain(blockSD.BlockStorageDomain):
+
+    def __init__(self, sdUUID):
+        self.sdUUID = sdUUID
+        self.stat = None
+
+
+class FakeReadblocks(object):
+    """
+    Return the metadata of every slot, using the slot offset as the volume
+    size.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, name, ranges):
+        self.calls += 1
+        blocks = []
+        for offset, size in ranges:
+            slot = offset / blockVolume.VOLUME_METASIZE
+            blocks.append(["SIZE=%d" % slot,
+                           "LEGALITY=%s" % volume.LEGAL_VOL,
+                           "EOF"])
+        return blocks
+
+
+class GetVolumesInfoTests(TestCaseBase):
+
+    SD_NAME = "3386c6f2-926f-42c4-839c-38287fac8998"
+
+    readblocks = FakeReadblocks()
+
+    def setUp(self):
+        self.readblocks.calls = 0
+        self.dom = FakeBlockStorageDomain(self.SD_NAME)
+
+    @MonkeyPatch(lvm, 'getLV', fakeGetLV)
+    @MonkeyPatch(misc, 'readblocks', readblocks)
+    def test_domain(self):
+        res = self.dom.getVolumesInfo()
+        self.assertEqual(len(res), 23)
+        # Metadata slots of all the volumes read at once
+        self.assertEqual(self.readblocks.calls, 1)
+
+        info = res["0574c3f6-3d44-4cc7-98e3-6d90626dd95f"]
+        self.assertEqual(info["image"], "ae863f0d-0f24-41d4-b6ed-333c6634c7dc")
+        self.assertEqual(info["parent"], volume.BLANK_UUID)
+        self.assertEqual(info["capacity"], str(17 * volume.BLOCK_SIZE))
+        self.assertEqual(info["apparentsize"], "2147483648")
+        self.assertEqual(info["status"], "OK")
+
+    @MonkeyPatch(lvm, 'getLV', fakeGetLV)
+    @MonkeyPatch(misc, 'readblocks', readblocks)
+    def test_image(self):
+        res = self.dom.getVolumesInfo("ae863f0d-0f24-41d4-b6ed-333c6634c7dc")
+        self.assertEqual(sorted(res),
+                         ["0574c3f6-3d44-4cc7-98e3-6d90626dd95f",
+                          "3fc4fd44-6d75-4b48-aafc-d72c7bba10d9"])
+
+
+class FakeVGTags(object):
+
+    def __init__(self):
+        self.tags = set()
+
+    def getVG(self, vgName):
+        return collections.namedtuple("VG", ["tags"])(tuple(self.tags))
+
+    def invalidateVG(self, vgName):
+        pass
+
+    def changeVGTags(self, vgName, delTags=(), addTags=()):
+        self.tags.difference_update(delTags)
+        self.tags.update(addTags)
+
+
+class VGTagMetadataRWTests(TestCaseBase):
+
+    def test_stale_dict(self):
+        vg = FakeVGTags()
+        with MonkeyPatchScope([(lvm, "getVG", vg.getVG),
+                               (lvm, "invalidateVG", vg.invalidateVG),
+                               (lvm, "changeVGTags", vg.changeVGTags)]):
+            md1 = PersistentDict(blockSD.VGTagMetadataRW("vg"))
+            md2 = PersistentDict(blockSD.VGTagMetadataRW("vg"))
+            md1["a"] = "1"
+            md2["b"] = "2"
+            md1["a"] = "3"
+            md = PersistentDict(blockSD.VGTagMetadataRW("vg"))
+            self.assertEqual(md.copy(), {"a": "3"})
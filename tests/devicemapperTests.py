@@ -0,0 +1,177 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+import os
+import struct
+import threading
+
+from monkeypatch import MonkeyPatchScope
+from storage import devicemapper as dm
+from testlib import VdsmTestCase
+from testlib import namedTemporaryDir
+
+
+def targetsBuffer(targets):
+    """
+    Build the data returned by DM_TABLE_STATUS, like the kernel does.
+    """
+    data = ""
+    for start, targetType, status in targets:
+        offset = len(data) + dm.DM_TARGET_SPEC_SIZE + len(status) + 1
+        offset += -offset % 8
+        spec = struct.pack(dm.DM_TARGET_SPEC_FORMAT, start, 100, 0, offset,
+                           targetType)
+        data += spec + status + "\0"
+        data += "\0" * (offset - len(data))
+    return data
+
+
+def createFakeSysfs(root, devices):
+    """
+    Create a fake sysfs tree with multipath devices {uuid: [(devnum,
+    physdev)]}.
+    """
+    for i, (uuid, paths) in enumerate(sorted(devices.items())):
+        dmInfo = os.path.join(root, "block", "dm-%d" % i, "dm")
+        os.makedirs(dmInfo)
+        with open(os.path.join(dmInfo, "uuid"), "w") as f:
+            f.write(uuid + "\n")
+        for devnum, physdev in paths:
+            os.makedirs(os.path.join(root, "block", physdev))
+            devBlock = os.path.join(root, "dev", "block")
+            if not os.path.isdir(devBlock):
+                os.makedirs(devBlock)
+            os.symlink(os.path.join("..", "..", "block", physdev),
+                       os.path.join(devBlock, devnum))
+
+
+def multipathStatus(paths):
+    return ("2 0 0 0 1 1 A 0 %d 0 " % len(paths) +
+            " ".join("%s %s 0 0" % (devnum, state)
+                     for devnum, state in paths))
+
+
+class ParseTargetsTests(VdsmTestCase):
+
+    def test_single(self):
+        status = multipathStatus([("8:16", "A"), ("8:32", "F")])
+        data = targetsBuffer([(0, "multipath", status)])
+        self.assertEqual(dm._parseTargets(data, 1), [("multipath", status)])
+
+    def test_multiple(self):
+        data = targetsBuffer([(0, "linear", ""), (100, "multipath", "1 2"),
+                              (200, "linear", "")])
+        self.assertEqual(dm._parseTargets(data, 3), [("linear", ""),
+                                                     ("multipath", "1 2"),
+                                                     ("linear", "")])
+
+
+class GetPathsStatusTests(VdsmTestCase):
+
+    def test_paths_status(self):
+        devices = {
+            "mpath-guid-1": [("8:16", "sdb"), ("8:32", "sdc")],
+            "mpath-guid-2": [("8:48", "sdd")],
+            "LVM-not-multipath": [],
+        }
+        statuses = {
+            "mpath-guid-1": [("linear", ""),
+                             ("multipath", multipathStatus(
+                                 [("8:16", "A"), ("8:32", "F")]))],
+            "mpath-guid-2": [("multipath", multipathStatus(
+                [("8:48", "A")]))],
+        }
+
+        with namedTemporaryDir() as root:
+            createFakeSysfs(root, devices)
+            control = os.path.join(root, "control")
+            open(control, "w").close()
+            with MonkeyPatchScope([
+                (dm, "_SYS_BLOCK", os.path.join(root, "block")),
+                (dm, "_SYS_DEV_BLOCK", os.path.join(root, "dev", "block")),
+                (dm, "_DM_CONTROL", control),
+                (dm, "_tableStatus", lambda fd, uuid: statuses[uuid]),
+            ]):
+                res = dm._getPathsStatus()
+
+        self.assertEqual(res, {"sdb": "active", "sdc": "failed",
+                               "sdd": "active"})
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class PathsStatusCacheTests(VdsmTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = dm._PathsStatusCache(2, clock=self.clock)
+        self.updates = 0
+
+    def update(self):
+        self.updates += 1
+        return {"sdb": "active", "update": self.updates}
+
+    def test_cached(self):
+        self.cache.get(self.update)
+        self.clock.time = 1
+        self.assertEqual(self.cache.get(self.update)["update"], 1)
+
+    def test_expired(self):
+        self.cache.get(self.update)
+        self.clock.time = 2
+        self.assertEqual(self.cache.get(self.update)["update"], 2)
+
+    def test_error_not_cached(self):
+        def fail():
+            raise RuntimeError("supervdsm failed")
+        self.assertRaises(RuntimeError, self.cache.get, fail)
+        self.assertEqual(self.cache.get(self.update)["update"], 1)
+
+    def test_concurrent_callers_share_update(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slowUpdate():
+            started.set()
+            finish.wait()
+            return self.update()
+
+        results = []
+        first = threading.Thread(
+            target=lambda: results.append(self.cache.get(slowUpdate)))
+        first.start()
+        started.wait()
+        others = [threading.Thread(
+            target=lambda: results.append(self.cache.get(self.update)))
+            for i in range(4)]
+        for t in others:
+            t.start()
+        finish.set()
+        for t in [first] + others:
+            t.join()
+        self.assertEqual(self.updates, 1)
+        self.assertEqual([r["update"] for r in results], [1] * 5)
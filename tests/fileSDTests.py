@@ -20,14 +20,21 @@
 
 from __future__ import print_function
 import fnmatch
+import glob
 import os
+import shutil
+import stat
 import time
 import uuid
 
+from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import namedTemporaryDir
 
 from storage import fileSD
+from storage import remoteFileHandler
 from storage import sd
+from storage import volume
 
 
 class TestingFileStorageDomain(fileSD.FileStorageDomain):
@@ -37,7 +44,10 @@ class TestingFileStorageDomain(fileSD.FileStorageDomain):
     def __init__(self, uuid, mountpoint, oop):
         self.sdUUID = uuid
         self.mountpoint = mountpoint
+        self.domaindir = os.path.join(mountpoint, uuid)
         self._oop = oop
+        self._volumeIndex = fileSD.VolumeIndex(
+            os.path.join(mountpoint, uuid, sd.DOMAIN_IMAGES))
 
     @property
     def oop(self):
@@ -52,12 +62,21 @@ class FakeGlob(object):
     def glob(self, pattern):
         return fnmatch.filter(self.files, pattern)
 
+    def globStat(self, pattern):
+        # The directories containing the files, modified long ago
+        dirs = set(os.path.dirname(path) for path in self.files)
+        st = os.stat_result((stat.S_IFDIR | 0o755, 0, 0, 2, 0, 0, 0, 0, 0, 0))
+        return [(path, st) for path in fnmatch.filter(dirs, pattern)]
+
 
 class FakeOOP(object):
 
     def __init__(self, glob=None):
         self.glob = glob
 
+    def globStat(self, pattern):
+        return self.glob.globStat(pattern)
+
 
 class GetAllVolumesTests(TestCaseBase):
 
@@ -156,3 +175,272 @@ class GetAllVolumesTests(TestCaseBase):
         # This takes 0.065 seconds on my laptop, 1 second should be enough even
         # on overloaded jenkins slave.
         self.assertTrue(elapsed < 1.0, "Elapsed time: %f seconds" % elapsed)
+
+
+class CountingGlob(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def glob(self, pattern):
+        self.calls += 1
+        return glob.glob(pattern)
+
+
+class CountingOOP(object):
+
+    def __init__(self):
+        self.glob = CountingGlob()
+        self.globStatCalls = 0
+
+    def globStat(self, pattern):
+        self.globStatCalls += 1
+        return remoteFileHandler.globStat(pattern)
+
+
+class VolumeIndexTests(TestCaseBase):
+
+    def setUp(self):
+        self.oop = CountingOOP()
+
+    def createImage(self, imagesDir, volUUIDs, mtime=None):
+        imgUUID = str(uuid.uuid4())
+        imgDir = os.path.join(imagesDir, imgUUID)
+        os.mkdir(imgDir)
+        for volUUID in volUUIDs:
+            self.createVolume(imgDir, volUUID, mtime)
+        return imgUUID
+
+    def createVolume(self, imgDir, volUUID, mtime=None):
+        for ext in ("", ".meta", ".lease"):
+            open(os.path.join(imgDir, volUUID + ext), "w").close()
+        if mtime is None:
+            # Modified long ago, so the directory is not listed again
+            mtime = time.time() - 60
+        os.utime(imgDir, (mtime, mtime))
+
+    def test_scan(self):
+        with namedTemporaryDir() as imagesDir:
+            img1 = self.createImage(imagesDir, ["vol-1", "vol-2"])
+            img2 = self.createImage(imagesDir, [])
+            index = fileSD.VolumeIndex(imagesDir)
+            images = index.images(self.oop)
+            self.assertEqual(sorted(images[img1]), ["vol-1", "vol-2"])
+            self.assertEqual(images[img2], ())
+            self.assertEqual(len(images), 2)
+            # All directories listed in one call
+            self.assertEqual(self.oop.glob.calls, 1)
+
+    def test_unmodified_dirs_not_listed(self):
+        with namedTemporaryDir() as imagesDir:
+            img1 = self.createImage(imagesDir, ["vol-1"])
+            index = fileSD.VolumeIndex(imagesDir)
+            index.images(self.oop)
+            self.assertEqual(index.images(self.oop), {img1: ("vol-1",)})
+            self.assertEqual(self.oop.glob.calls, 1)
+
+    def test_modified_dir_listed(self):
+        with namedTemporaryDir() as imagesDir:
+            imgUUIDs = [self.createImage(imagesDir, ["vol-%d" % i])
+                        for i in range(20)]
+            index = fileSD.VolumeIndex(imagesDir)
+            index.images(self.oop)
+            self.createVolume(os.path.join(imagesDir, imgUUIDs[0]), "new",
+                              time.time() - 30)
+            images = index.images(self.oop)
+            self.assertEqual(sorted(images[imgUUIDs[0]]), ["new", "vol-0"])
+            self.assertEqual(images[imgUUIDs[1]], ("vol-1",))
+            # Only the modified directory was listed
+            self.assertEqual(self.oop.glob.calls, 2)
+
+    def test_removed_image(self):
+        with namedTemporaryDir() as imagesDir:
+            img1 = self.createImage(imagesDir, ["vol-1"])
+            img2 = self.createImage(imagesDir, ["vol-2"])
+            index = fileSD.VolumeIndex(imagesDir)
+            index.images(self.oop)
+            shutil.rmtree(os.path.join(imagesDir, img2))
+            self.assertEqual(index.images(self.oop), {img1: ("vol-1",)})
+
+    def test_recently_modified_dir_listed_again(self):
+        with namedTemporaryDir() as imagesDir:
+            self.createImage(imagesDir, ["vol-1"], mtime=time.time())
+            index = fileSD.VolumeIndex(imagesDir)
+            index.images(self.oop)
+            index.images(self.oop)
+            self.assertEqual(self.oop.glob.calls, 2)
+
+    def test_no_bulk_operations(self):
+        with namedTemporaryDir() as imagesDir, MonkeyPatchScope([
+                (fileSD.oop, "_oopImpl", fileSD.oop.IOPROC)]):
+            img1 = self.createImage(imagesDir, ["vol-1", "vol-2"])
+            self.createImage(imagesDir, [])
+            index = fileSD.VolumeIndex(imagesDir)
+            images = index.images(self.oop)
+            self.assertEqual(sorted(images[img1]), ["vol-1", "vol-2"])
+            # Image directories without volumes are not found
+            self.assertEqual(len(images), 1)
+            # A single glob on every scan, without stat
+            index.images(self.oop)
+            self.assertEqual(self.oop.glob.calls, 2)
+            self.assertEqual(self.oop.globStatCalls, 0)
+
+
+class FakeWatcher(object):
+
+    def __init__(self):
+        self.mountsChanged = False
+
+    def changed(self):
+        changed = self.mountsChanged
+        self.mountsChanged = False
+        return changed
+
+
+class DomainIndexTests(TestCaseBase):
+
+    def setUp(self):
+        self.oop = FakeOOP(CountingGlob())
+        self.oop.os = os
+        self.index = fileSD.DomainIndex()
+        self.index._watcher = self.watcher = FakeWatcher()
+
+    def scan(self, mntList):
+        with MonkeyPatchScope([(fileSD.oop, "getProcessPool",
+                                lambda name: self.oop)]):
+            return sorted(self.index.scan(mntList))
+
+    def createDomain(self, mountpoint):
+        sdUUID = str(uuid.uuid4())
+        domainPath = os.path.join(mountpoint, sdUUID)
+        os.makedirs(os.path.join(domainPath, sd.DOMAIN_META_DATA))
+        return sdUUID, domainPath
+
+    def test_scan(self):
+        with namedTemporaryDir() as mnt1, namedTemporaryDir() as mnt2:
+            dom1 = self.createDomain(mnt1)
+            self.assertEqual(self.scan([mnt1, mnt2]), [dom1])
+            self.assertEqual(self.oop.glob.calls, 2)
+
+    def test_unmodified_mounts_not_scanned(self):
+        with namedTemporaryDir() as mnt1, namedTemporaryDir() as mnt2:
+            dom1 = self.createDomain(mnt1)
+            self.scan([mnt1, mnt2])
+            self.assertEqual(self.scan([mnt1, mnt2]), [dom1])
+            self.assertEqual(self.oop.glob.calls, 2)
+
+    def test_domain_created(self):
+        with namedTemporaryDir() as mnt1, namedTemporaryDir() as mnt2:
+            dom1 = self.createDomain(mnt1)
+            self.scan([mnt1, mnt2])
+            dom2 = self.createDomain(mnt2)
+            self.assertEqual(self.scan([mnt1, mnt2]), sorted([dom1, dom2]))
+            self.assertEqual(self.oop.glob.calls, 3)
+
+    def test_domain_removed(self):
+        with namedTemporaryDir() as mnt1:
+            sdUUID, domainPath = self.createDomain(mnt1)
+            self.scan([mnt1])
+            os.rename(domainPath, os.path.join(mnt1, "_remove_me"))
+            self.assertEqual(self.scan([mnt1]), [])
+
+    def test_mounts_changed(self):
+        with namedTemporaryDir() as mnt1:
+            self.createDomain(mnt1)
+            self.scan([mnt1])
+            self.watcher.mountsChanged = True
+            self.scan([mnt1])
+            self.assertEqual(self.oop.glob.calls, 2)
+
+
+class LocalOOP(object):
+    """
+    Run the bulk file operations in this process, using buffered reads.
+    """
+
+    def __init__(self):
+        self.glob = glob
+        self.calls = []
+
+    def globStat(self, pattern):
+        return remoteFileHandler.globStat(pattern)
+
+    def statMany(self, paths):
+        self.calls.append("statMany")
+        return remoteFileHandler.statMany(paths)
+
+    def readLinesMany(self, paths, direct=False):
+        self.calls.append("readLinesMany")
+        return remoteFileHandler.readLinesMany(paths)
+
+
+class GetVolumesInfoTests(TestCaseBase):
+
+    SD_UUID = str(uuid.uuid4())
+
+    def setUp(self):
+        self.oop = LocalOOP()
+
+    def createVolume(self, mountpoint, imgUUID, volUUID, parent, **meta):
+        imgDir = os.path.join(mountpoint, self.SD_UUID, sd.DOMAIN_IMAGES,
+                              imgUUID)
+        if not os.path.exists(imgDir):
+            os.makedirs(imgDir)
+        with open(os.path.join(imgDir, volUUID), "w") as f:
+            f.truncate(1024)
+        md = {volume.IMAGE: imgUUID, volume.PUUID: parent,
+              volume.SIZE: "2", volume.LEGALITY: volume.LEGAL_VOL}
+        md.update(meta)
+        with open(os.path.join(imgDir, volUUID + ".meta"), "w") as f:
+            for item in md.iteritems():
+                f.write("%s=%s\n" % item)
+            f.write("EOF\n")
+        # Modified long ago, so the directory is not listed again
+        mtime = time.time() - 60
+        os.utime(imgDir, (mtime, mtime))
+
+    def test_domain(self):
+        with namedTemporaryDir() as mnt:
+            self.createVolume(mnt, "image-1", "volume-1", sd.BLANK_UUID)
+            self.createVolume(mnt, "image-1", "volume-2", "volume-1")
+            self.createVolume(mnt, "image-2", "volume-3", sd.BLANK_UUID)
+            dom = TestingFileStorageDomain(self.SD_UUID, mnt, self.oop)
+            res = dom.getVolumesInfo()
+            self.assertEqual(sorted(res), ["volume-1", "volume-2",
+                                           "volume-3"])
+            info = res["volume-2"]
+            self.assertEqual(info["image"], "image-1")
+            self.assertEqual(info["parent"], "volume-1")
+            self.assertEqual(info["capacity"], str(2 * volume.BLOCK_SIZE))
+            self.assertEqual(info["apparentsize"], "1024")
+            self.assertEqual(info["status"], "OK")
+            # All the volumes are read at once
+            self.assertEqual(self.oop.calls, ["statMany", "readLinesMany"])
+
+    def test_image(self):
+        with namedTemporaryDir() as mnt:
+            self.createVolume(mnt, "image-1", "volume-1", sd.BLANK_UUID)
+            self.createVolume(mnt, "image-2", "volume-2", sd.BLANK_UUID)
+            dom = TestingFileStorageDomain(self.SD_UUID, mnt, self.oop)
+            self.assertEqual(list(dom.getVolumesInfo("image-2")),
+                             ["volume-2"])
+
+    def test_invalid_metadata(self):
+        with namedTemporaryDir() as mnt:
+            self.createVolume(mnt, "image-1", "volume-1", sd.BLANK_UUID)
+            metaPath = os.path.join(mnt, self.SD_UUID, sd.DOMAIN_IMAGES,
+                                    "image-1", "volume-1.meta")
+            with open(metaPath, "w") as f:
+                f.write("SIZE=2\nEOF\n")
+            dom = TestingFileStorageDomain(self.SD_UUID, mnt, self.oop)
+            info = dom.getVolumesInfo()["volume-1"]
+            self.assertEqual(info["status"], "INVALID")
+            self.assertEqual(info["truesize"], "0")
+
+    def test_illegal(self):
+        with namedTemporaryDir() as mnt:
+            self.createVolume(mnt, "image-1", "volume-1", sd.BLANK_UUID,
+                              LEGALITY=volume.ILLEGAL_VOL)
+            dom = TestingFileStorageDomain(self.SD_UUID, mnt, self.oop)
+            info = dom.getVolumesInfo()["volume-1"]
+            self.assertEqual(info["status"], volume.ILLEGAL_VOL)
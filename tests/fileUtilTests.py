@@ -66,6 +66,31 @@ class DirectFileTests(TestCaseBase):
                 f.seek(512)
                 self.assertEquals(f.read(), data[512:])
 
+    def testPread(self):
+        data = "a" * 512 + "b" * 512 + "c" * 100
+        with temporaryPath(data=data) as srcPath:
+            with fileUtils.open_ex(srcPath, "dr") as f:
+                self.assertEquals(f.pread(512, 512), "b" * 512)
+                self.assertEquals(f.pread(1024, 512), data[512:])
+                self.assertEquals(f.tell(), 0)
+                self.assertRaises(ValueError, f.pread, 512, 100)
+
+    def testReadRanges(self):
+        data = "".join(chr(ord("a") + i) * 512 for i in range(8))
+        ranges = [(3584, 512), (0, 1024), (512, 512), (2048, 512)]
+        with temporaryPath(data=data) as srcPath:
+            with fileUtils.open_ex(srcPath, "dr") as f:
+                self.assertEquals(f.readRanges(ranges),
+                                  [data[offset:offset + size]
+                                   for offset, size in ranges])
+
+    def testMergeRanges(self):
+        far = fileUtils.MAX_READ_GAP + 4096
+        ranges = [(far, 512), (512, 512), (0, 512)]
+        self.assertEquals(fileUtils._mergeRanges(ranges),
+                          [(0, 1024, [(2, 0, 512), (1, 512, 512)]),
+                           (far, far + 512, [(0, far, 512)])])
+
     def testWrite(self):
         data = """In ut non platea egestas, quisque magnis nunc nostra ac etiam
         suscipit nec integer sociosqu. Fermentum. Ante orci luctus, ipsum
@@ -19,9 +19,19 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import sys
+import threading
+import time
+
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import temporaryPath
+from monkeypatch import MonkeyPatchScope
 
+from vdsm import cmdutils
+from vdsm import constants
 import storage.lvm as lvm
+import storage.lvmshell as lvmshell
+import storage.misc as misc
 
 
 class LvmTests(TestCaseBase):
@@ -37,3 +47,419 @@ class LvmTests(TestCaseBase):
                           "\\\\x22\\\\x28|\', \'r|.*|\' ]"
                           )
         self.assertEqual(expectedFilter, filter)
+
+
+class FakeLVMCache(lvm.LVMCache):
+
+    def __init__(self, incremental=True):
+        super(FakeLVMCache, self).__init__(incremental)
+        self.seqno = 1
+        self.lvNames = ["lv1", "lv2", "lv3"]
+        self.commands = []
+
+    def _vgLine(self):
+        return lvm.SEPARATOR.join((
+            "vg-uuid", "vg", "wz--n-", "1073741824", "536870912",
+            "134217728", "8", "4", "", "134217728", "67108864",
+            str(len(self.lvNames)), "1", "/dev/mapper/pv1", str(self.seqno)))
+
+    def _lvLine(self, name):
+        return lvm.SEPARATOR.join((
+            "%s-uuid" % name, name, "vg", "-wi-------", "134217728", "0",
+            "/dev/mapper/pv1(0)", ""))
+
+    def cmd(self, cmd, devices=tuple()):
+        self.commands.append(tuple(cmd))
+        if cmd[0] == "pvs":
+            return 0, [], []
+        if cmd[0] == "vgs":
+            return 0, [self._vgLine()], []
+        if cmd[0] == "lvs":
+            args = list(cmd[len(lvm.LVS_CMD):])
+            if not args or args == ["vg"]:
+                names = self.lvNames
+            else:
+                names = [arg.split("/")[1] for arg in args]
+            return 0, [self._lvLine(name) for name in names], []
+        raise AssertionError("Unexpected command: %s" % (cmd,))
+
+    def lvsCommands(self):
+        return [list(cmd[len(lvm.LVS_CMD):]) for cmd in self.commands
+                if cmd[0] == "lvs"]
+
+
+class LVMCacheIncrementalTests(TestCaseBase):
+
+    def setUp(self):
+        self.cache = FakeLVMCache()
+        self.cache.bootstrap()
+        del self.cache.commands[:]
+
+    def test_invalidate_vg_unchanged_seqno(self):
+        self.cache._invalidatevgsSeqno("vg")
+        lvs = self.cache.getLv("vg")
+        self.assertEqual(sorted(lv.name for lv in lvs), ["lv1", "lv2", "lv3"])
+        self.assertEqual(self.cache.lvsCommands(), [])
+
+    def test_invalidate_vg_changed_seqno(self):
+        self.cache.seqno += 1
+        self.cache.lvNames.append("lv4")
+        self.cache._invalidatevgsSeqno("vg")
+        lvs = self.cache.getLv("vg")
+        self.assertEqual(sorted(lv.name for lv in lvs),
+                         ["lv1", "lv2", "lv3", "lv4"])
+        self.assertEqual(self.cache.lvsCommands(), [["vg"]])
+
+    def test_local_change_reloads_changed_lv_only(self):
+        self.cache.seqno += 1
+        self.cache._invalidatevgs("vg")
+        self.cache._invalidateLvsMetadata("vg", "lv2")
+        self.cache.getLv("vg", "lv1")
+        self.cache.getLv("vg", "lv2")
+        self.assertEqual(self.cache.lvsCommands(), [["vg/lv2"]])
+
+    def test_udev_event_invalidates_lv(self):
+        self.cache.handleUdevEvent({"ACTION": "change",
+                                    "DM_VG_NAME": "vg",
+                                    "DM_LV_NAME": "lv3"})
+        self.assertIsInstance(self.cache._lvs[("vg", "lv3")], lvm.Stub)
+        self.assertNotIsInstance(self.cache._lvs[("vg", "lv1")], lvm.Stub)
+        self.cache.getLv("vg")
+        self.assertEqual(self.cache.lvsCommands(), [["vg/lv3"]])
+
+    def test_udev_event_ignores_unknown_devices(self):
+        self.cache.handleUdevEvent({"ACTION": "change",
+                                    "DEVNAME": "/dev/sda"})
+        self.cache.handleUdevEvent({"ACTION": "add",
+                                    "DM_VG_NAME": "other",
+                                    "DM_LV_NAME": "lv1"})
+        self.assertNotIn(("other", "lv1"), self.cache._lvs)
+
+    def test_stats(self):
+        self.cache.getLv("vg", "lv1")
+        self.cache._invalidatelvs("vg", "lv1")
+        self.cache.getLv("vg", "lv1")
+        stats = self.cache.stats()
+        self.assertEqual(stats["lv"]["hits"], 1)
+        self.assertEqual(stats["lv"]["misses"], 1)
+        # bootstrap reload and the reload of lv1
+        self.assertEqual(stats["lv"]["reloads"], 2)
+
+    def test_lvs_generation_local_change(self):
+        gen = self.cache.lvsGeneration("vg")
+        self.cache.seqno += 1
+        self.cache._invalidatevgs("vg")
+        self.cache._invalidateLvsMetadata("vg", "lv2")
+        self.assertEqual(self.cache.lvsGeneration("vg"), gen)
+
+    def test_lvs_generation_remote_change(self):
+        gen = self.cache.lvsGeneration("vg")
+        self.cache.seqno += 1
+        self.cache._invalidatevgsSeqno("vg")
+        self.assertGreater(self.cache.lvsGeneration("vg"), gen)
+
+    def test_lvs_generation_lvs_removed(self):
+        gen = self.cache.lvsGeneration("vg")
+        self.cache._lvsRemoved("vg")
+        self.assertGreater(self.cache.lvsGeneration("vg"), gen)
+
+    def test_lvs_generation_flush(self):
+        gen = self.cache.lvsGeneration("vg")
+        self.cache.flush()
+        self.assertGreater(self.cache.lvsGeneration("vg"), gen)
+
+
+class BlockingLVMCache(FakeLVMCache):
+    """
+    Block lvm commands on the "hung" VG until released.
+    """
+
+    def __init__(self):
+        super(BlockingLVMCache, self).__init__()
+        self.entered = threading.Event()
+        self.released = threading.Event()
+
+    def cmd(self, cmd, devices=tuple()):
+        if "hung" in cmd:
+            self.entered.set()
+            self.released.wait()
+        return super(BlockingLVMCache, self).cmd(cmd, devices)
+
+
+class LVMCacheLockingTests(TestCaseBase):
+
+    def setUp(self):
+        self.cache = BlockingLVMCache()
+        self.cache.bootstrap()
+
+    def tearDown(self):
+        self.cache.released.set()
+
+    def start(self, func, *args):
+        t = threading.Thread(target=func, args=args)
+        t.daemon = True
+        t.start()
+        self.assertTrue(self.cache.entered.wait(2))
+        return t
+
+    def test_hung_vg_does_not_block_other_vgs(self):
+        t = self.start(self.cache.getVg, "hung")
+        self.cache._invalidatevgs("vg")
+        self.assertEqual(self.cache.getVg("vg").name, "vg")
+        self.cache.released.set()
+        t.join()
+
+    def test_invalidate_during_reload(self):
+        self.cache.seqno += 1
+        self.cache._invalidatevgs("vg")
+        result = []
+        t = self.start(lambda: result.append(self.cache._reloadvgs(
+            ["hung", "vg"])))
+        self.cache._invalidatevgs("vg")
+        self.cache.released.set()
+        t.join()
+        # The caller gets the reloaded VG, but the cache keeps the stub
+        self.assertEqual(result[0]["vg"].vg_seqno, str(self.cache.seqno))
+        self.assertTrue(isinstance(self.cache._vgs["vg"], lvm.Stub))
+
+    def test_lock_stats(self):
+        self.cache.getLv("vg")
+        self.cache._invalidatevgs("vg")
+        self.cache.getVg("vg")
+        locks = self.cache.stats()["locks"]
+        self.assertEqual(locks["vg"]["acquired"], 1)
+        self.assertNotIn("hung", locks)
+
+
+FAKE_LVM_SHELL = """
+import json
+import sys
+
+lastRc = 1
+sys.stdout.write("lvm> ")
+sys.stdout.flush()
+for line in iter(sys.stdin.readline, ""):
+    args = line.split()
+    if args[0] == "lastlog":
+        status = {"log_type": "status", "log_ret_code": str(lastRc)}
+        sys.stdout.write(json.dumps({"log": [status]}))
+    elif args[0] == "fail":
+        lastRc = 5
+    elif args[0] == "warn":
+        sys.stderr.write("warning\\n")
+        sys.stderr.flush()
+        lastRc = 1
+    else:
+        sys.stdout.write("ran: %s\\n" % " ".join(args))
+        lastRc = 1
+    sys.stdout.write("lvm> ")
+    sys.stdout.flush()
+"""
+
+
+class LVMShellTests(TestCaseBase):
+
+    def test_quote_plain(self):
+        self.assertEqual(lvmshell.quoteArg("vg/lv"), "vg/lv")
+
+    def test_quote_double_quotes(self):
+        self.assertEqual(lvmshell.quoteArg('a "b"'), '\'a "b"\'')
+
+    def test_quote_single_quotes(self):
+        self.assertEqual(lvmshell.quoteArg("a 'b'"), '"a \'b\'"')
+
+    def test_quote_both_quotes(self):
+        self.assertRaises(lvmshell.QuoteError, lvmshell.quoteArg,
+                          '\'a\' "b"')
+
+    def test_lastlog_success(self):
+        out = '{"log": [{"log_type": "status", "log_ret_code": "1"}]}'
+        self.assertEqual(lvmshell.parseLastlog(out), 0)
+
+    def test_lastlog_no_status(self):
+        self.assertEqual(lvmshell.parseLastlog('{"log": []}'), 0)
+
+    def test_lastlog_failure(self):
+        out = ('  {\n  "log": [\n'
+               '  {"log_type": "error", "log_ret_code": "0"},\n'
+               '  {"log_type": "status", "log_ret_code": "5"}\n  ]\n  }\n')
+        self.assertEqual(lvmshell.parseLastlog(out), 5)
+
+    def test_lastlog_invalid(self):
+        self.assertRaises(lvmshell.Error, lvmshell.parseLastlog,
+                          "No such command 'lastlog'")
+
+    def test_pool(self):
+        script = "#!%s\n%s" % (sys.executable, FAKE_LVM_SHELL)
+        with temporaryPath(perms=0o755, data=script) as fakeLvm:
+            with MonkeyPatchScope([(constants, "EXT_LVM", fakeLvm),
+                                   (cmdutils, "sudo", lambda cmd: cmd)]):
+                pool = lvmshell.ShellPool(2, 10)
+                try:
+                    rc, out, err = pool.run(["lvs", "--config", "a 'b'"])
+                    self.assertEqual(rc, 0)
+                    self.assertEqual(out, ['ran: lvs --config "a \'b\'"'])
+                    rc, out, err = pool.run(["fail"])
+                    self.assertEqual(rc, 5)
+                    self.assertEqual(out, [])
+                finally:
+                    pool.close()
+
+    def test_stderr(self):
+        script = "#!%s\n%s" % (sys.executable, FAKE_LVM_SHELL)
+        with temporaryPath(perms=0o755, data=script) as fakeLvm:
+            with MonkeyPatchScope([(constants, "EXT_LVM", fakeLvm),
+                                   (cmdutils, "sudo", lambda cmd: cmd)]):
+                pool = lvmshell.ShellPool(1, 10)
+                try:
+                    for i in range(10):
+                        rc, out, err = pool.run(["warn"])
+                        self.assertEqual(err, ["warning"])
+                        rc, out, err = pool.run(["lvs"])
+                        self.assertEqual(err, [])
+                finally:
+                    pool.close()
+
+    def test_pool_busy(self):
+        class FakeShell(object):
+            pid = 0
+
+            def __init__(self, timeout):
+                pass
+
+            def run(self, args, timeout):
+                started.set()
+                release.wait()
+                return 0, [], []
+
+            def stop(self):
+                pass
+
+        started = threading.Event()
+        release = threading.Event()
+        with MonkeyPatchScope([(lvmshell, "Shell", FakeShell)]):
+            pool = lvmshell.ShellPool(1, 10)
+            t = threading.Thread(target=pool.run, args=(["lvs"],))
+            t.start()
+            try:
+                started.wait()
+                self.assertRaises(lvmshell.Busy, pool.run, ["lvs"])
+            finally:
+                release.set()
+                t.join()
+            self.assertEqual(pool.run(["lvs"]), (0, [], []))
+
+
+class FakeShellPool(object):
+
+    def __init__(self, error=None):
+        self.error = error
+        self.commands = []
+
+    def run(self, args):
+        self.commands.append(args)
+        if self.error:
+            raise self.error
+        return 0, [], []
+
+
+class LVMCacheShellTests(TestCaseBase):
+
+    def setUp(self):
+        self.cache = lvm.LVMCache()
+        self.cache._addExtraCfg = lambda cmd, devices=(): (
+            ("lvm",) + tuple(cmd))
+        self.execCommands = []
+
+    def execCmd(self, cmd, sudo=False):
+        self.execCommands.append(cmd)
+        return 0, [], []
+
+    def test_config_quotes(self):
+        pool = self.cache._shellPool = FakeShellPool()
+        conf = lvm._buildConfig(["/dev/mapper/a\\x20b"])
+        self.cache._run(("lvm", "lvs", "--config", conf))
+        shellConf = pool.commands[0][2]
+        self.assertIn("preferred_names = ['^/dev/mapper/']", shellConf)
+        # Single quoted strings are not modified
+        self.assertIn("'a|/dev/mapper/a\\\\x20b|'", shellConf)
+
+    def test_config_cannot_quote(self):
+        self.cache._shellPool = lvmshell.ShellPool(1, 10)
+        cmd = ("lvm", "lvs", "--config", "a = ['x'] b = [\"\\\\\"]")
+        with MonkeyPatchScope([(misc, "execCmd", self.execCmd)]):
+            self.assertEqual(self.cache._run(cmd), (0, [], []))
+        self.assertEqual(self.execCommands, [cmd])
+
+    def test_shell_busy(self):
+        self.cache._shellPool = FakeShellPool(lvmshell.Busy())
+        with MonkeyPatchScope([(misc, "execCmd", self.execCmd)]):
+            self.assertEqual(self.cache.cmd(("lvs",)), (0, [], []))
+        self.assertEqual(self.execCommands, [("lvm", "lvs")])
+
+    def test_shell_failure_retries_without_shell(self):
+        pool = self.cache._shellPool = FakeShellPool(lvmshell.Timeout())
+        with MonkeyPatchScope([(misc, "execCmd", self.execCmd)]):
+            self.assertEqual(self.cache.cmd(("lvs",)), (0, [], []))
+        self.assertEqual(len(pool.commands), 1)
+        self.assertEqual(self.execCommands, [("lvm", "lvs")])
+
+
+class LVChangeBatcherTests(TestCaseBase):
+
+    def setUp(self):
+        self.batcher = lvm.LVChangeBatcher()
+        self.calls = []
+        self.release = threading.Event()
+        self.rc = 0
+
+    def func(self, lvs):
+        self.calls.append(list(lvs))
+        self.release.wait()
+        return self.rc, [], []
+
+    def run_concurrently(self, lvs_list):
+        results = {}
+
+        def run(lvs):
+            results[lvs] = self.batcher.run(("vg", "--available", "y"),
+                                            [lvs], self.func)
+
+        first = threading.Thread(target=run, args=(lvs_list[0],))
+        first.start()
+        # Wait until the first command is running
+        while not self.calls:
+            time.sleep(0.01)
+        threads = [threading.Thread(target=run, args=(lvs,))
+                   for lvs in lvs_list[1:]]
+        for t in threads:
+            t.start()
+        # Let the other commands join the batch
+        time.sleep(0.2)
+        self.release.set()
+        for t in [first] + threads:
+            t.join()
+        return results
+
+    def test_single(self):
+        self.release.set()
+        res = self.batcher.run(("vg", "--available", "y"), ["lv1"],
+                               self.func)
+        self.assertEqual(res, (0, [], []))
+        self.assertEqual(self.calls, [["lv1"]])
+
+    def test_batch(self):
+        results = self.run_concurrently(["lv1", "lv2", "lv3"])
+        self.assertEqual(self.calls[0], ["lv1"])
+        self.assertEqual(sorted(self.calls[1]), ["lv2", "lv3"])
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(sorted(results), ["lv1", "lv2", "lv3"])
+        self.assertTrue(all(res[0] == 0 for res in results.values()))
+
+    def test_batch_failure_retries_each_caller(self):
+        self.rc = 5
+        results = self.run_concurrently(["lv1", "lv2", "lv3"])
+        # The failed batch is retried by each of its callers
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(sorted(self.calls[2:]), [["lv2"], ["lv3"]])
+        self.assertEqual(results["lv2"][0], 5)
@@ -99,6 +99,128 @@ class MountTests(TestCaseBase):
                 m.umount()
 
 
+class MountInfoWatcherTests(TestCaseBase):
+
+    def testNotChanged(self):
+        watcher = mount.MountInfoWatcher()
+        try:
+            self.assertFalse(watcher.changed())
+        finally:
+            watcher.close()
+
+    def testChanged(self):
+        checkSudo(["mount", "-t", "tmpfs", "tmpfs", "target"])
+        checkSudo(["umount", "target"])
+        watcher = mount.MountInfoWatcher()
+        try:
+            with namedTemporaryDir() as mpath:
+                m = mount.Mount("tmpfs", mpath)
+                m.mount(vfstype="tmpfs")
+                try:
+                    self.assertTrue(watcher.changed())
+                    self.assertFalse(watcher.changed())
+                finally:
+                    m.umount()
+            self.assertTrue(watcher.changed())
+        finally:
+            watcher.close()
+
+
+class FakeWatcher(object):
+    """
+    Report a mount table change on every check, unless set to False.
+    """
+
+    def __init__(self):
+        self.mountsChanged = True
+
+    def changed(self):
+        return self.mountsChanged
+
+    def close(self):
+        pass
+
+
+class MountTableTests(TestCaseBase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.mounts = os.path.join(self.tmpdir, "mounts")
+        self.writeMounts([("server:/export", "/rhev/data-center/mnt/a"),
+                          ("/dev/sdb1", "/mnt/b"),
+                          ("/dev/sdb1", "/mnt/c")])
+        self.watcher = FakeWatcher()
+        self.table = mount.MountTable(self.watcher)
+        self.patch = monkeypatch.Patch([
+            (mount, '_PROC_MOUNTS_PATH', self.mounts),
+            (mount, '_mountTable', self.table)])
+        self.patch.apply()
+
+    def tearDown(self):
+        self.patch.revert()
+        shutil.rmtree(self.tmpdir)
+
+    def writeMounts(self, mounts):
+        with open(self.mounts, "w") as f:
+            for spec, target in mounts:
+                f.write("%s %s ext4 rw 0 0\n" % (spec, target))
+
+    def testLookupTarget(self):
+        m = mount.getMountFromTarget("/rhev/data-center/mnt/a/")
+        self.assertEqual(m, mount.Mount("server:/export",
+                                        "/rhev/data-center/mnt/a"))
+        self.assertTrue(m.isMounted())
+        self.assertFalse(mount.isMounted("/mnt/missing"))
+
+    def testLookupDevice(self):
+        self.assertEqual(mount.getMountFromDevice("/dev/sdb1"),
+                         mount.Mount("/dev/sdb1", "/mnt/b"))
+        records = self.table.lookupDevice("/dev/sdb1")
+        self.assertEqual([r.fs_file for r in records], ["/mnt/b", "/mnt/c"])
+        self.assertRaises(OSError, mount.getMountFromDevice, "/dev/sdc1")
+
+    def testNotChanged(self):
+        self.assertTrue(mount.isMounted("/mnt/b"))
+        self.watcher.mountsChanged = False
+        self.writeMounts([])
+        self.assertTrue(mount.isMounted("/mnt/b"))
+        self.assertEqual(len(list(mount.iterMounts())), 3)
+
+    def testChanged(self):
+        self.assertTrue(mount.isMounted("/mnt/b"))
+        self.watcher.mountsChanged = False
+        self.writeMounts([("/dev/sdb1", "/mnt/c")])
+        self.watcher.mountsChanged = True
+        self.assertFalse(mount.isMounted("/mnt/b"))
+        self.assertEqual(list(mount.iterMounts()),
+                         [mount.Mount("/dev/sdb1", "/mnt/c")])
+
+    def testInvalidate(self):
+        self.assertTrue(mount.isMounted("/mnt/b"))
+        self.watcher.mountsChanged = False
+        self.writeMounts([])
+        self.table.invalidate()
+        self.assertFalse(mount.isMounted("/mnt/b"))
+
+
+class MountTableWatchTests(TestCaseBase):
+
+    def testMountUmount(self):
+        checkSudo(["mount", "-t", "tmpfs", "tmpfs", "target"])
+        checkSudo(["umount", "target"])
+        table = mount.MountTable()
+        with monkeypatch.MonkeyPatchScope([(mount, '_mountTable', table)]):
+            with namedTemporaryDir() as mpath:
+                m = mount.Mount("tmpfs", mpath)
+                self.assertFalse(m.isMounted())
+                m.mount(vfstype="tmpfs")
+                try:
+                    self.assertTrue(m.isMounted())
+                finally:
+                    m.umount()
+                self.assertFalse(m.isMounted())
+
+
 class IterMountsPerfTests(TestCaseBase):
     line_fmt = ('%(fs_spec)s\t%(fs_file)s\t%(fs_vfstype)s'
                 '\t%(fs_mntops)s\t%(fs_freq)s\t%(fs_passno)s\n')
@@ -149,6 +271,8 @@ class IterMountsPerfTests(TestCaseBase):
                                          (mount, '_SYS_DEV_BLOCK_PATH',
                                           self._temp_dir),
                                          (mount, '_loopFsSpecs', {}),
+                                         (mount, '_mountTable',
+                                          mount.MountTable(FakeWatcher())),
                                          (os, 'stat', mock_stat),
                                          (stat, 'S_ISBLK', lambda x: True)])
         self._patch.apply()
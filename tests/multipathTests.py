@@ -0,0 +1,151 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from monkeypatch import MonkeyPatchScope
+from storage import multipath
+from testlib import VdsmTestCase
+
+
+class FakeInventory(multipath.DeviceInventory):
+
+    def __init__(self):
+        multipath.DeviceInventory.__init__(self)
+        self.collected = []
+
+    def _collectDevicesInfo(self, devices):
+        res = {}
+        for dmId, guid in devices:
+            self.collected.append(guid)
+            res[dmId] = ({"serial": "serial-" + guid}, True)
+        return res
+
+
+class DeviceInventoryTests(VdsmTestCase):
+
+    def setUp(self):
+        self.sysfs = {"dm-1": "guid-1", "dm-2": "guid-2", "dm-3": "guid-3"}
+        self.enumerations = 0
+        self.inventory = FakeInventory()
+
+    def getMPDevsIter(self):
+        self.enumerations += 1
+        return sorted(self.sysfs.items())
+
+    def patched(self):
+        return MonkeyPatchScope([
+            (multipath, "getMPDevsIter", self.getMPDevsIter),
+            (multipath, "_getMPDevGuid", self.sysfs.get),
+        ])
+
+    def test_get_devices(self):
+        with self.patched():
+            devices = self.inventory.getDevices()
+        self.assertEqual(devices, sorted(self.sysfs.items()))
+
+    def test_filter_known_devices(self):
+        with self.patched():
+            self.inventory.getDevices()
+            devices = self.inventory.getDevices(["guid-3", "guid-1"])
+        self.assertEqual(devices, [("dm-3", "guid-3"), ("dm-1", "guid-1")])
+        self.assertEqual(self.enumerations, 1)
+
+    def test_filter_new_device(self):
+        with self.patched():
+            self.inventory.getDevices()
+            self.sysfs["dm-4"] = "guid-4"
+            devices = self.inventory.getDevices(["guid-4"])
+        self.assertEqual(devices, [("dm-4", "guid-4")])
+        self.assertEqual(self.enumerations, 2)
+
+    def test_filter_renamed_device(self):
+        with self.patched():
+            self.inventory.getDevices()
+            self.sysfs["dm-1"] = "guid-4"
+            devices = self.inventory.getDevices(["guid-1"])
+        self.assertEqual(devices, [])
+
+    def test_info_missing(self):
+        with self.patched():
+            devices = self.inventory.getDevices()
+            self.inventory._collectDevicesInfo = lambda devices: {}
+            info = self.inventory.getDevicesInfo(devices)
+        self.assertEqual(info["guid-1"]["serial"], "")
+        self.assertEqual(self.inventory._devices, {})
+
+    def test_info_cached(self):
+        with self.patched():
+            devices = self.inventory.getDevices()
+            self.inventory.getDevicesInfo(devices)
+            info = self.inventory.getDevicesInfo(devices)
+        self.assertEqual(info["guid-2"], {"serial": "serial-guid-2"})
+        self.assertEqual(sorted(self.inventory.collected),
+                         ["guid-1", "guid-2", "guid-3"])
+
+    def test_change_event(self):
+        with self.patched():
+            devices = self.inventory.getDevices()
+            self.inventory.getDevicesInfo(devices)
+            self.inventory.handleUdevEvent({"ACTION": "change",
+                                            "DM_UUID": "mpath-guid-2",
+                                            "DM_NAME": "guid-2"})
+            self.inventory.getDevicesInfo(devices)
+        self.assertEqual(self.inventory.collected.count("guid-2"), 2)
+        self.assertEqual(self.inventory.collected.count("guid-1"), 1)
+
+    def test_removed_device_dropped(self):
+        with self.patched():
+            devices = self.inventory.getDevices()
+            self.inventory.getDevicesInfo(devices)
+            del self.sysfs["dm-2"]
+            devices = self.inventory.getDevices()
+            self.sysfs["dm-2"] = "guid-2"
+            devices = self.inventory.getDevices()
+            self.inventory.getDevicesInfo(devices)
+        self.assertEqual(self.inventory.collected.count("guid-2"), 2)
+
+    def test_session_info_dropped_on_disk_removal(self):
+        sessions = []
+
+        def collectSessionInfo(sessionID):
+            sessions.append(sessionID)
+            return {"connection": "host-%d" % sessionID}
+
+        with MonkeyPatchScope([(multipath, "_collectSessionInfo",
+                                collectSessionInfo)]):
+            self.inventory.getSessionInfo(1)
+            self.inventory.getSessionInfo(1)
+            self.inventory.handleUdevEvent({"ACTION": "remove",
+                                            "DEVTYPE": "disk"})
+            self.inventory.getSessionInfo(1)
+        self.assertEqual(sessions, [1, 1])
+
+
+class GetDevicesInfoTests(VdsmTestCase):
+
+    def test_collect(self):
+        def getDeviceInfo(dmId):
+            if dmId == "dm-2":
+                raise OSError("No such device")
+            return {"serial": "serial-" + dmId}, True
+
+        with MonkeyPatchScope([(multipath, "getDeviceInfo", getDeviceInfo)]):
+            res = multipath.getDevicesInfo(["dm-1", "dm-2", "dm-3"], 2)
+        self.assertEqual(res, {"dm-1": ({"serial": "serial-dm-1"}, True),
+                               "dm-3": ({"serial": "serial-dm-3"}, True)})
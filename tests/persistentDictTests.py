@@ -75,3 +75,62 @@ class PersistentDictTests(TestCaseBase):
             return
 
         self.fail("Exception was not thrown")
+
+
+class DummyCountingWriter(DummyWriter):
+    def __init__(self):
+        DummyWriter.__init__(self)
+        self.writes = 0
+
+    def writelines(self, lines):
+        self.writes += 1
+        DummyWriter.writelines(self, lines)
+
+
+class PersistentDictTransactionTests(TestCaseBase):
+
+    def setUp(self):
+        self.writer = DummyCountingWriter()
+        self.pd = persistentDict.PersistentDict(self.writer)
+        self.pd.update({"a": "1", "b": "2"})
+        self.writer.writes = 0
+
+    def testUnchangedNotFlushed(self):
+        self.pd["a"] = "1"
+        self.assertEqual(self.writer.writes, 0)
+
+    def testChangedFlushed(self):
+        self.pd["a"] = "3"
+        self.assertEqual(self.writer.writes, 1)
+        pd = persistentDict.PersistentDict(self.writer)
+        self.assertEqual(pd.copy(), {"a": "3", "b": "2"})
+
+    def testRevertedChangeNotFlushed(self):
+        with self.pd.transaction():
+            self.pd["a"] = "3"
+            del self.pd["b"]
+            self.pd["a"] = "1"
+            self.pd["b"] = "2"
+        self.assertEqual(self.writer.writes, 0)
+
+    def testRollback(self):
+        try:
+            with self.pd.transaction():
+                self.pd["a"] = "3"
+                self.pd["c"] = "4"
+                del self.pd["b"]
+                raise SpecialError("Transaction failed")
+        except SpecialError:
+            pass
+        self.assertEqual(self.pd.copy(), {"a": "1", "b": "2"})
+        pd = persistentDict.PersistentDict(self.writer)
+        self.assertEqual(pd.copy(), {"a": "1", "b": "2"})
+
+    def testClearRollback(self):
+        try:
+            with self.pd.transaction():
+                self.pd.clear()
+                raise SpecialError("Transaction failed")
+        except SpecialError:
+            pass
+        self.assertEqual(self.pd.copy(), {"a": "1", "b": "2"})
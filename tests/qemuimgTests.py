@@ -18,8 +18,13 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import json
+import os
+import time
+
 from monkeypatch import MonkeyPatch, MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import namedTemporaryDir
 from vdsm import qemuimg
 from vdsm import utils
 
@@ -108,6 +113,136 @@ class InfoTests(TestCaseBase):
             self.assertEquals('base.img', info['backingfile'])
 
 
+class InfoChainTests(TestCaseBase):
+
+    def setUp(self):
+        self.calls = 0
+
+    def chain(self, *paths):
+        nodes = []
+        for i, path in enumerate(paths):
+            node = {"filename": path, "format": "qcow2",
+                    "virtual-size": 1073741824, "cluster-size": 65536}
+            if i < len(paths) - 1:
+                node["backing-filename"] = os.path.basename(paths[i + 1])
+            nodes.append(node)
+        nodes[-1]["format"] = "raw"
+        del nodes[-1]["cluster-size"]
+        return json.dumps(nodes)
+
+    def images(self, tmpdir, *names):
+        # Created long enough ago to be cached
+        paths = []
+        for name in names:
+            path = os.path.join(tmpdir, name)
+            with open(path, "w") as f:
+                f.write(name)
+            self.setMtime(path, time.time() - 10)
+            paths.append(path)
+        return paths
+
+    def setMtime(self, path, mtime):
+        os.utime(path, (mtime, mtime))
+
+    def patch(self, out, rc=0):
+        def call(cmd, **kw):
+            self.calls += 1
+            self.assertEqual(cmd[:4], [QEMU_IMG, 'info', '--backing-chain',
+                                       '--output=json'])
+            return rc, out, ''
+
+        return MonkeyPatchScope([(utils, "execCmd", call),
+                                 (qemuimg, "_chainCache",
+                                  qemuimg._ChainCache(size=2))])
+
+    def test_parse(self):
+        with namedTemporaryDir() as tmpdir:
+            leaf, base = self.images(tmpdir, "leaf", "base")
+            with self.patch(self.chain(leaf, base)):
+                chain = qemuimg.info_chain(leaf, "qcow2")
+        self.assertEqual(chain, [
+            {'filename': leaf, 'format': 'qcow2', 'virtualsize': 1073741824,
+             'clustersize': 65536, 'backingfile': 'base'},
+            {'filename': base, 'format': 'raw', 'virtualsize': 1073741824},
+        ])
+
+    def test_parse_error(self):
+        with self.patch('[{"filename": "leaf"}]'):
+            self.assertRaises(qemuimg.QImgError, qemuimg.info_chain, 'leaf')
+
+    def test_command_error(self):
+        with self.patch('', rc=1):
+            self.assertRaises(qemuimg.QImgError, qemuimg.info_chain, 'leaf')
+
+    def test_cached(self):
+        with namedTemporaryDir() as tmpdir:
+            leaf, base = self.images(tmpdir, "leaf", "base")
+            with self.patch(self.chain(leaf, base)):
+                first = qemuimg.info_chain(leaf)
+                first[0]['format'] = 'modified'
+                self.assertEqual(qemuimg.info_chain(leaf)[0]['format'],
+                                 'qcow2')
+                self.assertEqual(self.calls, 1)
+
+    def test_not_cached(self):
+        with namedTemporaryDir() as tmpdir:
+            leaf, base = self.images(tmpdir, "leaf", "base")
+            with self.patch(self.chain(leaf, base)):
+                qemuimg.info_chain(leaf)
+                qemuimg.info_chain(leaf, cache=False)
+                self.assertEqual(self.calls, 2)
+
+    def test_backing_modified(self):
+        with namedTemporaryDir() as tmpdir:
+            leaf, base = self.images(tmpdir, "leaf", "base")
+            with self.patch(self.chain(leaf, base)):
+                qemuimg.info_chain(leaf)
+                self.setMtime(base, time.time() - 5)
+                qemuimg.info_chain(leaf)
+                qemuimg.info_chain(leaf)
+                self.assertEqual(self.calls, 2)
+
+    def test_recently_modified(self):
+        with namedTemporaryDir() as tmpdir:
+            leaf, base = self.images(tmpdir, "leaf", "base")
+            self.setMtime(leaf, time.time())
+            with self.patch(self.chain(leaf, base)):
+                qemuimg.info_chain(leaf)
+                qemuimg.info_chain(leaf)
+                self.assertEqual(self.calls, 2)
+
+    def test_not_regular_file(self):
+        with namedTemporaryDir() as tmpdir:
+            leaf, = self.images(tmpdir, "leaf")
+            with self.patch(self.chain(leaf, "/dev/null")):
+                qemuimg.info_chain(leaf)
+                qemuimg.info_chain(leaf)
+                self.assertEqual(self.calls, 2)
+
+    def test_evict_least_recently_used(self):
+        with namedTemporaryDir() as tmpdir:
+            a, b, c = self.images(tmpdir, "a", "b", "c")
+            outputs = dict((path, self.chain(path)) for path in (a, b, c))
+
+            def call(cmd, **kw):
+                self.calls += 1
+                return 0, outputs[cmd[-1]], ''
+
+            with MonkeyPatchScope([(utils, "execCmd", call),
+                                   (qemuimg, "_chainCache",
+                                    qemuimg._ChainCache(size=2))]):
+                qemuimg.info_chain(a)
+                qemuimg.info_chain(b)
+                qemuimg.info_chain(a)  # b is now least recently used
+                qemuimg.info_chain(c)  # Evicts b
+                self.assertEqual(self.calls, 3)
+                qemuimg.info_chain(a)
+                qemuimg.info_chain(c)
+                self.assertEqual(self.calls, 3)
+                qemuimg.info_chain(b)
+                self.assertEqual(self.calls, 4)
+
+
 class CreateTests(CommandTests):
 
     def test_no_format(self):
@@ -20,9 +20,13 @@
 import os
 import string
 import tempfile
+import threading
+import time
 from vdsm import utils
 
+from monkeypatch import MonkeyPatchScope
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import namedTemporaryDir
 import storage.remoteFileHandler as rhandler
 
 HANDLERS_NUM = 10
@@ -55,10 +59,237 @@ class RemoteFileHandlerTests(TestCaseBase):
             self.testTimeout()
             self.testEcho()
 
+    def testStatMany(self):
+        with namedTemporaryDir() as tmpdir:
+            path = os.path.join(tmpdir, "file")
+            open(path, "w").close()
+            missing = os.path.join(tmpdir, "missing")
+            res = self.pool.callCrabRPCFunction(5, "statMany", [path, missing])
+            self.assertEquals(res, [os.stat(path), None])
+
+    def testConcurrentCalls(self):
+        pool = rhandler.RemoteFileHandlerPool(1)
+        try:
+            slow = threading.Thread(target=pool.callCrabRPCFunction,
+                                    args=(5, "sleep", 1))
+            slow.start()
+            try:
+                start = time.time()
+                self.assertEquals(pool.callCrabRPCFunction(5, "echo", "x"),
+                                  "x")
+                self.assertTrue(time.time() - start < 1)
+                stats = pool.stats()
+                self.assertEquals(len(stats), 1)
+                self.assertEquals(stats[0]["pending"], 1)
+            finally:
+                slow.join()
+        finally:
+            pool.close()
+
     def tearDown(self):
         self.pool.close()
 
 
+class CrabRPCTests(TestCaseBase):
+    """
+    Test the protocol with a server running in a thread.
+    """
+
+    def setUp(self):
+        serverRead, clientWrite = os.pipe()
+        clientRead, serverWrite = os.pipe()
+        self.server = rhandler.CrabRPCServer(serverRead, serverWrite)
+        self.server.registerFunction(rhandler.echo)
+        self.server.registerFunction(time.sleep)
+        self.server.registerModule(os)
+        self.serverThread = threading.Thread(target=self.server.serve_forever)
+        self.serverThread.daemon = True
+        self.serverThread.start()
+        self.proxy = rhandler.CrabRPCProxy(clientRead, clientWrite)
+
+    def tearDown(self):
+        self.proxy.close()
+        self.serverThread.join()
+        self.server.close()
+
+    def testEcho(self):
+        self.assertEquals(self.proxy.callCrabRPCFunction(2, "echo", "data"),
+                          "data")
+
+    def testLargeMessage(self):
+        data = "x" * (rhandler.READ_SIZE * 3 + 1)
+        self.assertEquals(self.proxy.callCrabRPCFunction(2, "echo", data),
+                          data)
+
+    def testError(self):
+        self.assertRaises(OSError, self.proxy.callCrabRPCFunction, 2,
+                          "os.stat", "/no/such/path")
+
+    def testPipelined(self):
+        slow = threading.Thread(target=self.proxy.callCrabRPCFunction,
+                                args=(2, "sleep", 0.5))
+        slow.start()
+        try:
+            start = time.time()
+            self.proxy.callCrabRPCFunction(2, "echo", "fast")
+            self.assertTrue(time.time() - start < 0.5)
+        finally:
+            slow.join()
+
+    def testTimeout(self):
+        self.assertRaises(rhandler.Timeout, self.proxy.callCrabRPCFunction,
+                          0.1, "sleep", 0.3)
+        # The late response is discarded
+        time.sleep(0.3)
+        self.assertEquals(self.proxy.callCrabRPCFunction(2, "echo", "data"),
+                          "data")
+
+    def testConnectionLost(self):
+        self.server.wfile.close()
+        self.assertRaises(rhandler.Timeout, self.proxy.callCrabRPCFunction,
+                          2, "echo", "data")
+
+    def testCloseWakesCallers(self):
+        # A proxy without a server, so calls wait until the proxy is closed
+        serverRead, clientWrite = os.pipe()
+        clientRead, serverWrite = os.pipe()
+        proxy = rhandler.CrabRPCProxy(clientRead, clientWrite)
+        res = []
+
+        def call():
+            try:
+                proxy.callCrabRPCFunction(5, "echo", "data")
+            except rhandler.Timeout as e:
+                res.append(e)
+
+        try:
+            caller = threading.Thread(target=call)
+            caller.start()
+            time.sleep(0.1)
+            start = time.time()
+            proxy.close()
+            caller.join()
+            self.assertTrue(time.time() - start < 1)
+            self.assertEquals(len(res), 1)
+            # Closed by the caller when leaving
+            self.assertEquals(proxy._myRead, None)
+            self.assertRaises(rhandler.Timeout, proxy.callCrabRPCFunction,
+                              2, "echo", "data")
+        finally:
+            os.close(serverRead)
+            os.close(serverWrite)
+
+    def testPendingAge(self):
+        self.assertEquals(self.proxy.pendingAge(), 0)
+        slow = threading.Thread(target=self.proxy.callCrabRPCFunction,
+                                args=(2, "sleep", 0.3))
+        slow.start()
+        try:
+            time.sleep(0.1)
+            self.assertTrue(self.proxy.pendingAge() >= 0.1)
+        finally:
+            slow.join()
+        self.assertEquals(self.proxy.pendingAge(), 0)
+
+    def testStats(self):
+        for i in range(3):
+            self.proxy.callCrabRPCFunction(2, "echo", "data")
+        self.assertRaises(rhandler.Timeout, self.proxy.callCrabRPCFunction,
+                          0.05, "sleep", 0.1)
+        # Wait for the late response
+        time.sleep(0.2)
+        stats = self.proxy.stats()
+        self.assertEquals(stats["calls"], 3)
+        self.assertEquals(stats["timeouts"], 1)
+        self.assertEquals(stats["pending"], 0)
+        self.assertEquals(stats["maxPending"], 1)
+        self.assertTrue(stats["maxLatency"] >= stats["avgLatency"] > 0)
+
+
+class FakeProcess(object):
+    pid = 0
+
+
+class ThreadPoolHandler(object):
+    """
+    A pool handler running the server in a thread.
+    """
+
+    instances = []
+
+    def __init__(self):
+        serverRead, clientWrite = os.pipe()
+        clientRead, serverWrite = os.pipe()
+        self.server = rhandler.CrabRPCServer(serverRead, serverWrite)
+        self.server.registerFunction(rhandler.echo)
+        self.server.registerFunction(time.sleep)
+        self.serverThread = threading.Thread(target=self.server.serve_forever)
+        self.serverThread.daemon = True
+        self.serverThread.start()
+        self.proxy = rhandler.CrabRPCProxy(clientRead, clientWrite)
+        self.process = FakeProcess()
+        self.stopped = False
+        self.instances.append(self)
+
+    def stop(self):
+        self.stopped = True
+        self.proxy.close()
+        self.serverThread.join()
+        self.server.close()
+
+
+class RemoteFileHandlerPoolTests(TestCaseBase):
+
+    def setUp(self):
+        ThreadPoolHandler.instances = []
+
+    def pool(self, handlers, **kw):
+        return MonkeyPatchScope([(rhandler, "PoolHandler",
+                                  ThreadPoolHandler)]), \
+            rhandler.RemoteFileHandlerPool(handlers, **kw)
+
+    def testSlowHandlerNotUsed(self):
+        patch, pool = self.pool(1, slowThreshold=0.1)
+        with patch:
+            slow = threading.Thread(target=pool.callCrabRPCFunction,
+                                    args=(2, "sleep", 0.5))
+            slow.start()
+            try:
+                time.sleep(0.2)
+                self.assertRaises(Exception, pool.callCrabRPCFunction,
+                                  2, "echo", "x")
+            finally:
+                slow.join()
+            self.assertEquals(pool.callCrabRPCFunction(2, "echo", "x"), "x")
+            pool.close()
+
+    def testTimeoutDoesNotFailOtherCalls(self):
+        patch, pool = self.pool(1)
+        res = []
+        with patch:
+            other = threading.Thread(
+                target=lambda: res.append(
+                    pool.callCrabRPCFunction(2, "echo", "x")
+                    if pool.callCrabRPCFunction(2, "sleep", 0.5) is None
+                    else None))
+            other.start()
+            try:
+                time.sleep(0.1)
+                self.assertRaises(rhandler.Timeout, pool.callCrabRPCFunction,
+                                  0.1, "sleep", 1)
+                # Retired, but not stopped while a call is running
+                handler, = ThreadPoolHandler.instances
+                self.assertEquals(pool.handlers, [None])
+                self.assertFalse(handler.stopped)
+            finally:
+                other.join()
+            # The second call used a new handler
+            self.assertEquals(res, ["x"])
+            self.assertEquals(len(ThreadPoolHandler.instances), 2)
+            self.assertTrue(handler.stopped)
+            pool.close()
+
+
 class PoolHandlerTests(TestCaseBase):
     def testStop(self):
         p = rhandler.PoolHandler()
@@ -101,3 +332,52 @@ class RemoteFileHandlerTruncateTests(TestCaseBase):
         with open(self.path) as path:
             actual = path.read()
         self.assertEquals(expected, actual)
+
+
+class RemoteFileHandlerBulkTests(TestCaseBase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = []
+        for name in ("a", "b"):
+            subdir = os.path.join(self.tmpdir, name)
+            os.mkdir(subdir)
+            path = os.path.join(subdir, name + ".meta")
+            with open(path, "w") as f:
+                f.write("NAME=%s\nEOF\n" % name)
+            self.files.append(path)
+        self.missing = os.path.join(self.tmpdir, "missing")
+
+    def tearDown(self):
+        for path in self.files:
+            os.unlink(path)
+            os.rmdir(os.path.dirname(path))
+        os.rmdir(self.tmpdir)
+
+    def testStatMany(self):
+        res = rhandler.statMany(self.files + [self.missing])
+        self.assertEquals(res, [os.stat(p) for p in self.files] + [None])
+
+    def testStatManyError(self):
+        notDir = os.path.join(self.files[0], "file")
+        self.assertRaises(OSError, rhandler.statMany, [notDir])
+
+    def testReadLinesMany(self):
+        res = rhandler.readLinesMany([self.missing] + self.files)
+        self.assertEquals(res, [None, ["NAME=a\n", "EOF\n"],
+                                ["NAME=b\n", "EOF\n"]])
+
+    def testReadLinesManyDirectMissing(self):
+        res = rhandler.readLinesMany([self.missing], True)
+        self.assertEquals(res, [None])
+
+    def testGlobStat(self):
+        res = rhandler.globStat(os.path.join(self.tmpdir, "*"))
+        expected = [(os.path.dirname(p), os.stat(os.path.dirname(p)))
+                    for p in self.files]
+        self.assertEquals(sorted(res), expected)
+
+    def testWalkStat(self):
+        res = rhandler.walkStat(self.tmpdir)
+        expected = [(p, os.stat(p)) for p in self.files]
+        self.assertEquals(sorted(res), expected)
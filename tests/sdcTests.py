@@ -0,0 +1,133 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+import threading
+
+from storage import sdc
+from storage import storage_exception as se
+from testlib import VdsmTestCase
+
+
+class FakeBackend(object):
+
+    def __init__(self, name, domains=(), error=None):
+        self.__name__ = name
+        self.domains = set(domains)
+        self.error = error
+        self.blocked = None
+        self.calls = 0
+
+    def findDomain(self, sdUUID):
+        self.calls += 1
+        if self.blocked is not None:
+            self.blocked.wait()
+        if self.error is not None:
+            raise self.error
+        if sdUUID not in self.domains:
+            raise se.StorageDomainDoesNotExist(sdUUID)
+        return (self.__name__, sdUUID)
+
+
+class FakeStorageDomainCache(sdc.StorageDomainCache):
+
+    def __init__(self, backends):
+        sdc.StorageDomainCache.__init__(self, "/rhev/data-center")
+        self.backends = backends
+
+    def _backends(self):
+        return self.backends
+
+
+class FindUnfetchedDomainTests(VdsmTestCase):
+
+    def setUp(self):
+        self.block = FakeBackend("block", ["sd-1"])
+        self.nfs = FakeBackend("nfs", ["sd-2"])
+        self.cache = FakeStorageDomainCache([self.block, self.nfs])
+
+    def test_found(self):
+        self.assertEqual(self.cache._findUnfetchedDomain("sd-1"),
+                         ("block", "sd-1"))
+        self.assertEqual(self.cache._findUnfetchedDomain("sd-2"),
+                         ("nfs", "sd-2"))
+
+    def test_blocked_backend(self):
+        self.nfs.blocked = threading.Event()
+        try:
+            self.assertEqual(self.cache._findUnfetchedDomain("sd-1"),
+                             ("block", "sd-1"))
+        finally:
+            self.nfs.blocked.set()
+
+    def test_hint(self):
+        self.cache._findUnfetchedDomain("sd-2")
+        self.cache.invalidateStorage()
+        self.cache._findUnfetchedDomain("sd-2")
+        self.assertEqual(self.block.calls, 1)
+        self.assertEqual(self.nfs.calls, 2)
+
+    def test_stale_hint(self):
+        self.cache._findUnfetchedDomain("sd-2")
+        self.nfs.domains.remove("sd-2")
+        self.block.domains.add("sd-2")
+        self.assertEqual(self.cache._findUnfetchedDomain("sd-2"),
+                         ("block", "sd-2"))
+
+    def test_hint_error(self):
+        self.cache._findUnfetchedDomain("sd-2")
+        self.nfs.error = RuntimeError("nfs failure")
+        self.nfs.domains.remove("sd-2")
+        self.block.domains.add("sd-2")
+        self.assertEqual(self.cache._findUnfetchedDomain("sd-2"),
+                         ("block", "sd-2"))
+        self.assertEqual(self.cache._hints["sd-2"], self.block.findDomain)
+
+    def test_missing_cached(self):
+        self.assertRaises(se.StorageDomainDoesNotExist,
+                          self.cache._findUnfetchedDomain, "sd-3")
+        self.nfs.domains.add("sd-3")
+        self.assertRaises(se.StorageDomainDoesNotExist,
+                          self.cache._findUnfetchedDomain, "sd-3")
+        self.assertEqual(self.nfs.calls, 1)
+
+    def test_missing_expired(self):
+        self.cache._missingTTL = 0
+        self.assertRaises(se.StorageDomainDoesNotExist,
+                          self.cache._findUnfetchedDomain, "sd-3")
+        self.nfs.domains.add("sd-3")
+        self.assertEqual(self.cache._findUnfetchedDomain("sd-3"),
+                         ("nfs", "sd-3"))
+
+    def test_missing_invalidated(self):
+        self.assertRaises(se.StorageDomainDoesNotExist,
+                          self.cache._findUnfetchedDomain, "sd-3")
+        self.nfs.domains.add("sd-3")
+        self.cache.invalidateStorage()
+        self.assertEqual(self.cache._findUnfetchedDomain("sd-3"),
+                         ("nfs", "sd-3"))
+
+    def test_backend_error_not_cached(self):
+        self.nfs.error = RuntimeError("nfs failure")
+        self.assertRaises(se.StorageDomainDoesNotExist,
+                          self.cache._findUnfetchedDomain, "sd-3")
+        self.nfs.error = None
+        self.nfs.domains.add("sd-3")
+        self.assertEqual(self.cache._findUnfetchedDomain("sd-3"),
+                         ("nfs", "sd-3"))
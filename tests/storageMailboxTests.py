@@ -19,11 +19,15 @@
 #
 
 from uuid import uuid4
+import Queue
 import threading
 import os
 import shutil
 
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import permutations, expandPermutations
+from testlib import temporaryPath
+from monkeypatch import MonkeyPatch
 
 import storage.storage_mailbox as sm
 from storage.sd import DOMAIN_META_DATA
@@ -48,7 +52,117 @@ class StoragePoolStub(object):
         shutil.rmtree(self.storage_repository)
 
 
+class FakeMailboxFile(object):
+
+    def __init__(self, path):
+        self.writes = []
+
+    def read(self, offset, size):
+        return "\0" * size
+
+    def write(self, offset, data):
+        self.writes.append((offset, len(data)))
+
+    def close(self):
+        pass
+
+
+class FakeMessage(object):
+    payload = "1" + "x" * (sm.MESSAGE_SIZE - 1)
+
+
+class HSM_MailMonitorTests(TestCaseBase):
+
+    def setUp(self):
+        self.poolID = str(uuid4())
+        self.volumeData = {"poolID": self.poolID,
+                           "domainID": str(uuid4()),
+                           "volumeID": str(uuid4())}
+
+    def message(self, size, volumeData=None):
+        return sm.SPM_Extend_Message(volumeData or self.volumeData, size)
+
+    @MonkeyPatch(sm, 'openMailboxFile', FakeMailboxFile)
+    def testCoalesceExtendMessages(self):
+        monitor = sm.HSM_MailMonitor("inbox", "outbox", 1, Queue.Queue(), 2)
+        monitor.immStop()
+        monitor.join()
+
+        first = self.message(100)
+        monitor._handleMessage(first)
+        self.assertEquals(len(monitor._activeMessages), 1)
+        slot = monitor._activeMessages.keys()[0]
+
+        # Covered by the active message
+        smaller = self.message(50)
+        monitor._handleMessage(smaller)
+        self.assertEquals(monitor._activeMessages, {slot: first})
+
+        # Replaces the unsent active message
+        larger = self.message(200)
+        monitor._handleMessage(larger)
+        self.assertEquals(monitor._activeMessages, {slot: larger})
+        self.assertEquals(monitor._waiters[slot], [smaller, first])
+        start = slot * sm.MESSAGE_SIZE
+        self.assertEquals(
+            monitor._outgoingMail[start:start + sm.MESSAGE_SIZE],
+            larger.payload)
+
+        # The active message was sent, so a larger request needs a new slot
+        monitor._sendMail()
+        monitor._handleMessage(self.message(300))
+        self.assertEquals(len(monitor._activeMessages), 2)
+
+        # Other volumes are not coalesced
+        other = dict(self.volumeData, volumeID=str(uuid4()))
+        monitor._handleMessage(self.message(50, other))
+        self.assertEquals(len(monitor._activeMessages), 3)
+        self.assertEquals(monitor.getStats()["requests"], 5)
+
+
+class PollIntervalTests(TestCaseBase):
+
+    def testBackoff(self):
+        interval = sm.PollInterval(0.5, 2)
+        self.assertEquals(interval.next(), 2)
+        interval.reset()
+        self.assertEquals([interval.next() for i in range(4)],
+                          [0.5, 1, 2, 2])
+
+
+class LatencyStatsTests(TestCaseBase):
+
+    def testInfo(self):
+        stats = sm.LatencyStats()
+        stats.requested(1)
+        stats.requested(1)
+        stats.replied(1, 1.0)
+        stats.replied(1, 3.0)
+        stats.requested(2)
+        self.assertEquals(stats.info(), {
+            1: {"requests": 2, "replies": 2, "avgLatency": 2.0,
+                "maxLatency": 3.0, "lastLatency": 3.0},
+            2: {"requests": 1, "replies": 0, "avgLatency": 0.0,
+                "maxLatency": 0.0, "lastLatency": 0.0},
+        })
+
+
 class SPM_MailMonitorTests(TestCaseBase):
+
+    @MonkeyPatch(sm, 'openMailboxFile', FakeMailboxFile)
+    def testSendReplyWritesOnlyItsMailbox(self):
+        mailer = sm.SPM_MailMonitor(StoragePoolStub(), 10)
+        try:
+            outFile = mailer._outFile
+            # Clearing the outgoing mail on startup
+            self.assertEquals(outFile.writes, [(0, 10 * sm.MAILBOX_SIZE)])
+            del outFile.writes[:]
+            mailer.sendReply(3 * sm.SLOTS_PER_MAILBOX + 1, FakeMessage())
+            self.assertEquals(outFile.writes,
+                              [(3 * sm.MAILBOX_SIZE, sm.MAILBOX_SIZE)])
+        finally:
+            mailer.stop()
+
     def testThreadLeak(self):
         mailer = sm.SPM_MailMonitor(StoragePoolStub(), 100)
         threadCount = len(threading.enumerate())
@@ -56,3 +170,29 @@ class SPM_MailMonitorTests(TestCaseBase):
         mailer.run()
         t = lambda: self.assertEquals(threadCount, len(threading.enumerate()))
         retry(AssertionError, t, timeout=4, sleep=0.1)
+
+
+@expandPermutations
+class MailboxFileTests(TestCaseBase):
+
+    @permutations([[sm.DDMailboxFile], [sm.DirectMailboxFile]])
+    def testReadWrite(self, mailboxFile):
+        data = "".join(chr(i) * sm.MAILBOX_SIZE for i in range(4))
+        with temporaryPath(data=data) as path:
+            mbox = mailboxFile(path)
+            try:
+                self.assertEquals(mbox.read(sm.MAILBOX_SIZE,
+                                            2 * sm.MAILBOX_SIZE),
+                                  data[sm.MAILBOX_SIZE:3 * sm.MAILBOX_SIZE])
+                mbox.write(2 * sm.MAILBOX_SIZE, "x" * sm.MAILBOX_SIZE)
+                self.assertEquals(mbox.read(0, len(data)),
+                                  data[:2 * sm.MAILBOX_SIZE] +
+                                  "x" * sm.MAILBOX_SIZE +
+                                  data[3 * sm.MAILBOX_SIZE:])
+            finally:
+                mbox.close()
+
+    def testDirtyRuns(self):
+        self.assertEquals(sm._dirtyRuns(set([7, 1, 2, 3, 5])),
+                          [(1, 3), (5, 1), (7, 1)])
+        self.assertEquals(sm._dirtyRuns(set()), [])
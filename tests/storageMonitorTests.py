@@ -18,8 +18,14 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import threading
+import time
+
+from monkeypatch import MonkeyPatchScope
+from storage import clusterlock
 from storage import monitor
 from testlib import VdsmTestCase
+from vdsm.config import config
 
 
 class FrozenStatusTests(VdsmTestCase):
@@ -41,3 +47,185 @@ class FrozenStatusTests(VdsmTestCase):
     def test_deleting_attribute_raises(self):
         for name in self.status.__slots__:
             self.assertRaises(AssertionError, delattr, self.frozen, name)
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class LatencyHistoryTests(VdsmTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.history = monitor.LatencyHistory(100, clock=self.clock)
+
+    def test_empty(self):
+        self.assertEqual(self.history.info([60]), {'60': {'count': 0}})
+
+    def test_percentiles(self):
+        for i in range(1, 101):
+            self.history.add(i / 100.0)
+        self.assertEqual(self.history.info([60]), {
+            '60': {'count': 100, 'p50': 0.5, 'p95': 0.95, 'p99': 0.99,
+                   'max': 1.0}})
+
+    def test_windows(self):
+        self.history.add(5.0)
+        self.clock.time = 100
+        self.history.add(1.0)
+        self.history.add(2.0)
+        info = self.history.info([60, 300])
+        self.assertEqual(info['60'], {'count': 2, 'p50': 1.0, 'p95': 2.0,
+                                      'p99': 2.0, 'max': 2.0})
+        self.assertEqual(info['300']['count'], 3)
+        self.assertEqual(info['300']['max'], 5.0)
+
+    def test_bounded(self):
+        for i in range(200):
+            self.history.add(i)
+        info = self.history.info([60])
+        self.assertEqual(info['60']['count'], 100)
+        self.assertEqual(info['60']['p50'], 149)
+
+
+class FakeDomain(object):
+
+    def __init__(self, sdUUID):
+        self.sdUUID = sdUUID
+        self.checks = 0
+        self.blocked = None
+        self.acquired = False
+        self.released = threading.Event()
+
+    def isISO(self):
+        return False
+
+    def selftest(self):
+        self.checks += 1
+        if self.blocked is not None:
+            self.blocked.wait()
+
+    def getReadDelay(self):
+        return 0.001
+
+    def getStats(self):
+        return {"disktotal": "100", "diskfree": "50", "mdasize": 0,
+                "mdafree": 0, "mdavalid": True, "mdathreshold": True}
+
+    def validateMaster(self):
+        return {"valid": True, "mount": True}
+
+    def hasHostId(self, hostId):
+        return self.acquired
+
+    def getVersion(self):
+        return 3
+
+    def acquireHostId(self, hostId, **kwargs):
+        self.acquired = True
+
+    def releaseHostId(self, hostId, **kwargs):
+        self.acquired = False
+        self.released.set()
+
+    def getHostStatus(self, hostId):
+        return clusterlock.HOST_STATUS_LIVE
+
+
+class FakeSDCache(object):
+
+    def __init__(self, domains):
+        self.domains = domains
+
+    def produce(self, sdUUID):
+        return self.domains[sdUUID]
+
+    def manuallyRemoveDomain(self, sdUUID):
+        pass
+
+
+def waitFor(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("Timeout waiting for %s" % predicate)
+        time.sleep(0.05)
+
+
+class DomainMonitorTests(VdsmTestCase):
+
+    def setUp(self):
+        self.domains = dict((uuid, FakeDomain(uuid))
+                            for uuid in ("sd-1", "sd-2", "sd-3"))
+        self.patch = MonkeyPatchScope([
+            (monitor, "sdCache", FakeSDCache(self.domains))])
+        self.patch.__enter__()
+        self.monitor = monitor.DomainMonitor(0.1)
+
+    def tearDown(self):
+        try:
+            self.monitor.close()
+        finally:
+            self.patch.__exit__(None, None, None)
+
+    def test_check_domains(self):
+        for sdUUID in self.domains:
+            self.monitor.startMonitoring(sdUUID, 1)
+        waitFor(lambda: all(d.checks > 1 for d in self.domains.values()))
+        status = dict(self.monitor.getDomainsStatus())
+        self.assertEqual(sorted(status), sorted(self.domains))
+        for sdUUID, domainStatus in status.items():
+            self.assertTrue(domainStatus.actual)
+            self.assertTrue(domainStatus.valid)
+            self.assertEqual(domainStatus.version, 3)
+            self.assertTrue(self.domains[sdUUID].acquired)
+
+    def test_latency(self):
+        self.monitor.startMonitoring("sd-1", 1)
+        domain = self.domains["sd-1"]
+        waitFor(lambda: domain.checks > 1)
+        latency = dict(self.monitor.getDomainsLatency([60]))
+        readDelay = latency["sd-1"]["readDelay"]["60"]
+        self.assertTrue(readDelay["count"] > 0)
+        self.assertEqual(readDelay["max"], 0.001)
+        self.assertTrue(latency["sd-1"]["selftest"]["60"]["count"] > 0)
+
+    def test_stop_releases_host_id(self):
+        self.monitor.startMonitoring("sd-1", 1)
+        domain = self.domains["sd-1"]
+        waitFor(lambda: domain.acquired)
+        self.monitor.stopMonitoring(["sd-1"])
+        self.assertTrue(domain.released.is_set())
+        self.assertEqual(self.monitor.domains, [])
+        checks = domain.checks
+        time.sleep(0.3)
+        self.assertEqual(domain.checks, checks)
+
+    def test_blocked_check_does_not_delay_other_domains(self):
+        # With a single worker, other domains are checked only if the
+        # blocked check is left behind.
+        self.monitor.close()
+        workers = config.get("irs", "monitor_workers")
+        config.set("irs", "monitor_workers", "1")
+        try:
+            self.monitor = monitor.DomainMonitor(0.1)
+        finally:
+            config.set("irs", "monitor_workers", workers)
+        self.monitor._timeout = 0.2
+        blocked = self.domains["sd-1"]
+        blocked.blocked = threading.Event()
+        for sdUUID in self.domains:
+            self.monitor.startMonitoring(sdUUID, 1)
+        try:
+            waitFor(lambda: all(self.domains[sdUUID].checks > 3
+                                for sdUUID in ("sd-2", "sd-3")))
+            # A blocked domain is never checked concurrently
+            self.assertEqual(blocked.checks, 1)
+        finally:
+            blocked.blocked.set()
+        waitFor(lambda: blocked.checks > 1)
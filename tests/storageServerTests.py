@@ -18,8 +18,15 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import threading
+import time
+from functools import partial
+
 from testlib import VdsmTestCase
+from storage import iscsi
 from storage.storageServer import IscsiConnection
+from storage.storageServer import connectAll
+from storage.storageServer import groupConnections
 
 
 class IscsiConnectionMismatchTests(VdsmTestCase):
@@ -37,3 +44,113 @@ class IscsiConnectionMismatchTests(VdsmTestCase):
                   IscsiConnection.Mismatch("error 2")]
         expected = "%s" % ["error 1", "error 2"]
         self.assertEqual(str(errors), expected)
+
+
+class FakeConnection(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+def iscsiConnection(iqn, iface="default"):
+    portal = iscsi.IscsiPortal("server", 3260)
+    target = iscsi.IscsiTarget(portal, 1, iqn)
+    return IscsiConnection(target, iface=iscsi.IscsiInterface(iface))
+
+
+class GroupConnectionsTests(VdsmTestCase):
+
+    def test_independent(self):
+        cons = [FakeConnection("a"), FakeConnection("b")]
+        self.assertEqual(groupConnections(cons), [[0], [1]])
+
+    def test_iscsi_per_iface(self):
+        cons = [iscsiConnection("iqn1"),
+                FakeConnection("a"),
+                iscsiConnection("iqn2", iface="iser"),
+                iscsiConnection("iqn3"),
+                iscsiConnection("iqn4", iface="iser")]
+        self.assertEqual(groupConnections(cons), [[0, 3], [1], [2, 4]])
+
+
+class ConnectAllTests(VdsmTestCase):
+
+    def test_results_order(self):
+        def connect(con, delay):
+            time.sleep(delay)
+            return con.name
+
+        cons = [FakeConnection(str(i)) for i in range(5)]
+        jobs = [(con, partial(connect, con, 0.05 * (5 - i)))
+                for i, con in enumerate(cons)]
+        results = connectAll(jobs, 5)
+        self.assertEqual(results, [(True, str(i)) for i in range(5)])
+
+    def test_errors(self):
+        error = RuntimeError("no route to host")
+
+        def fail():
+            raise error
+
+        jobs = [(FakeConnection("a"), lambda: "a"),
+                (FakeConnection("b"), fail)]
+        self.assertEqual(connectAll(jobs, 2), [(True, "a"), (False, error)])
+
+    def test_concurrent(self):
+        lock = threading.Lock()
+        started = [0]
+        allStarted = threading.Event()
+        cons = [FakeConnection(str(i)) for i in range(3)]
+
+        def connect():
+            with lock:
+                started[0] += 1
+                if started[0] == len(cons):
+                    allStarted.set()
+            allStarted.wait(2)
+            return allStarted.is_set()
+
+        results = connectAll([(con, connect) for con in cons], 3)
+        self.assertEqual(results, [(True, True)] * 3)
+
+    def test_max_workers(self):
+        lock = threading.Lock()
+        running = [0]
+        maxRunning = [0]
+
+        def connect():
+            with lock:
+                running[0] += 1
+                maxRunning[0] = max(maxRunning[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        cons = [FakeConnection(str(i)) for i in range(6)]
+        connectAll([(con, connect) for con in cons], 2)
+        self.assertEqual(maxRunning[0], 2)
+
+    def test_no_workers(self):
+        jobs = [(FakeConnection("a"), lambda: "a"),
+                (FakeConnection("b"), lambda: "b")]
+        self.assertEqual(connectAll(jobs, 0), [(True, "a"), (True, "b")])
+
+    def test_iscsi_same_iface_serialized(self):
+        lock = threading.Lock()
+        running = [0]
+        maxRunning = [0]
+
+        def connect():
+            with lock:
+                running[0] += 1
+                maxRunning[0] = max(maxRunning[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        cons = [iscsiConnection("iqn%d" % i) for i in range(3)]
+        connectAll([(con, connect) for con in cons], 3)
+        self.assertEqual(maxRunning[0], 1)
+
+    def test_no_connections(self):
+        self.assertEqual(connectAll([], 10), [])
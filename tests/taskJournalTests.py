@@ -0,0 +1,272 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+import os
+
+from monkeypatch import MonkeyPatchScope
+from testlib import VdsmTestCase as TestCaseBase
+from testlib import namedTemporaryDir
+from testlib import make_config
+
+from storage import fileUtils
+from storage import outOfProcess as oop
+from storage import remoteFileHandler
+from storage import task
+from storage import taskJournal
+
+
+class FakeProcPool(object):
+    """
+    Run the journal file operations in this process.
+    """
+
+    def __init__(self):
+        self.os = os
+        self.fileUtils = fileUtils
+        self.appends = 0
+        self.failAppend = False
+
+    def directReadLines(self, path):
+        # The test directory may not support direct I/O
+        return remoteFileHandler.readLines(path)
+
+    def writeLines(self, path, lines):
+        remoteFileHandler.writeLines(path, lines)
+
+    def appendLines(self, path, lines):
+        if self.failAppend:
+            # Leave a partly written record
+            remoteFileHandler.appendLines(path, [lines[0][:10]])
+            raise OSError("Cannot append")
+        self.appends += 1
+        remoteFileHandler.appendLines(path, lines)
+
+
+class FakeIOProcess(object):
+    """
+    Implement the ioprocess calls used by the journal like ioprocess does,
+    in this process.
+    """
+
+    def __init__(self):
+        self.writes = 0
+
+    def readfile(self, path, direct=False):
+        with open(path) as f:
+            return f.read()
+
+    def readlines(self, path):
+        # ioprocess drops the line endings
+        return self.readfile(path).splitlines()
+
+    def writefile(self, path, data):
+        self.writes += 1
+        with open(path, "w") as f:
+            f.write(data)
+
+    def fsyncPath(self, path):
+        pass
+
+    def rename(self, oldpath, newpath):
+        os.rename(oldpath, newpath)
+
+
+class TaskJournalTests(TestCaseBase):
+
+    def setUp(self):
+        self.procPool = FakeProcPool()
+
+    def patch(self, *patches):
+        return MonkeyPatchScope([(taskJournal, "getProcPool",
+                                  lambda: self.procPool),
+                                 (oop, "_oopImpl", oop.RFH)] + list(patches))
+
+    def test_empty(self):
+        with namedTemporaryDir() as store, self.patch():
+            journal = taskJournal.TaskJournal(store)
+            self.assertEqual(journal.load(), {})
+
+    def test_save(self):
+        with namedTemporaryDir() as store, self.patch():
+            journal = taskJournal.TaskJournal(store)
+            journal.save("task-1", {".task": ["id = task-1"]})
+            journal.save("task-2", {".task": ["id = task-2"]})
+            journal.save("task-1", {".task": ["id = task-1", "njobs = 1"],
+                                    ".job.0": ["name = job"]})
+            self.assertEqual(self.procPool.appends, 3)
+            self.assertEqual(taskJournal.TaskJournal(store).load(), {
+                "task-1": {".task": ["id = task-1", "njobs = 1"],
+                           ".job.0": ["name = job"]},
+                "task-2": {".task": ["id = task-2"]},
+            })
+
+    def test_remove(self):
+        with namedTemporaryDir() as store, self.patch():
+            journal = taskJournal.TaskJournal(store)
+            journal.save("task-1", {".task": ["id = task-1"]})
+            journal.save("task-2", {".task": ["id = task-2"]})
+            journal.remove("task-1")
+            self.assertEqual(taskJournal.TaskJournal(store).load(),
+                             {"task-2": {".task": ["id = task-2"]}})
+
+    def test_remove_missing(self):
+        with namedTemporaryDir() as store, self.patch():
+            journal = taskJournal.TaskJournal(store)
+            journal.remove("task-1")
+            self.assertEqual(self.procPool.appends, 0)
+
+    def test_compact(self):
+        with namedTemporaryDir() as store, self.patch(
+                (taskJournal, "COMPACT_MIN_RECORDS", 4)):
+            journal = taskJournal.TaskJournal(store)
+            for i in range(5):
+                journal.save("task-1", {".task": ["state = %d" % i]})
+            # The last update compacted the journal
+            self.assertEqual(self.procPool.appends, 4)
+            with open(os.path.join(store, taskJournal.JOURNAL_NAME)) as f:
+                self.assertEqual(len(f.readlines()), 1)
+            self.assertEqual(taskJournal.TaskJournal(store).load(),
+                             {"task-1": {".task": ["state = 4"]}})
+
+    def test_partly_written_record(self):
+        with namedTemporaryDir() as store, self.patch():
+            journal = taskJournal.TaskJournal(store)
+            journal.save("task-1", {".task": ["id = task-1"]})
+            self.procPool.failAppend = True
+            self.assertRaises(OSError, journal.save, "task-2",
+                              {".task": ["id = task-2"]})
+            self.assertEqual(taskJournal.TaskJournal(store).load(),
+                             {"task-1": {".task": ["id = task-1"]}})
+
+            # The next update replaces the partly written record
+            self.procPool.failAppend = False
+            journal.save("task-3", {".task": ["id = task-3"]})
+            with open(os.path.join(store, taskJournal.JOURNAL_NAME)) as f:
+                self.assertEqual(len(f.readlines()), 2)
+            self.assertEqual(sorted(taskJournal.TaskJournal(store).load()),
+                             ["task-1", "task-3"])
+
+    def test_journal_files(self):
+        self.assertTrue(taskJournal.isJournalFile(taskJournal.JOURNAL_NAME))
+        self.assertTrue(taskJournal.isJournalFile(
+            taskJournal.JOURNAL_NAME + taskJournal.COMPACT_EXT))
+        self.assertFalse(taskJournal.isJournalFile(
+            "5a8b6da8-5a0d-4bc1-a3c4-61b4a1cbbd43"))
+
+
+class IOProcessTaskJournalTests(TestCaseBase):
+
+    def setUp(self):
+        self.ioproc = FakeIOProcess()
+        self.procPool = oop._IOProcWrapper("oop", self.ioproc)
+
+    def patch(self):
+        return MonkeyPatchScope([(taskJournal, "getProcPool",
+                                  lambda: self.procPool),
+                                 (oop, "_oopImpl", oop.IOPROC)])
+
+    def test_load(self):
+        with namedTemporaryDir() as store, self.patch():
+            journal = taskJournal.TaskJournal(store)
+            journal.save("task-1", {".task": ["id = task-1"]})
+            journal.save("task-2", {".task": ["id = task-2"]})
+            self.assertEqual(taskJournal.TaskJournal(store).load(), {
+                "task-1": {".task": ["id = task-1"]},
+                "task-2": {".task": ["id = task-2"]},
+            })
+
+    def test_update_writes_current_tasks(self):
+        with namedTemporaryDir() as store, self.patch():
+            journal = taskJournal.TaskJournal(store)
+            for i in range(5):
+                journal.save("task-1", {".task": ["state = %d" % i]})
+            journal.save("task-2", {".task": ["id = task-2"]})
+            journal.remove("task-2")
+            self.assertEqual(self.ioproc.writes, 7)
+            with open(os.path.join(store, taskJournal.JOURNAL_NAME)) as f:
+                self.assertEqual(len(f.readlines()), 1)
+            self.assertEqual(taskJournal.TaskJournal(store).load(),
+                             {"task-1": {".task": ["state = 4"]}})
+
+    def test_partly_written_record(self):
+        with namedTemporaryDir() as store, self.patch():
+            taskJournal.TaskJournal(store).save("task-1",
+                                                {".task": ["id = task-1"]})
+            # A record without the line ending
+            with open(os.path.join(store, taskJournal.JOURNAL_NAME),
+                      "a") as f:
+                f.write('{"id": "task-2", "parts": {}}')
+            journal = taskJournal.TaskJournal(store)
+            self.assertEqual(journal.load(),
+                             {"task-1": {".task": ["id = task-1"]}})
+            journal.save("task-3", {".task": ["id = task-3"]})
+            self.assertEqual(sorted(taskJournal.TaskJournal(store).load()),
+                             ["task-1", "task-3"])
+
+
+class EnabledTests(TestCaseBase):
+
+    JOURNAL_CONFIG = make_config([('irs', 'task_journal', 'true')])
+
+    def test_disabled(self):
+        with MonkeyPatchScope([(taskJournal, "config",
+                                make_config([('irs', 'task_journal',
+                                              'false')])),
+                               (oop, "_oopImpl", oop.RFH)]):
+            self.assertFalse(taskJournal.enabled())
+
+    def test_rfh(self):
+        with MonkeyPatchScope([(taskJournal, "config", self.JOURNAL_CONFIG),
+                               (oop, "_oopImpl", oop.RFH)]):
+            self.assertTrue(taskJournal.enabled())
+
+    def test_ioprocess(self):
+        with MonkeyPatchScope([(taskJournal, "config", self.JOURNAL_CONFIG),
+                               (oop, "_oopImpl", oop.IOPROC)]):
+            self.assertFalse(taskJournal.enabled())
+
+
+class TaskPartsTests(TestCaseBase):
+
+    def test_load_parts(self):
+        t = task.Task(None, name="copy", tag="spm")
+        t.state.moveto(task.State.preparing)
+        t.state.moveto(task.State.finished, force=True)
+        t.result = task.TaskResult(0, "done", "result")
+        t.jobs.append(task.Job("job-1", None))
+        t.recoveries.append(task.Recovery("rec-1", "mod", "obj", "fn",
+                                          ["arg"]))
+        parts = t._dumpParts()
+
+        loaded = task.Task.loadJournalTask(t.id, parts)
+        self.assertEqual(loaded.name, "copy")
+        self.assertEqual(loaded.state, task.State.finished)
+        self.assertEqual(loaded.result.message, "done")
+        self.assertEqual([j.name for j in loaded.jobs], ["job-1"])
+        self.assertEqual([r.name for r in loaded.recoveries], ["rec-1"])
+
+    def test_missing_part(self):
+        t = task.Task(None)
+        t.state.moveto(task.State.preparing)
+        t.jobs.append(task.Job("job-1", None))
+        parts = t._dumpParts()
+        del parts[task.JOB_EXT + task.NUM_SEP + "0"]
+        self.assertRaises(task.se.TaskMetaDataLoadError,
+                          task.Task.loadJournalTask, t.id, parts)
@@ -19,6 +19,7 @@
 
 from testlib import VdsmTestCase as TestCaseBase
 from vdsm.tool.dump_volume_chains import (_build_volume_chain, _BLANK_UUID,
+                                          _get_images_volumes,
                                           OrphanVolumes, ChainLoopError,
                                           NoBaseVolume, DuplicateParentError)
 
@@ -54,3 +55,28 @@ class GetVolumeChainTests(TestCaseBase):
         with self.assertRaises(DuplicateParentError):
             _build_volume_chain(
                 [(_BLANK_UUID, 'a'), ('a', 'b'), ('a', 'c')])
+
+
+class GetImagesVolumesTests(TestCaseBase):
+    def test_images(self):
+        volumes_info = {
+            'a': {'image': 'img-1', 'parent': _BLANK_UUID},
+            'b': {'image': 'img-1', 'parent': 'a'},
+            'c': {'image': 'img-2', 'parent': _BLANK_UUID},
+        }
+        images_volumes = _get_images_volumes(volumes_info)
+        self.assertEqual(sorted(images_volumes['img-1']), ['a', 'b'])
+        self.assertEqual(images_volumes['img-2'], ['c'])
+
+    def test_template(self):
+        volumes_info = {
+            'template': {'image': 'img-1', 'parent': _BLANK_UUID},
+            'a': {'image': 'img-2', 'parent': 'template'},
+        }
+        images_volumes = _get_images_volumes(volumes_info)
+        self.assertEqual(images_volumes['img-1'], ['template'])
+        self.assertEqual(sorted(images_volumes['img-2']), ['a', 'template'])
+
+    def test_invalid_volume(self):
+        volumes_info = {'a': {'status': 'INVALID'}}
+        self.assertEqual(_get_images_volumes(volumes_info), {})
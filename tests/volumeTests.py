@@ -22,9 +22,11 @@ import shutil
 import tempfile
 import uuid
 
+from monkeypatch import MonkeyPatch
 from testlib import VdsmTestCase as TestCaseBase
 
-from storage import blockSD, fileSD, outOfProcess
+from storage import blockSD, fileSD, lvm, outOfProcess
+from storage import storage_exception as se
 
 SDBLKSZ = 512
 
@@ -75,27 +77,132 @@ class FakeBlockStorageDomain(blockSD.BlockStorageDomain):
         self.stat = None
         self.logBlkSize = SDBLKSZ
         self.occupiedMetadataSlots = occupiedMetadataSlots
+        self.scans = 0
+        self._metadataSlots = blockSD.MetadataSlotMap(
+            self._metadataSlotsBase())
 
     def getVersion(self):
         return self.DOMAIN_VERSION
 
     def _getOccupiedMetadataSlots(self):
+        self.scans += 1
         return self.occupiedMetadataSlots
 
 
+class FakeLvsGeneration(object):
+
+    def __init__(self):
+        self.generation = 0
+
+    def __call__(self, vgName):
+        return self.generation
+
+
 class BlockDomainMetadataSlotTests(TestCaseBase):
     OCCUPIED_METADATA_SLOTS = [(4, 1), (7, 1)]
     EXPECTED_METADATA_SLOT = 5
 
+    lvsGeneration = FakeLvsGeneration()
+
     def setUp(self):
+        self.lvsGeneration.generation = 0
         self.blksd = FakeBlockStorageDomain(str(uuid.uuid4()),
                                             self.OCCUPIED_METADATA_SLOTS)
 
+    @MonkeyPatch(lvm, "lvsGeneration", lvsGeneration)
     def testMetaSlotSelection(self):
         with self.blksd.acquireVolumeMetadataSlot(None, 1) as mdSlot:
             self.assertEqual(mdSlot, self.EXPECTED_METADATA_SLOT)
 
+    @MonkeyPatch(lvm, "lvsGeneration", lvsGeneration)
     def testMetaSlotLock(self):
         with self.blksd.acquireVolumeMetadataSlot(None, 1):
             acquired = self.blksd._lvTagMetaSlotLock.acquire(False)
             self.assertEqual(acquired, False)
+
+    @MonkeyPatch(lvm, "lvsGeneration", lvsGeneration)
+    def testMetaSlotAllocation(self):
+        slots = []
+        for i in range(4):
+            with self.blksd.acquireVolumeMetadataSlot(None, 1) as mdSlot:
+                slots.append(mdSlot)
+        # The gap before slot 7 is too small for the second slot
+        self.assertEqual(slots, [5, 8, 9, 10])
+        self.assertEqual(self.blksd.scans, 1)
+
+    @MonkeyPatch(lvm, "lvsGeneration", lvsGeneration)
+    def testMetaSlotRebuild(self):
+        with self.blksd.acquireVolumeMetadataSlot(None, 1):
+            pass
+        self.lvsGeneration.generation += 1
+        with self.blksd.acquireVolumeMetadataSlot(None, 1) as mdSlot:
+            self.assertEqual(mdSlot, self.EXPECTED_METADATA_SLOT)
+        self.assertEqual(self.blksd.scans, 2)
+
+    @MonkeyPatch(lvm, "lvsGeneration", lvsGeneration)
+    def testMetaSlotRebuiltOnError(self):
+        try:
+            with self.blksd.acquireVolumeMetadataSlot(None, 1):
+                raise RuntimeError("Cannot change tags")
+        except RuntimeError:
+            pass
+        with self.blksd.acquireVolumeMetadataSlot(None, 1) as mdSlot:
+            self.assertEqual(mdSlot, self.EXPECTED_METADATA_SLOT)
+        self.assertEqual(self.blksd.scans, 2)
+
+    @MonkeyPatch(lvm, "lvsGeneration", lvsGeneration)
+    def testMetaSlotFreedOnNoSpace(self):
+        try:
+            with self.blksd.acquireVolumeMetadataSlot(None, 1):
+                raise se.NoSpaceLeftOnDomain(self.blksd.sdUUID)
+        except se.NoSpaceLeftOnDomain:
+            pass
+        with self.blksd.acquireVolumeMetadataSlot(None, 1) as mdSlot:
+            self.assertEqual(mdSlot, self.EXPECTED_METADATA_SLOT)
+        self.assertEqual(self.blksd.scans, 1)
+
+
+class MetadataSlotMapTests(TestCaseBase):
+
+    def test_empty(self):
+        slots = blockSD.MetadataSlotMap(4)
+        slots.rebuild([], 0)
+        self.assertEqual([slots.allocate(1) for i in range(3)], [4, 5, 6])
+
+    def test_gaps(self):
+        slots = blockSD.MetadataSlotMap(4)
+        slots.rebuild([(4, 1), (6, 1), (10, 2)], 0)
+        # Slots are allocated only in gaps larger than the slot size, like
+        # getFreeMetadataSlot always did.
+        self.assertEqual([slots.allocate(1) for i in range(4)], [7, 8, 12, 13])
+
+    def test_slot_size(self):
+        slots = blockSD.MetadataSlotMap(4)
+        slots.rebuild([(4, 1), (8, 1), (12, 1)], 0)
+        self.assertEqual(slots.allocate(2), 5)
+        self.assertEqual(slots.allocate(1), 9)
+        self.assertEqual(slots.allocate(2), 13)
+
+    def test_free(self):
+        slots = blockSD.MetadataSlotMap(4)
+        slots.rebuild([(4, 1)], 0)
+        allocated = [slots.allocate(1) for i in range(3)]
+        slots.free(allocated[0], 1)
+        slots.free(allocated[1], 1)
+        self.assertEqual(slots.allocate(1), allocated[0])
+
+    def test_free_last(self):
+        slots = blockSD.MetadataSlotMap(4)
+        slots.rebuild([(4, 1)], 0)
+        slot = slots.allocate(1)
+        slots.free(slot, 1)
+        self.assertEqual(slots.allocate(1), slot)
+
+    def test_valid(self):
+        slots = blockSD.MetadataSlotMap(4)
+        self.assertFalse(slots.valid(0))
+        slots.rebuild([], 0)
+        self.assertTrue(slots.valid(0))
+        self.assertFalse(slots.valid(1))
+        slots.invalidate()
+        self.assertFalse(slots.valid(0))
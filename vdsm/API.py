@@ -1033,6 +1033,9 @@ class StorageDomain(APIBase):
     def getVolumes(self, storagepoolID, imageID=Image.BLANK_UUID):
         return self._irs.getVolumesList(self._UUID, storagepoolID, imageID)
 
+    def getVolumesInfo(self, storagepoolID, imageID=Image.BLANK_UUID):
+        return self._irs.getVolumesInfo(self._UUID, storagepoolID, imageID)
+
     def setDescription(self, description):
         return self._irs.setStorageDomainDescription(self._UUID, description)
 
@@ -1602,8 +1605,8 @@ class Global(APIBase):
     def getConnectedStoragePools(self):
         return self._irs.getConnectedStoragePoolsList()
 
-    def getStorageRepoStats(self):
-        return self._irs.repoStats()
+    def getStorageRepoStats(self, options=None):
+        return self._irs.repoStats(options)
 
     def startMonitoringDomain(self, sdUUID, hostID):
         return self._irs.startMonitoringDomain(sdUUID, hostID)
@@ -680,6 +680,11 @@ class BindingXMLRPC(object):
         domain = API.StorageDomain(sdUUID)
         return domain.getVolumes(spUUID, imgUUID)
 
+    def domainGetVolumesInfo(self, sdUUID, spUUID,
+                             imgUUID=API.Image.BLANK_UUID):
+        domain = API.StorageDomain(sdUUID)
+        return domain.getVolumesInfo(spUUID, imgUUID)
+
     def domainSetDescription(self, sdUUID, description, options=None):
         domain = API.StorageDomain(sdUUID)
         return domain.setDescription(description)
@@ -966,7 +971,7 @@ class BindingXMLRPC(object):
 
     def storageRepoGetStats(self, options=None):
         api = API.Global()
-        return api.getStorageRepoStats()
+        return api.getStorageRepoStats(options)
 
     def startMonitoringDomain(self, sdUUID, hostID, options=None):
         api = API.Global()
@@ -1075,6 +1080,7 @@ class BindingXMLRPC(object):
                 (self.domainGetInfo, 'getStorageDomainInfo'),
                 (self.domainGetStats, 'getStorageDomainStats'),
                 (self.domainGetVolumes, 'getVolumesList'),
+                (self.domainGetVolumesInfo, 'getVolumesInfo'),
                 (self.domainSetDescription, 'setStorageDomainDescription'),
                 (self.domainValidate, 'validateStorageDomain'),
                 (self.imageDelete, 'deleteImage'),
@@ -395,6 +395,62 @@ def metadataValidity(vg):
     return {'mdathreshold': mda_free_ok, 'mdavalid': mda_size_ok}
 
 
+class MetadataSlotMap(object):
+    """
+    Map of the volume metadata slots in the domain metadata LV, with one
+    byte per slot, set if the slot is occupied.
+
+    A slot of slotSize blocks is allocated in the first gap of more than
+    slotSize free blocks after base, or after the last occupied slot.
+    Slots are freed only by rebuilding the map, so every slot size keeps
+    the offset where the last search for a gap ended, making allocation
+    O(1) amortized.
+    """
+
+    def __init__(self, base):
+        self._base = base
+        self._slots = None
+        self._hints = {}
+        self.generation = None
+
+    def valid(self, generation):
+        return self._slots is not None and generation == self.generation
+
+    def rebuild(self, occupiedSlots, generation):
+        self._slots = bytearray()
+        self._hints = {}
+        for offset, size in occupiedSlots:
+            self._occupy(offset, size)
+        self.generation = generation
+
+    def invalidate(self):
+        self._slots = None
+
+    def allocate(self, slotSize):
+        start = max(self._base, self._hints.get(slotSize, self._base))
+        slot = self._slots.find("\0" * (slotSize + 1), start)
+        if slot == -1:
+            slot = max(self._base, len(self._slots))
+        self._occupy(slot, slotSize)
+        self._hints[slotSize] = slot + slotSize
+        return slot
+
+    def free(self, slot, slotSize):
+        if self._slots is None:
+            return
+        self._slots[slot:slot + slotSize] = "\0" * slotSize
+        while self._slots and not self._slots[-1]:
+            self._slots.pop()
+        for size, hint in self._hints.items():
+            self._hints[size] = min(hint, slot)
+
+    def _occupy(self, offset, size):
+        end = offset + size
+        if end > len(self._slots):
+            self._slots.extend("\0" * (end - len(self._slots)))
+        self._slots[offset:end] = "\1" * size
+
+
 class BlockStorageDomain(sd.StorageDomain):
     mountpoint = os.path.join(sd.StorageDomain.storage_repository,
                               sd.DOMAIN_MNT_POINT, sd.BLOCKSD_DIR)
@@ -424,6 +480,7 @@ class BlockStorageDomain(sd.StorageDomain):
         # _extendlock is used to prevent race between
         # VG extend and LV extend.
         self._extendlock = threading.Lock()
+        self._metadataSlots = MetadataSlotMap(self._metadataSlotsBase())
         self.imageGarbageCollector()
         self._registerResourceNamespaces()
         self._lastUncachedSelftest = 0
@@ -620,6 +677,58 @@ class BlockStorageDomain(sd.StorageDomain):
 
     getVAllocSize = getVSize
 
+    def _getVolumesInfo(self, volImgs):
+        lvs = dict((lv.name, lv) for lv in lvm.getLV(self.sdUUID)
+                   if lv.name in volImgs)
+
+        tags = {}  # {volUUID: {tagPrefix: value}}
+        for volUUID in volImgs:
+            tags[volUUID] = volTags = {}
+            lv = lvs.get(volUUID)
+            if lv is None:
+                continue
+            for tag in lv.tags:
+                for prefix in (blockVolume.TAG_PREFIX_MD,
+                               blockVolume.TAG_PREFIX_PARENT,
+                               blockVolume.TAG_PREFIX_IMAGE):
+                    if tag.startswith(prefix):
+                        volTags[prefix] = tag[len(prefix):]
+
+        # Read the metadata slots of all the volumes at once
+        slots = []  # [(volUUID, offset)]
+        for volUUID, volTags in tags.iteritems():
+            if blockVolume.TAG_PREFIX_MD in volTags:
+                slots.append((volUUID,
+                              int(volTags[blockVolume.TAG_PREFIX_MD])))
+        blocks = {}
+        if slots:
+            ranges = [(offset * blockVolume.VOLUME_METASIZE,
+                       blockVolume.VOLUME_METASIZE) for _, offset in slots]
+            try:
+                blocks = dict(zip(
+                    (volUUID for volUUID, _ in slots),
+                    misc.readblocks(lvm.lvPath(self.sdUUID, sd.METADATA),
+                                    ranges)))
+            except se.StorageException:
+                self.log.error("Cannot read volumes metadata in VG %s",
+                               self.sdUUID, exc_info=True)
+
+        res = {}
+        for volUUID, volTags in tags.iteritems():
+            meta = None
+            if volUUID in blocks:
+                try:
+                    meta = volume.parseMetadata(blocks[volUUID])
+                except ValueError as e:
+                    self.log.warning("Invalid metadata for volume %s/%s: %s",
+                                     self.sdUUID, volUUID, e)
+            lv = lvs.get(volUUID)
+            size = None if lv is None else int(lv.size)
+            res[volUUID] = volume.makeInfo(
+                volUUID, meta, volTags.get(blockVolume.TAG_PREFIX_PARENT),
+                volTags.get(blockVolume.TAG_PREFIX_IMAGE), size, size)
+        return res
+
     def validateCreateVolumeParams(self, volFormat, srcVolUUID,
                                    preallocate=None):
         super(BlockStorageDomain, self).validateCreateVolumeParams(
@@ -722,7 +831,18 @@ class BlockStorageDomain(sd.StorageDomain):
             if self.getVersion() in VERS_METADATA_LV:
                 yield self.getVolumeMetadataOffsetFromPvMapping(vol_name)
             else:
-                yield self.getFreeMetadataSlot(slotSize)
+                slot = self.getFreeMetadataSlot(slotSize)
+                try:
+                    yield slot
+                except se.NoSpaceLeftOnDomain:
+                    # Raised before the slot was used (see formatConverter)
+                    self._metadataSlots.free(slot, slotSize)
+                    raise
+                except Exception:
+                    # The slot tag may have been written even if the
+                    # command failed, rebuild the map from the LV tags.
+                    self._metadataSlots.invalidate()
+                    raise
 
     def _getOccupiedMetadataSlots(self):
         stripPrefix = lambda s, pfx: s[len(pfx):]
@@ -756,21 +876,29 @@ class BlockStorageDomain(sd.StorageDomain):
         occupiedSlots.sort(key=itemgetter(0))
         return occupiedSlots
 
-    def getFreeMetadataSlot(self, slotSize):
-        occupiedSlots = self._getOccupiedMetadataSlots()
-
+    def _metadataSlotsBase(self):
         # It might look weird skipping the sd metadata when it has been moved
         # to tags. But this is here because domain metadata and volume metadata
         # look the same. The domain might get confused and think it has lv
         # metadata if it finds something is written in that area.
-        freeSlot = (SD_METADATA_SIZE + self.logBlkSize - 1) / self.logBlkSize
-
-        for offset, size in occupiedSlots:
-            if offset - freeSlot > slotSize:
-                break
+        return (SD_METADATA_SIZE + self.logBlkSize - 1) / self.logBlkSize
 
-            freeSlot = offset + size
+    def getFreeMetadataSlot(self, slotSize):
+        """
+        Allocate a free metadata slot. Must be called with
+        _lvTagMetaSlotLock held.
 
+        The slot map is built from the LV tags, and rebuilt when LVs were
+        removed, or the VG was modified by another host.
+        """
+        generation = lvm.lvsGeneration(self.sdUUID)
+        if not self._metadataSlots.valid(generation):
+            self.log.debug("Building metadata slot map of VG %s",
+                           self.sdUUID)
+            self._metadataSlots.rebuild(self._getOccupiedMetadataSlots(),
+                                        generation)
+
+        freeSlot = self._metadataSlots.allocate(slotSize)
         self.log.debug("Found freeSlot %s in VG %s", freeSlot, self.sdUUID)
         return freeSlot
 
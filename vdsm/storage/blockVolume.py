@@ -589,14 +589,7 @@ class BlockVolume(volume.Volume):
         try:
             meta = misc.readblock(lvm.lvPath(vgname, sd.METADATA),
                                   offs * VOLUME_METASIZE, VOLUME_METASIZE)
-            out = {}
-            for l in meta:
-                if l.startswith("EOF"):
-                    return out
-                if l.find("=") < 0:
-                    continue
-                key, value = l.split("=")
-                out[key.strip()] = value.strip()
+            out = volume.parseMetadata(meta)
 
         except Exception as e:
             self.log.error(e, exc_info=True)
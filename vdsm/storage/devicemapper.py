@@ -20,15 +20,29 @@
 
 import os
 import misc
+from array import array
 from glob import glob
 import errno
+import fcntl
+import logging
+import platform
 import re
+import struct
+import threading
 
 from supervdsm import getProxy
+from vdsm import utils
+from vdsm.config import config
 from vdsm.constants import EXT_DMSETUP
 
 DMPATH_PREFIX = "/dev/mapper/"
 
+_SYS_BLOCK = "/sys/block"
+_SYS_DEV_BLOCK = "/sys/dev/block"
+_DM_CONTROL = "/dev/mapper/control"
+
+log = logging.getLogger("Storage.DeviceMapper")
+
 
 def getDmId(deviceMultipathName):
     devlinkPath = os.path.join(DMPATH_PREFIX, deviceMultipathName)
@@ -42,8 +56,8 @@ def getDmId(deviceMultipathName):
 
 
 def findDev(major, minor):
-    return os.path.basename(os.path.realpath('/sys/dev/block/%d:%d' %
-                                             (major, minor)))
+    return os.path.basename(os.path.realpath(
+        os.path.join(_SYS_DEV_BLOCK, '%d:%d' % (major, minor))))
 
 
 def getSysfsPath(devName):
@@ -147,13 +161,135 @@ def removeMappingsHoldingDevice(slaveName):
 
 PATH_STATUS_RE = re.compile(r"(?P<devnum>\d+:\d+)\s+(?P<status>[AF])")
 
+_PATH_STATUS = {"A": "active", "F": "failed"}
+
+# Device mapper ioctl interface, see linux/dm-ioctl.h
+
+DM_VERSION = (4, 0, 0)
+DM_TABLE_STATUS_CMD = 12
+DM_BUFFER_FULL_FLAG = 1 << 8
+
+# struct dm_ioctl
+DM_IOCTL_FORMAT = "=3IIIIiIIIQ128s129s7s"
+DM_IOCTL_SIZE = struct.calcsize(DM_IOCTL_FORMAT)
+
+# struct dm_target_spec, followed by the target status string
+DM_TARGET_SPEC_FORMAT = "=QQiI16s"
+DM_TARGET_SPEC_SIZE = struct.calcsize(DM_TARGET_SPEC_FORMAT)
+
+DM_STATUS_BUFFER_SIZE = 16 * 1024
+
+
+def _ioctlRequest(nr, size):
+    """
+    Return the _IOWR(0xfd, nr, size) ioctl request number
+    """
+    if platform.machine().startswith("ppc"):
+        readWrite, sizeShift, dirShift = 6, 16, 29
+    else:
+        readWrite, sizeShift, dirShift = 3, 16, 30
+    return (readWrite << dirShift) | (size << sizeShift) | (0xfd << 8) | nr
+
+
+DM_TABLE_STATUS = _ioctlRequest(DM_TABLE_STATUS_CMD, DM_IOCTL_SIZE)
+
+
+def _tableStatus(control, uuid):
+    """
+    Return a list of (target type, status) of the active table of the device
+    with uuid, using the DM_TABLE_STATUS ioctl on the device mapper control
+    file descriptor.
+    """
+    size = DM_STATUS_BUFFER_SIZE
+    while True:
+        header = struct.pack(DM_IOCTL_FORMAT, DM_VERSION[0], DM_VERSION[1],
+                             DM_VERSION[2], size, DM_IOCTL_SIZE, 0, 0, 0, 0,
+                             0, 0, "", uuid, "")
+        buf = array("B", header + "\0" * (size - DM_IOCTL_SIZE))
+        fcntl.ioctl(control, DM_TABLE_STATUS, buf, True)
+        data = buf.tostring()
+        fields = struct.unpack(DM_IOCTL_FORMAT, data[:DM_IOCTL_SIZE])
+        dataStart, targetCount, flags = fields[4], fields[5], fields[7]
+        if not flags & DM_BUFFER_FULL_FLAG:
+            return _parseTargets(data[dataStart:], targetCount)
+        size *= 2
+
+
+def _parseTargets(data, count):
+    """
+    Parse count struct dm_target_spec and their status strings in data,
+    returned by the DM_TABLE_STATUS ioctl.
+    """
+    targets = []
+    offset = 0
+    for _ in range(count):
+        start, length, status, nextOffset, targetType = struct.unpack_from(
+            DM_TARGET_SPEC_FORMAT, data, offset)
+        paramsStart = offset + DM_TARGET_SPEC_SIZE
+        paramsEnd = data.index("\0", paramsStart)
+        targets.append((targetType.rstrip("\0"), data[paramsStart:paramsEnd]))
+        offset = nextOffset
+    return targets
+
+
+def _iterMultipathUUIDs():
+    for uuidFile in glob(os.path.join(_SYS_BLOCK, "dm-*", "dm", "uuid")):
+        try:
+            with open(uuidFile) as f:
+                uuid = f.read().strip()
+        except (OSError, IOError):
+            continue
+        if uuid.startswith("mpath-"):
+            yield uuid
+
+
+def _parsePathsStatus(status, res):
+    for m in PATH_STATUS_RE.finditer(status):
+        devNum, pathStatus = m.groups()
+        physdevName = findDev(*[int(i) for i in devNum.split(":")])
+        res[physdevName] = _PATH_STATUS[pathStatus]
+
 
 def _getPathsStatus():
+    """
+    Return the status of the paths of all multipath devices, reading the
+    devices status with device mapper ioctls. Must run as root.
+    """
+    try:
+        control = os.open(_DM_CONTROL, os.O_RDWR)
+    except OSError as e:
+        log.warning("Cannot open %s (%s), using dmsetup", _DM_CONTROL, e)
+        return _getPathsStatusDmsetup()
+
+    res = {}
+    try:
+        for uuid in _iterMultipathUUIDs():
+            try:
+                targets = _tableStatus(control, uuid)
+            except (OSError, IOError) as e:
+                # Device removed since listed
+                if e.errno == errno.ENXIO:
+                    continue
+                raise
+            for targetType, status in targets:
+                if targetType == "multipath":
+                    _parsePathsStatus(status, res)
+    finally:
+        os.close(control)
+
+    return res
+
+
+def _getPathsStatusDmsetup():
     cmd = [EXT_DMSETUP, "status"]
     rc, out, err = misc.execCmd(cmd)
     if rc != 0:
         raise Exception("Could not get device statuses")
 
+    return _parseDmsetupStatus(out)
+
+
+def _parseDmsetupStatus(out):
     res = {}
     for statusLine in out:
         try:
@@ -165,13 +301,37 @@ def _getPathsStatus():
             else:
                 raise
 
-        for m in PATH_STATUS_RE.finditer(statusLine):
-            devNum, status = m.groups()
-            physdevName = findDev(*[int(i) for i in devNum.split(":")])
-            res[physdevName] = {"A": "active", "F": "failed"}[status]
+        _parsePathsStatus(statusLine, res)
 
     return res
 
 
+class _PathsStatusCache(object):
+    """
+    Keep the paths status for timeout seconds. Concurrent callers wait for
+    a single update.
+    """
+
+    def __init__(self, timeout, clock=utils.monotonic_time):
+        self._timeout = timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._status = None
+        self._updated = None
+
+    def get(self, update):
+        with self._lock:
+            if (self._status is None or
+                    self._clock() - self._updated >= self._timeout):
+                updated = self._clock()
+                self._status = update()
+                self._updated = updated
+            return self._status
+
+
+_pathsStatusCache = _PathsStatusCache(
+    config.getfloat("irs", "dm_paths_status_timeout"))
+
+
 def getPathsStatus():
-    return getProxy().getPathsStatus()
+    return _pathsStatusCache.get(getProxy().getPathsStatus)
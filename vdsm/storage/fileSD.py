@@ -25,11 +25,15 @@ import logging
 import glob
 import fnmatch
 import re
+import stat
+import threading
+import time
 
 import sd
 import storage_exception as se
 import fileUtils
 import fileVolume
+import volume
 import misc
 import outOfProcess as oop
 from remoteFileHandler import Timeout
@@ -145,6 +149,113 @@ FileSDMetadata = lambda metafile: DictValidator(
     PersistentDict(FileMetadataRW(metafile)), FILE_SD_MD_FIELDS)
 
 
+class VolumeIndex(object):
+    """
+    Keep the volumes found in every image directory of a file domain.
+
+    The image directories are listed with their stat in one call, and an image
+    directory is listed again only if it was modified since it was listed;
+    creating, removing or renaming a volume changes the directory mtime.
+    When many directories were modified (e.g. on the first scan), all the
+    directories are listed in one call instead.
+
+    A directory modified less than RACY_INTERVAL seconds before it was
+    listed is listed again on the next scan, since a file system with one
+    second timestamps may not show another change in the same second.
+
+    If the out of process implementation cannot stat many paths in one call
+    (ioprocess), stating the directories would cost a call per directory, so
+    the volumes of all the directories are listed with a single glob on every
+    scan instead, and image directories without volumes are not reported.
+    """
+    log = logging.getLogger("Storage.VolumeIndex")
+
+    RACY_INTERVAL = 1.0
+
+    # List all the directories in one call if more than this part of them
+    # were modified.
+    FULL_SCAN_RATIO = 0.1
+
+    def __init__(self, imagesDir):
+        self._imagesDir = imagesDir
+        self._lock = threading.Lock()
+        self._entries = {}  # {imgUUID: (stat key, (volUUIDs,))}
+
+    def images(self, procPool):
+        """
+        Return dict {imgUUID: (volUUIDs,)} of all the image directories,
+        including removed images, using procPool to access the domain.
+        """
+        if not oop.batchesBulkOperations():
+            return self._listAll(procPool)
+
+        with self._lock:
+            self._refresh(procPool)
+            return dict((imgUUID, vols)
+                        for imgUUID, (key, vols) in self._entries.iteritems())
+
+    def _listAll(self, procPool):
+        pattern = os.path.join(self._imagesDir, "*",
+                               "*" + fileVolume.META_FILEEXT)
+        volumes = collections.defaultdict(list)
+        for metaPath in procPool.glob.glob(pattern):
+            head, tail = os.path.split(metaPath)
+            volumes[os.path.basename(head)].append(os.path.splitext(tail)[0])
+        return dict((imgUUID, tuple(vols))
+                    for imgUUID, vols in volumes.iteritems())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _refresh(self, procPool):
+        now = time.time()
+        modified = {}
+        found = set()
+
+        for path, st in procPool.globStat(os.path.join(self._imagesDir,
+                                                       "*")):
+            if not stat.S_ISDIR(st.st_mode):
+                continue
+            imgUUID = os.path.basename(path)
+            found.add(imgUUID)
+            key = (st.st_dev, st.st_ino, st.st_nlink, st.st_mtime,
+                   st.st_ctime)
+            if now - st.st_mtime < self.RACY_INTERVAL:
+                key = None
+            entry = self._entries.get(imgUUID)
+            if entry is None or entry[0] is None or entry[0] != key:
+                modified[imgUUID] = key
+
+        for imgUUID in set(self._entries) - found:
+            del self._entries[imgUUID]
+
+        if not modified:
+            return
+
+        self.log.debug("Listing %d modified image directories of %d",
+                       len(modified), len(found))
+
+        volumes = dict((imgUUID, []) for imgUUID in modified)
+        if len(modified) > len(found) * self.FULL_SCAN_RATIO:
+            patterns = [os.path.join(self._imagesDir, "*", "*" +
+                                     fileVolume.META_FILEEXT)]
+        else:
+            patterns = [os.path.join(self._imagesDir, imgUUID, "*" +
+                                     fileVolume.META_FILEEXT)
+                        for imgUUID in modified]
+
+        for pattern in patterns:
+            for metaPath in procPool.glob.glob(pattern):
+                head, tail = os.path.split(metaPath)
+                imgUUID = os.path.basename(head)
+                if imgUUID in volumes:
+                    volumes[imgUUID].append(os.path.splitext(tail)[0])
+
+        for imgUUID, key in modified.iteritems():
+            self._entries[imgUUID] = (key, tuple(volumes[imgUUID]))
+
+
 class FileStorageDomain(sd.StorageDomain):
     def __init__(self, domainPath):
         # Using glob might look like the simplest thing to do but it isn't
@@ -162,6 +273,8 @@ class FileStorageDomain(sd.StorageDomain):
         metadata = FileSDMetadata(self.metafile)
         domaindir = os.path.join(self.mountpoint, sdUUID)
         sd.StorageDomain.__init__(self, sdUUID, domaindir, metadata)
+        self._volumeIndex = VolumeIndex(
+            os.path.join(domaindir, sd.DOMAIN_IMAGES))
 
         if not self.oop.fileUtils.pathExists(self.metafile):
             raise se.StorageDomainMetadataNotFound(sdUUID, self.metafile)
@@ -268,24 +381,24 @@ class FileStorageDomain(sd.StorageDomain):
         extension.
         """
         basedir = self.getIsoDomainImagesDir()
-        filesList = self.oop.simpleWalk(basedir)
+        filesList = self.oop.walkStat(basedir)
 
         if pattern != '*':
             if caseSensitive:
-                filesList = fnmatch.filter(filesList, pattern)
+                filesList = [(f, st) for f, st in filesList
+                             if fnmatch.fnmatchcase(f, pattern)]
             else:
                 regex = fnmatch.translate(pattern)
                 reobj = re.compile(regex, re.IGNORECASE)
-                filesList = [f for f in filesList if reobj.match(f)]
+                filesList = [(f, st) for f, st in filesList if reobj.match(f)]
 
         filesDict = {}
         filePrefixLen = len(basedir) + 1
-        for entry in filesList:
-            st = self.oop.os.stat(entry)
+        for entry, st in filesList:
             stats = {'size': str(st.st_size), 'ctime': str(st.st_ctime)}
 
             try:
-                self.oop.fileUtils.validateQemuReadable(entry)
+                fileUtils.validateQemuReadableStat(st)
                 stats['status'] = 0  # Status OK
             except OSError as e:
                 if e.errno != errno.EACCES:
@@ -317,6 +430,35 @@ class FileStorageDomain(sd.StorageDomain):
 
         return stat.st_blocks * ST_BYTES_PER_BLOCK
 
+    def _getVolumesInfo(self, volImgs):
+        items = volImgs.items()
+        volPaths = [os.path.join(self.getImagePath(imgUUID), volUUID)
+                    for volUUID, imgUUID in items]
+        stats = self.oop.statMany(volPaths)
+        metas = self.oop.readLinesMany(
+            [volPath + fileVolume.META_FILEEXT for volPath in volPaths], True)
+
+        res = {}
+        for (volUUID, imgUUID), st, lines in zip(items, stats, metas):
+            meta = parent = image = None
+            if lines is not None:
+                try:
+                    meta = volume.parseMetadata(lines)
+                    parent = meta[volume.PUUID]
+                    image = meta[volume.IMAGE]
+                except (ValueError, KeyError) as e:
+                    self.log.warning("Invalid metadata for volume %s/%s: %s",
+                                     imgUUID, volUUID, e)
+                    meta = None
+            if st is None:
+                apparentsize = truesize = None
+            else:
+                apparentsize = st.st_size
+                truesize = st.st_blocks * ST_BYTES_PER_BLOCK
+            res[volUUID] = volume.makeInfo(volUUID, meta, parent, image,
+                                           apparentsize, truesize)
+        return res
+
     def getVolumeLease(self, imgUUID, volUUID):
         """
         Return the volume lease (leasePath, leaseOffset)
@@ -344,18 +486,17 @@ class FileStorageDomain(sd.StorageDomain):
         """
         Fetch the set of the Image UUIDs in the SD.
         """
-        # Get Volumes of an image
-        pattern = os.path.join(self.storage_repository,
-                               # ISO domains don't have images,
-                               # we can assume single domain
-                               self.getPools()[0],
-                               self.sdUUID, sd.DOMAIN_IMAGES)
-        pattern = os.path.join(pattern, constants.UUID_GLOB_PATTERN)
-        files = self.oop.glob.glob(pattern)
+        if oop.batchesBulkOperations():
+            return set(fnmatch.filter(self._volumeIndex.images(self.oop),
+                                      constants.UUID_GLOB_PATTERN))
+
+        # The volume index does not report image directories without volumes
+        pattern = os.path.join(self.domaindir, sd.DOMAIN_IMAGES,
+                               constants.UUID_GLOB_PATTERN)
         images = set()
-        for i in files:
-            if self.oop.os.path.isdir(i):
-                images.add(os.path.basename(i))
+        for path in self.oop.glob.glob(pattern):
+            if self.oop.os.path.isdir(path):
+                images.add(os.path.basename(path))
         return images
 
     def getImagePath(self, imgUUID):
@@ -422,17 +563,8 @@ class FileStorageDomain(sd.StorageDomain):
         Template volumes have no parent, and thus we report BLANK_UUID as their
         parentUUID.
         """
-        volMetaPattern = os.path.join(self.mountpoint, self.sdUUID,
-                                      sd.DOMAIN_IMAGES, "*", "*.meta")
-        volMetaPaths = self.oop.glob.glob(volMetaPattern)
-
-        # First create mapping from images to volumes
-        images = collections.defaultdict(list)
-        for metaPath in volMetaPaths:
-            head, tail = os.path.split(metaPath)
-            volUUID, volExt = os.path.splitext(tail)
-            imgUUID = os.path.basename(head)
-            images[imgUUID].append(volUUID)
+        # First get mapping from images to volumes
+        images = self._volumeIndex.images(self.oop)
 
         # Using images to volumes mapping, we can create volumes to images
         # mapping, detecting template volumes and template images, based on
@@ -577,6 +709,9 @@ class FileStorageDomain(sd.StorageDomain):
             if e.errno == errno.ESTALE:
                 raise se.FileStorageDomainStaleNFSHandle
             raise se.StorageDomainAccessError(self.sdUUID)
+        oopStats = oop.getProcessPoolStats(self.sdUUID)
+        if oopStats is not None:
+            stats['oopStats'] = oopStats
         return stats
 
     def mountMaster(self):
@@ -676,43 +811,109 @@ def _getMountsList(pattern="*"):
     return mntList
 
 
-def scanDomains(pattern="*"):
-    log = logging.getLogger("Storage.scanDomains")
+def _collectMetaFiles(possibleDomain):
+    metaFiles = oop.getProcessPool(possibleDomain).glob.glob(
+        os.path.join(possibleDomain,
+                     constants.UUID_GLOB_PATTERN,
+                     sd.DOMAIN_META_DATA))
 
-    mntList = _getMountsList(pattern)
+    for metaFile in metaFiles:
+        if (os.path.basename(os.path.dirname(metaFile)) !=
+                sd.MASTER_FS_DIR):
+            sdUUID = os.path.basename(os.path.dirname(metaFile))
 
-    def collectMetaFiles(possibleDomain):
-        try:
-            metaFiles = oop.getProcessPool(possibleDomain).glob.glob(
-                os.path.join(possibleDomain,
-                             constants.UUID_GLOB_PATTERN,
-                             sd.DOMAIN_META_DATA))
+            return (sdUUID, os.path.dirname(metaFile))
 
-            for metaFile in metaFiles:
-                if (os.path.basename(os.path.dirname(metaFile)) !=
-                        sd.MASTER_FS_DIR):
-                    sdUUID = os.path.basename(os.path.dirname(metaFile))
+    return None
 
-                    return (sdUUID, os.path.dirname(metaFile))
 
+class DomainIndex(object):
+    """
+    Keep the domain found in every mountpoint by scanDomains.
+
+    A mountpoint is scanned again only if it was modified since it was
+    scanned, detected by a stat of the mountpoint directory; creating or
+    removing a domain directory changes the mountpoint mtime and link count.
+    The index is cleared when the mount table changes.
+    """
+    log = logging.getLogger("Storage.scanDomains")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # {mountpoint: (stat key, (sdUUID, path))}
+        self._watcher = None
+
+    def scan(self, mntList):
+        if self._mountsChanged():
+            self.log.debug("Mount table changed, clearing domain index")
+            with self._lock:
+                self._entries.clear()
+
+        # Run _scanMount in extenral processes.
+        # The amount of processes that can be initiated in the same time is
+        # the amount of stuck domains we are willing to handle +1.
+        # We Use 30% of the available slots.
+        # TODO: calculate it right, now we use same value of max process per
+        #       domain.
+        for res in misc.itmap(self._scanMount, mntList,
+                              oop.HELPERS_PER_DOMAIN):
+            if res is None:
+                continue
+
+            yield res
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _scanMount(self, mountpoint):
+        try:
+            st = oop.getProcessPool(mountpoint).os.stat(mountpoint)
+            key = (st.st_dev, st.st_ino, st.st_nlink, st.st_mtime,
+                   st.st_ctime)
+
+            with self._lock:
+                entry = self._entries.get(mountpoint)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+
+            res = _collectMetaFiles(mountpoint)
         except Timeout:
-            log.warn("Metadata collection for domain path %s timedout",
-                     possibleDomain, exc_info=True)
+            self.log.warn("Metadata collection for domain path %s timedout",
+                          mountpoint, exc_info=True)
         except Exception:
-            log.warn("Could not collect metadata file for domain path %s",
-                     possibleDomain, exc_info=True)
-
-    # Run collectMetaFiles in extenral processes.
-    # The amount of processes that can be initiated in the same time is the
-    # amount of stuck domains we are willing to handle +1.
-    # We Use 30% of the available slots.
-    # TODO: calculate it right, now we use same value of max process per
-    #       domain.
-    for res in misc.itmap(collectMetaFiles, mntList, oop.HELPERS_PER_DOMAIN):
-        if res is None:
-            continue
-
-        yield res
+            self.log.warn("Could not collect metadata file for domain path %s",
+                          mountpoint, exc_info=True)
+        else:
+            with self._lock:
+                self._entries[mountpoint] = (key, res)
+            return res
+
+        with self._lock:
+            self._entries.pop(mountpoint, None)
+        return None
+
+    def _mountsChanged(self):
+        with self._lock:
+            if self._watcher is None:
+                try:
+                    self._watcher = mount.MountInfoWatcher()
+                except EnvironmentError:
+                    self.log.warning("Cannot watch mount table, the domain "
+                                     "index is cleared on every scan",
+                                     exc_info=True)
+                    self._watcher = False
+                return True
+            if self._watcher is False:
+                return True
+        return self._watcher.changed()
+
+
+_domainIndex = DomainIndex()
+
+
+def scanDomains(pattern="*"):
+    return _domainIndex.scan(_getMountsList(pattern))
 
 
 def getStorageDomainsList():
@@ -46,6 +46,11 @@ CharPointer = ctypes.POINTER(ctypes.c_char)
 _PC_REC_XFER_ALIGN = 17
 _PC_REC_MIN_XFER_SIZE = 16
 
+# readRanges() merges ranges separated by up to MAX_READ_GAP bytes into one
+# read of up to MAX_MERGED_READ bytes.
+MAX_READ_GAP = 128 * 1024
+MAX_MERGED_READ = 1024 * 1024
+
 
 class TarCopyFailed(RuntimeError):
     pass
@@ -89,9 +94,15 @@ def validateQemuReadable(targetPath):
     """
     Validate that qemu process can read file
     """
+    validateQemuReadableStat(os.stat(targetPath))
+
+
+def validateQemuReadableStat(st):
+    """
+    Validate that qemu process can read a file with stat st
+    """
     gids = (grp.getgrnam(constants.DISKIMAGE_GROUP).gr_gid,
             grp.getgrnam(constants.METADATA_GROUP).gr_gid)
-    st = os.stat(targetPath)
     if not (st.st_gid in gids and st.st_mode & stat.S_IRGRP or
             st.st_mode & stat.S_IROTH):
         raise OSError(errno.EACCES, os.strerror(errno.EACCES))
@@ -311,6 +322,57 @@ class DirectFile(object):
             ptr = CharPointer.from_buffer(pbuff)
             return ptr[:numRead]
 
+    def pread(self, n, offset):
+        """
+        Read up to n bytes at offset, without changing the file position.
+        Returns less than n bytes only at end of file.
+        """
+        if (n % 512) or (offset % 512):
+            raise ValueError("You can only read in 512 multiplies")
+
+        with self._createAlignedBuffer(n) as pbuff:
+            numRead = self._pread(pbuff, n, offset)
+            ptr = CharPointer.from_buffer(pbuff)
+            return ptr[:numRead]
+
+    def readRanges(self, ranges):
+        """
+        Read a list of (offset, size) ranges, returning a list of strings in
+        the same order.
+
+        Adjacent and nearby ranges are read using a single pread call, so
+        reading many small ranges, like volume metadata slots, costs only a
+        few system calls.
+        """
+        for offset, size in ranges:
+            if (size % 512) or (offset % 512):
+                raise ValueError("You can only read in 512 multiplies")
+
+        results = [None] * len(ranges)
+        for start, end, members in _mergeRanges(ranges):
+            data = self.pread(end - start, start)
+            for i, offset, size in members:
+                results[i] = data[offset - start:offset - start + size]
+        return results
+
+    def _pread(self, pbuff, n, offset):
+        address = ctypes.cast(pbuff, ctypes.c_void_p).value
+        total = 0
+        while total < n:
+            numRead = libc.pread(self._fd,
+                                 ctypes.c_void_p(address + total),
+                                 ctypes.c_size_t(n - total),
+                                 ctypes.c_longlong(offset + total))
+            if numRead < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                raise OSError(err, os.strerror(err))
+            if numRead == 0:
+                break
+            total += numRead
+        return total
+
     def readall(self):
         buffsize = 1024
         res = StringIO()
@@ -337,6 +399,31 @@ class DirectFile(object):
                     msg = os.strerror(err)
                     raise OSError(err, msg)
 
+    def pwrite(self, data, offset):
+        """
+        Write data at offset, without changing the file position. The length
+        of data and offset must be multiples of 512.
+        """
+        length = len(data)
+        if (length % 512) or (offset % 512):
+            raise ValueError("You can only write in 512 multiplies")
+
+        with self._createAlignedBuffer(length) as pbuff:
+            ctypes.memmove(pbuff, ctypes.c_char_p(data), length)
+            address = ctypes.cast(pbuff, ctypes.c_void_p).value
+            total = 0
+            while total < length:
+                numWritten = libc.pwrite(self._fd,
+                                         ctypes.c_void_p(address + total),
+                                         ctypes.c_size_t(length - total),
+                                         ctypes.c_longlong(offset + total))
+                if numWritten < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.EINTR:
+                        continue
+                    raise OSError(err, os.strerror(err))
+                total += numWritten
+
     def seek(self, offset, whence=os.SEEK_SET):
         return os.lseek(self._fd, offset, whence)
 
@@ -355,6 +442,27 @@ class DirectFile(object):
             self.close()
 
 
+def _mergeRanges(ranges):
+    """
+    Group (offset, size) ranges into reads, returning a list of
+    (start, end, members) tuples, where members is a list of
+    (index, offset, size) of the ranges covered by the read.
+    """
+    merged = []
+    order = sorted(enumerate(ranges), key=lambda item: item[1])
+    for i, (offset, size) in order:
+        if merged:
+            start, end, members = merged[-1]
+            newEnd = max(end, offset + size)
+            if (offset <= end + MAX_READ_GAP and
+                    newEnd - start <= MAX_MERGED_READ):
+                members.append((i, offset, size))
+                merged[-1] = (start, newEnd, members)
+                continue
+        merged.append((offset, offset + size, [(i, offset, size)]))
+    return merged
+
+
 def fsyncPath(path):
     fd = os.open(path, os.O_RDONLY)
     try:
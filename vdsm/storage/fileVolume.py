@@ -294,14 +294,7 @@ class FileVolume(volume.Volume):
 
         try:
             f = self.oop.directReadLines(metaPath)
-            out = {}
-            for l in f:
-                if l.startswith("EOF"):
-                    return out
-                if l.find("=") < 0:
-                    continue
-                key, value = l.split("=")
-                out[key.strip()] = value.strip()
+            out = volume.parseMetadata(f)
 
         except Exception as e:
             self.log.error(e, exc_info=True)
@@ -160,6 +160,21 @@ def _resolveIscsiIface(ifaceName, initiatorName, netIfaceName):
     return iface
 
 
+def _latencyWindows(windows):
+    if not isinstance(windows, (list, tuple)):
+        raise se.InvalidParameterException("latencyWindows", windows)
+    res = []
+    for window in windows:
+        try:
+            value = int(window)
+        except (TypeError, ValueError):
+            raise se.InvalidParameterException("latencyWindows", window)
+        if value < 0:
+            raise se.InvalidParameterException("latencyWindows", window)
+        res.append(value)
+    return res
+
+
 def _connectionDict2ConnectionInfo(conTypeId, conDict):
     def getIntParam(optDict, key, default):
         res = optDict.get(key, default)
@@ -2422,31 +2437,34 @@ class HSM(object):
                 "domType=%s, spUUID=%s, conList=%s" %
                 (domType, spUUID, conList)))
 
-        res = []
+        jobs = []
         for conDef in conList:
             conInfo = _connectionDict2ConnectionInfo(domType, conDef)
             conObj = storageServer.ConnectionFactory.createConnection(conInfo)
-            try:
-                self._connectStorageOverIser(conDef, conObj, domType)
-                conObj.connect()
-            except Exception as err:
-                self.log.error(
-                    "Could not connect to storageServer", exc_info=True)
-                status, _ = self._translateConnectionError(err)
+            jobs.append((conObj, partial(self._connectStorageServer, domType,
+                                         conDef, conObj)))
+
+        results = storageServer.connectAll(
+            jobs, config.getint("irs", "connect_workers"))
+
+        res = []
+        for conDef, (succeeded, value) in zip(conList, results):
+            if succeeded:
+                status, doms = value
             else:
-                status = 0
-                try:
-                    doms = self.__prefetchDomains(domType, conObj)
-                except:
-                    self.log.debug("prefetch failed: %s",
-                                   sdCache.knownSDs, exc_info=True)
-                else:
-                    # Any pre-existing domains in sdCache stand the chance of
-                    # being invalid, since there is no way to know what happens
-                    # to them while the storage is disconnected.
-                    for sdUUID in doms.iterkeys():
-                        sdCache.manuallyRemoveDomain(sdUUID)
-                    sdCache.knownSDs.update(doms)
+                # Unexpected error, _connectStorageServer handles errors
+                self.log.error("Could not connect to storageServer: %s",
+                               value)
+                status, _ = self._translateConnectionError(value)
+                doms = None
+
+            if doms is not None:
+                # Any pre-existing domains in sdCache stand the chance of
+                # being invalid, since there is no way to know what happens
+                # to them while the storage is disconnected.
+                for sdUUID in doms.iterkeys():
+                    sdCache.manuallyRemoveDomain(sdUUID)
+                sdCache.knownSDs.update(doms)
 
             self.log.debug("knownSDs: {%s}", ", ".join("%s: %s.%s" %
                            (k, v.__module__, v.__name__)
@@ -2459,6 +2477,32 @@ class HSM(object):
         sdCache.invalidateStorage()
         return dict(statuslist=res)
 
+    def _connectStorageServer(self, domType, conDef, conObj):
+        """
+        Connect a single connection and prefetch its domains, running
+        concurrently with other connections in connectStorageServer.
+
+        Returns the connection status and the prefetched domains, or None if
+        prefetching failed.
+        """
+        try:
+            self._connectStorageOverIser(conDef, conObj, domType)
+            conObj.connect()
+        except Exception as err:
+            self.log.error(
+                "Could not connect to storageServer", exc_info=True)
+            status, _ = self._translateConnectionError(err)
+            return status, None
+
+        try:
+            doms = self.__prefetchDomains(domType, conObj)
+        except:
+            self.log.debug("prefetch failed: %s",
+                           sdCache.knownSDs, exc_info=True)
+            return 0, None
+
+        return 0, doms
+
     @deprecated
     def _connectStorageOverIser(self, conDef, conObj, conTypeId):
         """
@@ -3247,6 +3291,33 @@ class HSM(object):
             volUUIDs = [k for k, v in vols.iteritems() if imgUUID in v.imgs]
         return dict(uuidlist=volUUIDs)
 
+    @public
+    def getVolumesInfo(self, sdUUID, spUUID, imgUUID=volume.BLANK_UUID,
+                       options=None):
+        """
+        Gets the info of all the volumes of an image or a domain, reading the
+        volumes metadata at once.
+
+        :param sdUUID: The UUID of the storage domain you want to query.
+        :type sdUUID: UUID
+        :param spUUID: Unused.
+        :type spUUID: UUID
+        :param imgUUID: The UUID of the an image you want to filter the
+                        results.
+                        if imgUUID equals :attr:`~volume.BLANK_UUID` no
+                        filtering will be done.
+        :param options: ?
+
+        :returns: a dict with the info of every volume, keyed by the volume
+                  UUID, like the info returned by :meth:`getVolumeInfo`.
+        :rtype: dict
+        """
+        vars.task.getSharedLock(STORAGE, sdUUID)
+        dom = sdCache.produce(sdUUID=sdUUID)
+        if imgUUID == volume.BLANK_UUID:
+            imgUUID = None
+        return dict(info=dom.getVolumesInfo(imgUUID))
+
     @public
     def getImagesList(self, sdUUID, options=None):
         """
@@ -3589,7 +3660,11 @@ class HSM(object):
         """
         Collects a storage repository's information and stats.
 
-        :param options: ?
+        :param options: If options['latency'] is true, add the read delay
+                        and selftest latency statistics of every domain,
+                        over the windows in options['latencyWindows'], or
+                        the windows in irs:monitor_history_windows.
+        :type options: dict
 
         :returns: result
         """
@@ -3600,6 +3675,15 @@ class HSM(object):
         for d in repo_stats:
             result[d] = repo_stats[d]['result']
 
+        if options and options.get('latency'):
+            windows = options.get('latencyWindows')
+            if windows is not None:
+                windows = _latencyWindows(windows)
+            for sdUUID, latency in self.domainMonitor.getDomainsLatency(
+                    windows):
+                if sdUUID in result:
+                    result[sdUUID]['latency'] = latency
+
         return result
 
     @deprecated
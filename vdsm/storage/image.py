@@ -1172,19 +1172,13 @@ class Image:
         imgVolumes = sd.getVolsOfImage(allVols, imgUUID).keys()
         dom.activateVolumes(imgUUID, imgVolumes)
 
-        # Walk the volume chain using qemu-img.  Not safe for running VMs
-        actualVolumes = []
-        volUUID = leafVolUUID
-        while volUUID is not None:
-            actualVolumes.insert(0, volUUID)
-            vol = dom.produceVolume(imgUUID, volUUID)
-            qemuImgFormat = volume.fmt2str(vol.getFormat())
-            imgInfo = qemuimg.info(vol.volumePath, qemuImgFormat)
-            backingFile = imgInfo.get('backingfile')
-            if backingFile is not None:
-                volUUID = os.path.basename(backingFile)
-            else:
-                volUUID = None
+        # Inspect the volume chain using qemu-img.  Not safe for running VMs
+        vol = dom.produceVolume(imgUUID, leafVolUUID)
+        qemuImgFormat = volume.fmt2str(vol.getFormat())
+        # The chain may have been modified by a merge on another host.
+        chain = qemuimg.info_chain(vol.volumePath, qemuImgFormat, cache=False)
+        actualVolumes = [os.path.basename(imgInfo['filename'])
+                         for imgInfo in reversed(chain)]
 
         # A merge of the active layer has copy and pivot phases.
         # During copy, data is copied from the leaf into its parent.  Writes
@@ -32,14 +32,19 @@ import pwd
 import grp
 import logging
 from collections import namedtuple
+from contextlib import contextmanager
 import pprint as pp
 import threading
+from collections import defaultdict
 from itertools import chain
 from subprocess import list2cmdline
 
 from vdsm import constants
+from vdsm import udevadm
+from vdsm import utils
 import misc
 import multipath
+import lvmshell
 import storage_exception as se
 from vdsm.config import config
 import devicemapper
@@ -51,7 +56,7 @@ LVM_DEFAULT_TTL = 100
 PV_FIELDS = ("uuid,name,size,vg_name,vg_uuid,pe_start,pe_count,"
              "pe_alloc_count,mda_count,dev_size")
 VG_FIELDS = ("uuid,name,attr,size,free,extent_size,extent_count,free_count,"
-             "tags,vg_mda_size,vg_mda_free,lv_count,pv_count,pv_name")
+             "tags,vg_mda_size,vg_mda_free,lv_count,pv_count,pv_name,vg_seqno")
 LV_FIELDS = "uuid,name,vg_name,attr,size,seg_start_pe,devices,tags"
 
 VG_ATTR_BITS = ("permission", "resizeable", "exported",
@@ -92,9 +97,11 @@ PV_PREFIX = "/dev/mapper"
 # Assuming there are no spaces in the PV name
 re_pvName = re.compile(PV_PREFIX + '[^\s\"]+', re.MULTILINE)
 
+# A double quoted lvm configuration string without backslashes and single
+# quotes
+re_dquoteString = re.compile(r'"([^"\\\']*)"')
+
 # operations lock
-LVM_OP_INVALIDATE = "lvm invalidate operation"
-LVM_OP_RELOAD = "lvm reload operation"
 
 PVS_CMD = ("pvs",) + LVM_FLAGS + ("-o", PV_FIELDS)
 VGS_CMD = ("vgs",) + LVM_FLAGS + ("-o", VG_FIELDS)
@@ -234,9 +241,156 @@ def makeLV(*args):
     return LV(*args)
 
 
+class CacheStats(object):
+    """
+    Hit/miss counters and reload latency of the LVM cache, and the time
+    spent waiting for the per-VG reload locks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+        self._reloads = defaultdict(int)
+        self._reloadTime = defaultdict(float)
+        self._maxReloadTime = defaultdict(float)
+
+    def hit(self, kind):
+        with self._lock:
+            self._hits[kind] += 1
+
+    def miss(self, kind):
+        with self._lock:
+            self._misses[kind] += 1
+
+    def reloaded(self, kind, elapsed):
+        with self._lock:
+            self._reloads[kind] += 1
+            self._reloadTime[kind] += elapsed
+            self._maxReloadTime[kind] = max(self._maxReloadTime[kind],
+                                            elapsed)
+
+    def locked(self, vgName, wait):
+        with self._lock:
+            count, total, maxWait = self._locks.get(vgName, (0, 0.0, 0.0))
+            self._locks[vgName] = (count + 1, total + wait,
+                                   max(maxWait, wait))
+
+    def info(self):
+        with self._lock:
+            res = {}
+            for kind in ("pv", "vg", "lv"):
+                reloads = self._reloads[kind]
+                totalTime = self._reloadTime[kind]
+                res[kind] = {
+                    "hits": self._hits[kind],
+                    "misses": self._misses[kind],
+                    "reloads": reloads,
+                    "reloadTime": totalTime,
+                    "avgReloadTime": totalTime / reloads if reloads else 0.0,
+                    "maxReloadTime": self._maxReloadTime[kind],
+                }
+            res["locks"] = dict(
+                (vgName, {"acquired": count,
+                          "waitTime": total,
+                          "maxWaitTime": maxWait})
+                for vgName, (count, total, maxWait)
+                in self._locks.iteritems())
+            return res
+
+
+class _Batch(object):
+
+    def __init__(self, lvs):
+        self.lvs = list(lvs)
+        self.callers = 1
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def add(self, lvs):
+        self.lvs.extend(lv for lv in lvs if lv not in self.lvs)
+        self.callers += 1
+
+
+class LVChangeBatcher(object):
+    """
+    Merge concurrent lvchange commands with the same arguments on the same VG
+    into one command.
+
+    A command is run immediately if no command with the same arguments is
+    running. Otherwise it joins the batch waiting for the running command,
+    and the whole batch runs as one command when the running command
+    completes. If a batched command fails, we cannot tell which LV failed, so
+    every caller runs its own command again.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._running = set()
+        self._pending = {}
+
+    def run(self, key, lvs, func):
+        """
+        Run func(lvs), returning (rc, out, err), batching lvs with the lvs of
+        concurrent calls using the same key.
+        """
+        with self._cond:
+            batch = self._pending.get(key)
+            if batch is not None:
+                batch.add(lvs)
+                leader = False
+            else:
+                batch = _Batch(lvs)
+                leader = True
+                if key in self._running:
+                    self._pending[key] = batch
+                    while key in self._running:
+                        self._cond.wait()
+                    del self._pending[key]
+                self._running.add(key)
+
+        if leader:
+            try:
+                batch.result = func(batch.lvs)
+            except Exception as e:
+                batch.error = e
+            finally:
+                with self._cond:
+                    self._running.discard(key)
+                    self._cond.notifyAll()
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.callers > 1:
+            if batch.error is not None or batch.result[0] != 0:
+                log.debug("Batched lvchange of %s failed, retrying %s", key,
+                          lvs)
+                return func(lvs)
+            log.debug("Batched lvchange of %s for %d callers",
+                      key, batch.callers)
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.result
+
+
 class LVMCache(object):
     """
     Keep all the LVM information.
+
+    In incremental mode, invalidating a VG does not drop its LVs. The LVs are
+    reloaded only when the VG metadata sequence number reported by LVM
+    changed since the last reload, or when udev reports a change of a
+    specific LV device.
+
+    Reloads do not hold any lock shared by all VGs while running lvm, so a
+    reload of an unresponsive VG blocks only the callers using this VG.
+    Reloads of the same VG are serialized by a per-VG lock. Invalidations
+    never wait for reloads; a reload does not cache objects invalidated
+    while it was running, so the next access reloads them again.
     """
 
     def _getCachedExtraCfg(self):
@@ -272,13 +426,38 @@ class LVMCache(object):
 
     def invalidateCache(self):
         self.invalidateFilter()
-        self.flush()
+        if self._incremental:
+            self._invalidateAllPvs()
+            self._invalidateAllVgsSeqno()
+        else:
+            self.flush()
 
-    def __init__(self):
+    def __init__(self, incremental=False, shellPoolSize=0, shellTimeout=60):
+        self._incremental = incremental
+        if shellPoolSize > 0:
+            self._shellPool = lvmshell.ShellPool(shellPoolSize, shellTimeout)
+        else:
+            self._shellPool = None
+        self._stats = CacheStats()
+        self._vgSeqno = {}
+        self._staleLvVgs = set()
+        # Generations of changes to the LVs of a VG that were not made by
+        # creating or tagging LVs, see lvsGeneration()
+        self._lvsChangeGen = {}
+        self._allLvsChangeGen = 0
         self._filterStale = True
         self._extraCfg = None
         self._filterLock = threading.Lock()
-        self._oplock = misc.OperationMutex()
+        # Protects the cache state below; never held while running lvm.
+        self._lock = threading.Lock()
+        self._vgLocks = {}
+        # Invalidation generations, see _invalidated()
+        self._gen = 0
+        self._allGen = {"pv": 0, "vg": 0, "lv": 0}
+        self._pvGen = {}
+        self._vgGen = {}
+        self._lvGen = {}
+        self._vgLvsGen = {}
         self._stalepv = True
         self._stalevg = True
         self._stalelv = True
@@ -286,9 +465,45 @@ class LVMCache(object):
         self._vgs = {}
         self._lvs = {}
 
+    def _run(self, cmd, useShell=True):
+        """
+        Run cmd in the lvm shell if enabled, or in a new process. Raises
+        lvmshell.Error if the lvm shell failed running the command.
+        """
+        if useShell and self._shellPool is not None:
+            try:
+                return self._runInShell(cmd)
+            except lvmshell.Unsupported as e:
+                log.warning("Disabling lvm shell: %s", e)
+                self._shellPool = None
+            except lvmshell.StartError as e:
+                log.warning("Running command without lvm shell: %s", e)
+            except (lvmshell.Busy, lvmshell.QuoteError) as e:
+                log.debug("Running command without lvm shell: %s", e)
+
+        return misc.execCmd(cmd, sudo=True)
+
+    def _runInShell(self, cmd):
+        args = list(cmd[1:])  # Drop the lvm executable
+        # The lvm shell cannot parse an argument containing both kinds of
+        # quotes. The lvm configuration accepts both, but unescapes
+        # backslashes only in double quoted strings, so we can single quote
+        # only the double quoted strings without backslashes.
+        for i, arg in enumerate(args[:-1]):
+            if arg == "--config":
+                args[i + 1] = re_dquoteString.sub(r"'\1'", args[i + 1])
+        return self._shellPool.run(args)
+
     def cmd(self, cmd, devices=tuple()):
         finalCmd = self._addExtraCfg(cmd, devices)
-        rc, out, err = misc.execCmd(finalCmd, sudo=True)
+        shellFailed = False
+        try:
+            rc, out, err = self._run(finalCmd)
+        except lvmshell.Error as e:
+            log.error("lvm shell command failed: %s", e)
+            rc, out, err = lvmshell.ECMD_FAILED, [], [str(e)]
+            shellFailed = True
+
         if rc != 0:
             # Filter might be stale
             self.invalidateFilter()
@@ -296,9 +511,11 @@ class LVMCache(object):
             # Before blindly trying again make sure
             # that the commands are not identical, because
             # the devlist is sorted there is no fear
-            # of two identical filters looking differently
-            if newCmd != finalCmd:
-                return misc.execCmd(newCmd, sudo=True)
+            # of two identical filters looking differently.
+            # The retry does not use the lvm shell, so a command waits for
+            # one lvm shell timeout at most.
+            if newCmd != finalCmd or shellFailed:
+                return self._run(newCmd, useShell=False)
 
         return rc, out, err
 
@@ -308,17 +525,124 @@ class LVMCache(object):
                  pp.pformat(self._vgs),
                  pp.pformat(self._lvs)))
 
+    @property
+    def incremental(self):
+        return self._incremental
+
+    def stats(self):
+        return self._stats.info()
+
     def bootstrap(self):
         self._reloadpvs()
         self._reloadvgs()
         self._reloadAllLvs()
 
+    def handleUdevEvent(self, event):
+        """
+        Invalidate the LV reported by a device-mapper udev event.
+
+        Does not affect the VG metadata sequence number; changes in the VG
+        metadata made by other hosts are detected when the VG is reloaded.
+        """
+        vgName = event.get("DM_VG_NAME")
+        lvName = event.get("DM_LV_NAME")
+        if not vgName or not lvName:
+            return
+        if (vgName, lvName) in self._lvs:
+            log.debug("udev %s event for lv %s/%s", event.get("ACTION"),
+                      vgName, lvName)
+            self._invalidatelvs(vgName, lvName)
+
+    @contextmanager
+    def _reloadLock(self, vgNames):
+        """
+        Serialize reloads of vgNames, acquiring the per-VG locks in sorted
+        order.
+        """
+        with self._lock:
+            locks = [(name, self._vgLocks.setdefault(name, threading.Lock()))
+                     for name in sorted(set(vgNames))]
+        acquired = []
+        try:
+            for name, lock in locks:
+                start = utils.monotonic_time()
+                lock.acquire()
+                acquired.append(lock)
+                self._stats.locked(name, utils.monotonic_time() - start)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def _generation(self):
+        with self._lock:
+            return self._gen
+
+    def _nextGeneration(self):
+        """
+        Must be called with self._lock held.
+        """
+        self._gen += 1
+        return self._gen
+
+    def _invalidated(self, kind, gens, key, since):
+        """
+        Return True if key was invalidated after generation since, meaning
+        that the result of a reload started at this generation must not be
+        cached. Must be called with self._lock held.
+        """
+        return max(self._allGen[kind], gens.get(key, 0)) > since
+
+    def _lvInvalidated(self, vgName, lvName, since):
+        return (self._vgLvsGen.get(vgName, 0) > since or
+                self._invalidated("lv", self._lvGen, (vgName, lvName), since))
+
+    def _updateSeqno(self, vg):
+        """
+        Must be called with self._lock held.
+        """
+        oldSeqno = self._vgSeqno.get(vg.name)
+        if oldSeqno is not None and oldSeqno != vg.vg_seqno:
+            log.debug("vg %s metadata changed (seqno %s -> %s), lvs will be "
+                      "reloaded", vg.name, oldSeqno, vg.vg_seqno)
+            self._staleLvVgs.add(vg.name)
+            self._lvsChangeGen[vg.name] = self._nextGeneration()
+        self._vgSeqno[vg.name] = vg.vg_seqno
+
+    def _forgetSeqno(self, vgName):
+        """
+        Called after we modified the VG metadata ourselves. The affected
+        objects were already invalidated by the caller, so the next sequence
+        number should not trigger a reload of all the LVs in the VG.
+        """
+        self._vgSeqno.pop(vgName, None)
+
+    def _lvsRemoved(self, vgName):
+        with self._lock:
+            self._lvsChangeGen[vgName] = self._nextGeneration()
+
+    def lvsGeneration(self, vgName):
+        """
+        Return a number that changes when LVs of vgName may have been removed,
+        or when the VG metadata was changed by another host. Creating LVs or
+        changing their tags on this host does not change it.
+        """
+        # The sequence number of a VG is known only after reloading it
+        if not isinstance(self._vgs.get(vgName), VG):
+            self._reloadvgs(vgName)
+        with self._lock:
+            return max(self._allLvsChangeGen,
+                       self._lvsChangeGen.get(vgName, 0))
+
     def _reloadpvs(self, pvName=None):
         cmd = list(PVS_CMD)
         pvNames = _normalizeargs(pvName)
         cmd.extend(pvNames)
-        with self._oplock.acquireContext(LVM_OP_RELOAD):
-            rc, out, err = self.cmd(cmd)
+        since = self._generation()
+        start = utils.monotonic_time()
+        rc, out, err = self.cmd(cmd)
+        self._stats.reloaded("pv", utils.monotonic_time() - start)
+        with self._lock:
             if rc != 0:
                 log.warning("lvm pvs failed: %s %s %s", str(rc), str(out),
                             str(err))
@@ -335,17 +659,20 @@ class LVMCache(object):
                 if pv.name == UNKNOWN_DEVICE:
                     log.error("Missing pv: %s in vg: %s", pv.uuid, pv.vg_name)
                     continue
-                self._pvs[pv.name] = pv
+                if not self._invalidated("pv", self._pvGen, pv.name, since):
+                    self._pvs[pv.name] = pv
                 updatedPVs[pv.name] = pv
             # If we updated all the PVs drop stale flag
-            if not pvName:
+            if not pvName and self._allGen["pv"] <= since:
                 self._stalepv = False
                 # Remove stalePVs
                 stalePVs = [staleName for staleName in self._pvs.keys()
-                            if staleName not in updatedPVs.iterkeys()]
+                            if staleName not in updatedPVs.iterkeys() and
+                            self._pvGen.get(staleName, 0) <= since]
                 for staleName in stalePVs:
                     log.warning("Removing stale PV: %s", staleName)
                     self._pvs.pop((staleName), None)
+                    self._pvGen.pop(staleName, None)
 
         return updatedPVs
 
@@ -368,9 +695,15 @@ class LVMCache(object):
         vgNames = _normalizeargs(vgName)
         cmd.extend(vgNames)
 
-        with self._oplock.acquireContext(LVM_OP_RELOAD):
+        # Reloading all the VGs does not take the per-VG locks, so it does
+        # not wait for reloads of specific VGs.
+        with self._reloadLock(vgNames):
+            since = self._generation()
+            start = utils.monotonic_time()
             rc, out, err = self.cmd(cmd, self._getVGDevs(vgNames))
+            self._stats.reloaded("vg", utils.monotonic_time() - start)
 
+        with self._lock:
             if rc != 0:
                 log.warning("lvm vgs failed: %s %s %s", str(rc), str(out),
                             str(err))
@@ -402,18 +735,25 @@ class LVMCache(object):
                 if int(vg.pv_count) != len(vg.pv_name):
                     log.error("vg %s has pv_count %s but pv_names %s",
                               vg.name, vg.pv_count, vg.pv_name)
-                self._vgs[vg.name] = vg
+                if not self._invalidated("vg", self._vgGen, vg.name, since):
+                    self._vgs[vg.name] = vg
+                    self._updateSeqno(vg)
                 updatedVGs[vg.name] = vg
             # If we updated all the VGs drop stale flag
-            if not vgName:
+            if not vgName and self._allGen["vg"] <= since:
                 self._stalevg = False
                 # Remove stale VGs
                 staleVGs = [staleName for staleName in self._vgs.keys()
-                            if staleName not in updatedVGs.iterkeys()]
+                            if staleName not in updatedVGs.iterkeys() and
+                            self._vgGen.get(staleName, 0) <= since]
                 for staleName in staleVGs:
                     removeVgMapping(staleName)
                     log.warning("Removing stale VG: %s", staleName)
                     self._vgs.pop((staleName), None)
+                    self._vgGen.pop(staleName, None)
+                    self._vgSeqno.pop(staleName, None)
+                    self._staleLvVgs.discard(staleName)
+                    self._lvsChangeGen[staleName] = self._nextGeneration()
 
         return updatedVGs
 
@@ -425,9 +765,13 @@ class LVMCache(object):
         else:
             cmd.append(vgName)
 
-        with self._oplock.acquireContext(LVM_OP_RELOAD):
+        with self._reloadLock((vgName,)):
+            since = self._generation()
+            start = utils.monotonic_time()
             rc, out, err = self.cmd(cmd, self._getVGDevs((vgName, )))
+            self._stats.reloaded("lv", utils.monotonic_time() - start)
 
+        with self._lock:
             if rc != 0:
                 log.warning("lvm lvs failed: %s %s %s", str(rc), str(out),
                             str(err))
@@ -443,22 +787,29 @@ class LVMCache(object):
                 lv = makeLV(*fields)
                 # For LV we are only interested in its first extent
                 if lv.seg_start_pe == "0":
-                    self._lvs[(lv.vg_name, lv.name)] = lv
+                    if not self._lvInvalidated(lv.vg_name, lv.name, since):
+                        self._lvs[(lv.vg_name, lv.name)] = lv
                     updatedLVs[(lv.vg_name, lv.name)] = lv
 
             # Determine if there are stale LVs
             if lvNames:
-                staleLVs = (lvName for lvName in lvNames
-                            if (vgName, lvName) not in updatedLVs.iterkeys())
+                staleLVs = [lvName for lvName in lvNames
+                            if (vgName, lvName) not in updatedLVs.iterkeys()]
             else:
                 # All the LVs in the VG
-                staleLVs = (lvName for v, lvName in self._lvs.keys()
+                staleLVs = [lvName for v, lvName in self._lvs.keys()
                             if (v == vgName) and
-                            ((vgName, lvName) not in updatedLVs.iterkeys()))
+                            ((vgName, lvName) not in updatedLVs.iterkeys())]
 
             for lvName in staleLVs:
+                if self._lvInvalidated(vgName, lvName, since):
+                    continue
                 log.warning("Removing stale lv: %s/%s", vgName, lvName)
                 self._lvs.pop((vgName, lvName), None)
+                self._lvGen.pop((vgName, lvName), None)
+
+            if not lvNames and not self._lvInvalidated(vgName, None, since):
+                self._staleLvVgs.discard(vgName)
 
             log.debug("lvs reloaded")
 
@@ -469,66 +820,122 @@ class LVMCache(object):
         Used only during bootstrap.
         """
         cmd = list(LVS_CMD)
+        since = self._generation()
+        start = utils.monotonic_time()
         rc, out, err = self.cmd(cmd)
-        if rc == 0:
-            updatedLVs = set()
-            for line in out:
-                fields = [field.strip() for field in line.split(SEPARATOR)]
-                lv = makeLV(*fields)
-                # For LV we are only interested in its first extent
-                if lv.seg_start_pe == "0":
-                    self._lvs[(lv.vg_name, lv.name)] = lv
-                    updatedLVs.add((lv.vg_name, lv.name))
-
-            # Remove stales
-            for vgName, lvName in self._lvs.keys():
-                if (vgName, lvName) not in updatedLVs:
-                    self._lvs.pop((vgName, lvName), None)
-                    log.error("Removing stale lv: %s/%s", vgName, lvName)
-            self._stalelv = False
-        return dict(self._lvs)
+        self._stats.reloaded("lv", utils.monotonic_time() - start)
+        with self._lock:
+            if rc == 0:
+                updatedLVs = set()
+                for line in out:
+                    fields = [field.strip() for field in line.split(SEPARATOR)]
+                    lv = makeLV(*fields)
+                    # For LV we are only interested in its first extent
+                    if lv.seg_start_pe == "0":
+                        key = (lv.vg_name, lv.name)
+                        if not self._lvInvalidated(lv.vg_name, lv.name, since):
+                            self._lvs[key] = lv
+                        updatedLVs.add(key)
+
+                # Remove stales
+                for vgName, lvName in self._lvs.keys():
+                    if ((vgName, lvName) not in updatedLVs and
+                            not self._lvInvalidated(vgName, lvName, since)):
+                        self._lvs.pop((vgName, lvName), None)
+                        self._lvGen.pop((vgName, lvName), None)
+                        log.error("Removing stale lv: %s/%s", vgName, lvName)
+                if self._allGen["lv"] <= since:
+                    self._stalelv = False
+                    self._staleLvVgs.clear()
+            return dict(self._lvs)
 
     def _invalidatepvs(self, pvNames):
-        with self._oplock.acquireContext(LVM_OP_INVALIDATE):
+        with self._lock:
+            gen = self._nextGeneration()
             pvNames = _normalizeargs(pvNames)
             for pvName in pvNames:
                 self._pvs[pvName] = Stub(pvName, True)
+                self._pvGen[pvName] = gen
 
     def _invalidateAllPvs(self):
-        with self._oplock.acquireContext(LVM_OP_INVALIDATE):
+        with self._lock:
+            self._allGen["pv"] = self._nextGeneration()
             self._stalepv = True
             self._pvs.clear()
+            self._pvGen.clear()
 
     def _invalidatevgs(self, vgNames):
         vgNames = _normalizeargs(vgNames)
-        with self._oplock.acquireContext(LVM_OP_INVALIDATE):
+        with self._lock:
+            gen = self._nextGeneration()
+            for vgName in vgNames:
+                self._vgs[vgName] = Stub(vgName, True)
+                self._vgGen[vgName] = gen
+                self._forgetSeqno(vgName)
+
+    def _invalidatevgsSeqno(self, vgNames):
+        """
+        Invalidate VGs that may have been modified by other hosts, keeping
+        their metadata sequence number for detecting changes on reload.
+        """
+        vgNames = _normalizeargs(vgNames)
+        with self._lock:
+            gen = self._nextGeneration()
             for vgName in vgNames:
                 self._vgs[vgName] = Stub(vgName, True)
+                self._vgGen[vgName] = gen
+
+    def _invalidateAllVgsSeqno(self):
+        with self._lock:
+            self._allGen["vg"] = self._nextGeneration()
+            self._stalevg = True
+            for vgName in self._vgs.keys():
+                self._vgs[vgName] = Stub(vgName, True)
+
+    def _invalidateLvsMetadata(self, vgName, lvNames):
+        """
+        Invalidate LVs after changing their metadata (e.g. tags).
+        """
+        self._invalidatelvs(vgName, lvNames)
+        with self._lock:
+            self._forgetSeqno(vgName)
 
     def _invalidateAllVgs(self):
-        with self._oplock.acquireContext(LVM_OP_INVALIDATE):
+        with self._lock:
+            self._allGen["vg"] = self._nextGeneration()
             self._stalevg = True
             self._vgs.clear()
+            self._vgGen.clear()
+            self._vgSeqno.clear()
+            # Changes are not detected without the sequence numbers
+            self._allLvsChangeGen = self._allGen["vg"]
 
     def _invalidatelvs(self, vgName, lvNames=None):
-        with self._oplock.acquireContext(LVM_OP_INVALIDATE):
+        with self._lock:
+            gen = self._nextGeneration()
             lvNames = _normalizeargs(lvNames)
             # Invalidate LVs in a specific VG
             if lvNames:
                 # Invalidate a specific LVs
                 for lvName in lvNames:
                     self._lvs[(vgName, lvName)] = Stub(lvName, True)
+                    self._lvGen[(vgName, lvName)] = gen
             else:
                 # Invalidate all the LVs in a given VG
+                self._vgLvsGen[vgName] = gen
                 for lv in self._lvs.values():
                     if not isinstance(lv, Stub):
                         if lv.vg_name == vgName:
                             self._lvs[(vgName, lv.name)] = Stub(lv.name, True)
 
     def _invalidateAllLvs(self):
-        with self._oplock.acquireContext(LVM_OP_INVALIDATE):
+        with self._lock:
+            self._allGen["lv"] = self._nextGeneration()
             self._stalelv = True
             self._lvs.clear()
+            self._lvGen.clear()
+            self._vgLvsGen.clear()
+            self._staleLvVgs.clear()
 
     def flush(self):
         self._invalidateAllPvs()
@@ -539,29 +946,39 @@ class LVMCache(object):
         # Get specific PV
         pv = self._pvs.get(pvName)
         if not pv or isinstance(pv, Stub):
+            self._stats.miss("pv")
             pvs = self._reloadpvs(pvName)
             pv = pvs.get(pvName)
+        else:
+            self._stats.hit("pv")
         return pv
 
     def getAllPvs(self):
         # Get everything we have
         if self._stalepv:
+            self._stats.miss("pv")
             pvs = self._reloadpvs()
         else:
             pvs = dict(self._pvs)
             stalepvs = [pv.name for pv in pvs.itervalues()
                         if isinstance(pv, Stub)]
             if stalepvs:
+                self._stats.miss("pv")
                 reloaded = self._reloadpvs(stalepvs)
                 pvs.update(reloaded)
+            else:
+                self._stats.hit("pv")
         return pvs.values()
 
     def getVg(self, vgName):
         # Get specific VG
         vg = self._vgs.get(vgName)
         if not vg or isinstance(vg, Stub):
+            self._stats.miss("vg")
             vgs = self._reloadvgs(vgName)
             vg = vgs.get(vgName)
+        else:
+            self._stats.hit("vg")
         return vg
 
     def getVgs(self, vgNames):
@@ -571,23 +988,83 @@ class LVMCache(object):
         Fills the cache but not uses it.
         Only returns found VGs.
         """
+        self._stats.miss("vg")
         return [vg for vgName, vg in self._reloadvgs(vgNames).iteritems()
                 if vgName in vgNames]
 
     def getAllVgs(self):
         # Get everything we have
         if self._stalevg:
+            self._stats.miss("vg")
             vgs = self._reloadvgs()
         else:
             vgs = dict(self._vgs)
             stalevgs = [vg.name for vg in vgs.itervalues()
                         if isinstance(vg, Stub)]
             if stalevgs:
+                self._stats.miss("vg")
                 reloaded = self._reloadvgs(stalevgs)
                 vgs.update(reloaded)
+            else:
+                self._stats.hit("vg")
         return vgs.values()
 
+    def _checkVgSeqno(self, vgName):
+        """
+        Reload an invalidated VG to find out if its LVs changed.
+        """
+        if isinstance(self._vgs.get(vgName), Stub):
+            self._reloadvgs(vgName)
+
+    def _staleLvNames(self, vgName):
+        return [lvName for (v, lvName), lv in self._lvs.items()
+                if v == vgName and isinstance(lv, Stub)]
+
+    def _getLvIncremental(self, vgName, lvName=None):
+        self._checkVgSeqno(vgName)
+        fullReload = self._stalelv or vgName in self._staleLvVgs
+        if lvName:
+            lv = self._lvs.get((vgName, lvName))
+            if not lv or isinstance(lv, Stub):
+                self._stats.miss("lv")
+                # An unknown LV may have been created by another host
+                if fullReload or lv is None:
+                    lvs = self._reloadlvs(vgName)
+                else:
+                    # Reload only the LVs known to be stale in this VG
+                    stale = set(self._staleLvNames(vgName))
+                    stale.add(lvName)
+                    lvs = self._reloadlvs(vgName, sorted(stale))
+                lv = lvs.get((vgName, lvName))
+                if not lv:
+                    log.warning("lv: %s not found in lvs vg: %s response",
+                                lvName, vgName)
+            else:
+                self._stats.hit("lv")
+            return lv
+
+        reloaded = {}
+        if fullReload:
+            self._stats.miss("lv")
+            reloaded = self._reloadlvs(vgName)
+        else:
+            stale = self._staleLvNames(vgName)
+            if stale:
+                self._stats.miss("lv")
+                reloaded = self._reloadlvs(vgName, stale)
+            else:
+                self._stats.hit("lv")
+        # LVs invalidated during the reload are not cached, but the caller
+        # gets the reloaded values.
+        lvs = dict(((lv.vg_name, lv.name), lv) for lv in self._lvs.values()
+                   if not isinstance(lv, Stub) and (lv.vg_name == vgName))
+        lvs.update(reloaded)
+        return lvs.values()
+
     def getLv(self, vgName, lvName=None):
+        if self._incremental:
+            return self._getLvIncremental(vgName, lvName)
+
         # Checking self._stalelv here is suboptimal, because
         # unnecessary reloads
         # are done.
@@ -601,12 +1078,15 @@ class LVMCache(object):
             # vgName, lvName
             lv = self._lvs.get((vgName, lvName))
             if not lv or isinstance(lv, Stub):
+                self._stats.miss("lv")
                 # while we here reload all the LVs in the VG
                 lvs = self._reloadlvs(vgName)
                 lv = lvs.get((vgName, lvName))
                 if not lv:
                     log.warning("lv: %s not found in lvs vg: %s response",
                                 lvName, vgName)
+            else:
+                self._stats.hit("lv")
             res = lv
         else:
             # vgName, None
@@ -617,8 +1097,10 @@ class LVMCache(object):
             # Fix me: should not be more stubs
             if self._stalelv or any(isinstance(lv, Stub)
                                     for lv in self._lvs.values()):
+                self._stats.miss("lv")
                 lvs = self._reloadlvs(vgName)
             else:
+                self._stats.hit("lv")
                 lvs = dict(self._lvs)
             # lvs = self._reloadlvs()
             lvs = [lv for lv in lvs.values()
@@ -628,14 +1110,39 @@ class LVMCache(object):
 
     def getAllLvs(self):
         # None, None
+        if self._incremental and not self._stalelv:
+            vgNames = set(self._staleLvVgs)
+            vgNames.update(vgName for (vgName, lvName), lv
+                           in self._lvs.items() if isinstance(lv, Stub))
+            reloaded = {}
+            for vgName in vgNames:
+                reloaded[vgName] = self._getLvIncremental(vgName)
+            if not vgNames:
+                self._stats.hit("lv")
+            lvs = [lv for lv in self._lvs.values()
+                   if not isinstance(lv, Stub) and lv.vg_name not in reloaded]
+            for vgLvs in reloaded.itervalues():
+                lvs.extend(vgLvs)
+            return lvs
+
         if self._stalelv or any(isinstance(lv, Stub)
                                 for lv in self._lvs.values()):
+            self._stats.miss("lv")
             lvs = self._reloadAllLvs()
         else:
+            self._stats.hit("lv")
             lvs = dict(self._lvs)
         return lvs.values()
 
-_lvminfo = LVMCache()
+_lvminfo = LVMCache(config.getboolean("irs", "lvm_incremental_cache"),
+                    config.getint("irs", "lvm_shell_pool_size"),
+                    config.getint("irs", "lvm_shell_timeout"))
+_udevMonitor = None
+
+if config.getboolean("irs", "lvm_batch_lvchange"):
+    _lvchangeBatcher = LVChangeBatcher()
+else:
+    _lvchangeBatcher = None
 
 
 def bootstrap(refreshlvs=()):
@@ -645,8 +1152,15 @@ def bootstrap(refreshlvs=()):
     This function builds the lvm cache and ensure that all unused lvs are
     deactivated, expect lvs matching refreshlvs, which are refreshed instead.
     """
+    global _udevMonitor
+
     _lvminfo.bootstrap()
 
+    if _lvminfo.incremental and _udevMonitor is None:
+        _udevMonitor = udevadm.Monitor(_lvminfo.handleUdevEvent,
+                                       subsystem="block")
+        _udevMonitor.start()
+
     refreshlvs = set(refreshlvs)
 
     for vg in _lvminfo.getAllVgs():
@@ -686,6 +1200,10 @@ def invalidateCache():
     _lvminfo.invalidateCache()
 
 
+def getCacheStats():
+    return _lvminfo.stats()
+
+
 def _fqpvname(pv):
     if pv and not pv.startswith(PV_PREFIX):
         pv = os.path.join(PV_PREFIX, pv)
@@ -800,23 +1318,41 @@ def changelv(vg, lvs, attrs):
     lvs = _normalizeargs(lvs)
     # If it fails or not we (may be) change the lv,
     # so we invalidate cache to reload these volumes on first occasion
-    lvnames = tuple("%s/%s" % (vg, lv) for lv in lvs)
-    cmd = ["lvchange"]
-    cmd.extend(LVM_NOBACKUP)
+    args = []
     if isinstance(attrs[0], str):
         # ("--attribute", "value")
-        cmd.extend(attrs)
+        attrs = (attrs,)
+    # (("--aa", "v1"), ("--ab", "v2"))
+    for attr in attrs:
+        args.extend(attr)
+    rc, out, err = _lvchange(vg, lvs, args)
+    if all(attr[0] == "--available" for attr in attrs):
+        # Activation does not modify the VG metadata
+        _lvminfo._invalidatelvs(vg, lvs)
     else:
-        # (("--aa", "v1"), ("--ab", "v2"))
-        for attr in attrs:
-            cmd.extend(attr)
-    cmd.extend(lvnames)
-    rc, out, err = _lvminfo.cmd(tuple(cmd), _lvminfo._getVGDevs((vg, )))
-    _lvminfo._invalidatelvs(vg, lvs)
+        _lvminfo._invalidateLvsMetadata(vg, lvs)
     if rc != 0 and len(out) < 1:
         raise se.StorageException("%d %s %s\n%s/%s" % (rc, out, err, vg, lvs))
 
 
+def _lvchange(vg, lvs, args):
+    """
+    Run lvchange with args on lvs in vg. When batching is enabled,
+    concurrent calls with the same args on the same vg are merged into one
+    command.
+    """
+    def run(lvNames):
+        cmd = ["lvchange"]
+        cmd.extend(LVM_NOBACKUP)
+        cmd.extend(args)
+        cmd.extend("%s/%s" % (vg, lv) for lv in lvNames)
+        return _lvminfo.cmd(tuple(cmd), _lvminfo._getVGDevs((vg, )))
+
+    if _lvchangeBatcher is None:
+        return run(lvs)
+    return _lvchangeBatcher.run((vg,) + tuple(args), lvs, run)
+
+
 def _setLVAvailability(vg, lvs, available):
     try:
         changelv(vg, lvs, ("--available", available))
@@ -899,6 +1435,10 @@ def getVGbyUUID(vgUUID):
     raise se.VolumeGroupDoesNotExist("vg_uuid: %s" % vgUUID)
 
 
+def lvsGeneration(vgName):
+    return _lvminfo.lvsGeneration(vgName)
+
+
 def getLV(vgName, lvName=None):
     lv = _lvminfo.getLv(vgName, lvName)
     # getLV() should not return None
@@ -996,8 +1536,13 @@ def deactivateVG(vgName):
 
 
 def invalidateVG(vgName):
-    _lvminfo._invalidatevgs(vgName)
-    _lvminfo._invalidatelvs(vgName)
+    if _lvminfo.incremental:
+        # The LVs are reloaded only if the VG metadata has changed
+        _lvminfo._invalidatevgsSeqno(vgName)
+    else:
+        # Keep the sequence number for detecting changes, see lvsGeneration()
+        _lvminfo._invalidatevgsSeqno(vgName)
+        _lvminfo._invalidatelvs(vgName)
 
 
 def _getpvblksize(pv):
@@ -1108,6 +1653,8 @@ def removeLVs(vgName, lvNames):
     for lvName in lvNames:
         cmd.append("%s/%s" % (vgName, lvName))
     rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vgName, )))
+    # Some of the LVs may be removed even if lvremove failed
+    _lvminfo._lvsRemoved(vgName)
     if rc == 0:
         for lvName in lvNames:
             # Remove the LV from the cache
@@ -1183,6 +1730,7 @@ def renameLV(vg, oldlv, newlv):
         raise se.LogicalVolumeRenameError("%s %s %s" % (vg, oldlv, newlv))
 
     _lvminfo._lvs.pop((vg, oldlv), None)
+    _lvminfo._invalidateLvsMetadata(vg, newlv)
     _lvminfo._reloadlvs(vg, newlv)
 
 
@@ -1199,10 +1747,8 @@ def refreshLVs(vgName, lvNames):
 # Fix me: Function name should mention LV or unify with VG version.
 # may be for all the LVs in the whole VG?
 def addtag(vg, lv, tag):
-    lvname = "%s/%s" % (vg, lv)
-    cmd = ("lvchange",) + LVM_NOBACKUP + ("--addtag", tag) + (lvname,)
-    rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vg, )))
-    _lvminfo._invalidatelvs(vg, lv)
+    rc, out, err = _lvchange(vg, (lv,), ("--addtag", tag))
+    _lvminfo._invalidateLvsMetadata(vg, lv)
     if rc != 0:
         # Fix me: should be se.ChangeLogicalVolumeError but this not exists.
         raise se.MissingTagOnLogicalVolume("%s/%s" % (vg, lv), tag)
@@ -1217,19 +1763,16 @@ def changeLVTags(vg, lv, delTags=(), addTags=()):
             "Cannot add and delete the same tag lv: `%s` tags: `%s`" %
             (lvname, ", ".join(delTags.intersection(addTags))))
 
-    cmd = ['lvchange']
-    cmd.extend(LVM_NOBACKUP)
-
-    for tag in delTags:
-        cmd.extend(("--deltag", tag))
+    # Sorted, so concurrent calls changing the same tags can be batched
+    args = []
+    for tag in sorted(delTags):
+        args.extend(("--deltag", tag))
 
-    for tag in addTags:
-        cmd.extend(('--addtag', tag))
-
-    cmd.append(lvname)
+    for tag in sorted(addTags):
+        args.extend(('--addtag', tag))
 
-    rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vg, )))
-    _lvminfo._invalidatelvs(vg, lv)
+    rc, out, err = _lvchange(vg, (lv,), args)
+    _lvminfo._invalidateLvsMetadata(vg, lv)
     if rc != 0:
         raise se.LogicalVolumeReplaceTagError(
             'lv: `%s` add: `%s` del: `%s` (%s)' %
@@ -1334,11 +1877,9 @@ def replaceLVTag(vg, lv, deltag, addtag):
     """
     Removes and add tags atomically.
     """
-    lvname = "%s/%s" % (vg, lv)
-    cmd = (("lvchange",) + LVM_NOBACKUP + ("--deltag", deltag) +
-           ("--addtag", addtag) + (lvname,))
-    rc, out, err = _lvminfo.cmd(cmd, _lvminfo._getVGDevs((vg, )))
-    _lvminfo._invalidatelvs(vg, lv)
+    rc, out, err = _lvchange(vg, (lv,),
+                             ("--deltag", deltag, "--addtag", addtag))
+    _lvminfo._invalidateLvsMetadata(vg, lv)
     if rc != 0:
         raise se.LogicalVolumeReplaceTagError("%s/%s" % (vg, lv),
                                               "%s,%s" % (deltag, addtag))
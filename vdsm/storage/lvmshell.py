@@ -0,0 +1,318 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Persistent lvm shell processes
+
+Running lvm commands in a long running "lvm shell" process saves the cost of
+sudo, process startup and lvm initialization for every command.
+
+The shell does not report the exit code of a command, so after every command
+we run the "lastlog" shell command, reporting the status of the previous
+command in json format. The "lastlog" command is available since lvm2
+2.02.158; with older versions starting the shell raises Unsupported.
+"""
+
+import errno
+import json
+import logging
+import os
+import select
+import threading
+
+from cpopen import CPopen
+
+from vdsm import cmdutils
+from vdsm import constants
+from vdsm import utils
+import vdsm.infra.zombiereaper as zombiereaper
+
+PROMPT = "lvm> "
+LASTLOG = ("lastlog", "--reportformat", "json", "--select", "log_type=status")
+
+# lvm return codes (see lvm2 tools/errors.h)
+ECMD_PROCESSED = 1
+ECMD_FAILED = 5
+
+READ_SIZE = 4096
+
+
+class Error(Exception):
+    pass
+
+
+class StartError(Error):
+    pass
+
+
+class Unsupported(StartError):
+    pass
+
+
+class Timeout(Error):
+    pass
+
+
+class Busy(Error):
+    pass
+
+
+class QuoteError(Error):
+    pass
+
+
+def quoteArg(arg):
+    """
+    Quote an argument for the lvm shell line parser, which does not support
+    escaping. Arguments containing both kinds of quotes cannot be quoted.
+    """
+    if arg and not any(c.isspace() or c in "'\"#" for c in arg):
+        return arg
+    if "'" not in arg:
+        return "'%s'" % arg
+    if '"' not in arg:
+        return '"%s"' % arg
+    raise QuoteError("Cannot quote argument for lvm shell: %r" % arg)
+
+
+def formatCommand(args):
+    """
+    Return the lvm shell line running args.
+    """
+    return " ".join(quoteArg(arg) for arg in args) + "\n"
+
+
+def parseLastlog(out):
+    """
+    Return the lvm exit code of the previous command from the json output of
+    the lastlog command.
+    """
+    try:
+        report = json.loads(out[out.index("{"):out.rindex("}") + 1])
+    except ValueError:
+        raise Error("Invalid lastlog output: %r" % out)
+
+    retCodes = [int(entry["log_ret_code"]) for entry in report.get("log", [])
+                if entry.get("log_type") == "status"]
+
+    # Successful commands may not report any status
+    if not retCodes or retCodes[-1] == ECMD_PROCESSED:
+        return 0
+    return retCodes[-1]
+
+
+class Shell(object):
+    """
+    A single "lvm shell" process, running one command at a time.
+    """
+    log = logging.getLogger("Storage.LVM.Shell")
+
+    def __init__(self, timeout):
+        self._out = ""
+        self._err = ""
+        cmd = cmdutils.sudo([constants.EXT_LVM])
+        try:
+            self.process = CPopen(cmd, close_fds=True)
+        except OSError as e:
+            raise StartError("Cannot start lvm shell: %s" % e)
+
+        self._fdmap = {self.process.stdout.fileno(): "_out",
+                       self.process.stderr.fileno(): "_err"}
+        self._poller = select.epoll()
+        for fd in self._fdmap:
+            self._poller.register(fd, select.EPOLLIN | select.EPOLLPRI)
+
+        try:
+            self._readUntilPrompt(utils.monotonic_time() + timeout)
+            self._send(LASTLOG)
+            out, err = self._readUntilPrompt(
+                utils.monotonic_time() + timeout)
+            if "{" not in out:
+                raise Unsupported("lvm shell does not support lastlog: %s" %
+                                  err.strip())
+        except Error:
+            self.stop()
+            raise
+        except Exception as e:
+            self.stop()
+            raise StartError("Cannot start lvm shell: %s" % e)
+
+        self.log.debug("Started lvm shell (pid: %s)", self.process.pid)
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def run(self, args, timeout):
+        """
+        Run an lvm command (without the lvm executable) and return the rc
+        and the stdout and stderr lines, like misc.execCmd.
+        """
+        deadline = utils.monotonic_time() + timeout
+        self.log.debug("%s (pid %s)", cmdutils.command_log_line(args),
+                       self.process.pid)
+
+        line = self._send(args)
+        out, err = self._readUntilPrompt(deadline)
+        self._send(LASTLOG)
+        log, _ = self._readUntilPrompt(deadline)
+        rc = parseLastlog(log)
+
+        out = out.splitlines(False)
+        # Shells echoing the input line (e.g. readline) are not expected
+        # with a pipe, but do not mistake the echo for the output.
+        if out and out[0].strip() == line.strip():
+            del out[0]
+        err = err.splitlines(False)
+
+        self.log.debug(cmdutils.retcode_log_line(rc, err=err))
+        return rc, out, err
+
+    def stop(self):
+        try:
+            self.process.kill()
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                self.log.warning("Cannot kill lvm shell (pid: %s): %s",
+                                 self.process.pid, e)
+        self._poller.close()
+        zombiereaper.autoReapPID(self.process.pid)
+
+    def _send(self, args):
+        line = formatCommand(args)
+        data = line
+        try:
+            while data:
+                written = utils.NoIntrCall(os.write,
+                                           self.process.stdin.fileno(), data)
+                data = data[written:]
+        except OSError as e:
+            raise Error("Cannot write to lvm shell: %s" % e)
+        return line
+
+    def _readUntilPrompt(self, deadline):
+        while not self._out.endswith(PROMPT):
+            remaining = deadline - utils.monotonic_time()
+            if remaining <= 0:
+                raise Timeout("Timeout waiting for lvm shell (pid: %s)" %
+                              self.process.pid)
+
+            for fd, event in utils.NoIntrPoll(self._poller.poll, remaining):
+                if event & (select.EPOLLIN | select.EPOLLPRI):
+                    data = os.read(fd, READ_SIZE)
+                    if not data:
+                        raise Error("lvm shell (pid: %s) terminated" %
+                                    self.process.pid)
+                    attr = self._fdmap[fd]
+                    setattr(self, attr, getattr(self, attr) + data)
+                elif event & (select.EPOLLHUP | select.EPOLLERR):
+                    raise Error("lvm shell (pid: %s) terminated" %
+                                self.process.pid)
+
+        self._drainErr()
+        out = self._out[:-len(PROMPT)]
+        err = self._err
+        self._out = ""
+        self._err = ""
+        return out, err
+
+    def _drainErr(self):
+        """
+        Read the stderr of the command without waiting. The command wrote
+        to stderr before the shell wrote the prompt, but we may have seen
+        the prompt before reading all of it.
+        """
+        errFd = self.process.stderr.fileno()
+        while True:
+            ready = [fd for fd, event in
+                     utils.NoIntrPoll(self._poller.poll, 0)
+                     if fd == errFd and
+                     event & (select.EPOLLIN | select.EPOLLPRI)]
+            if not ready:
+                return
+            data = os.read(errFd, READ_SIZE)
+            if not data:
+                return
+            self._err += data
+
+
+class ShellPool(object):
+    """
+    Pool of persistent lvm shells. Commands use an idle shell; shells are
+    started on demand, up to size shells. When all the shells are busy, run
+    raises Busy instead of waiting, and the caller should run the command in
+    a new process, so commands hung on inaccessible storage do not delay
+    other commands.
+
+    A shell that failed or timed out is killed, since we cannot know in
+    which state it is.
+    """
+    log = logging.getLogger("Storage.LVM.ShellPool")
+
+    def __init__(self, size, timeout):
+        self._size = size
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = []
+        self._shells = 0  # Idle and busy shells
+
+    def run(self, args):
+        # Fail before taking a shell if the command cannot be sent
+        formatCommand(args)
+        shell = self._get()
+        try:
+            res = shell.run(args, self._timeout)
+        except Exception:
+            self.log.warning("Killing lvm shell (pid: %s)", shell.pid)
+            self._remove(shell)
+            raise
+        self._put(shell)
+        return res
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+            self._shells -= len(idle)
+        for shell in idle:
+            shell.stop()
+
+    def _get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            if self._shells >= self._size:
+                raise Busy("All lvm shells are busy")
+            self._shells += 1
+        try:
+            return Shell(self._timeout)
+        except Exception:
+            with self._lock:
+                self._shells -= 1
+            raise
+
+    def _put(self, shell):
+        with self._lock:
+            self._idle.append(shell)
+
+    def _remove(self, shell):
+        with self._lock:
+            self._shells -= 1
+        shell.stop()
@@ -49,6 +49,7 @@ import inspect
 
 from vdsm import constants
 from vdsm import utils
+import fileUtils
 import storage_exception as se
 import logUtils
 
@@ -185,43 +186,28 @@ def getProcCtime(pid):
 
     return str(ctime)
 
-_readspeed_regex = re.compile(
-    "(?P<bytes>\d+) bytes? \([\de\-.]+ [kMGT]*B\) copied, "
-    "(?P<seconds>[\de\-.]+) s, "
-    "([\de\-.]+|Infinity) [kMGT]*B/s"
-)
-
 
 def readspeed(path, buffersize=None):
     """
     Measures the amount of bytes transferred and the time elapsed
-    reading the content of the file/device
+    reading the content of the file/device, using direct I/O in the
+    calling thread.
     """
-    cmd = [constants.EXT_DD, "if=%s" % path, "iflag=%s" % DIRECTFLAG,
-           "of=/dev/null"]
-
-    if buffersize:
-        cmd.extend(["bs=%d" % buffersize, "count=1"])
-
-    rc, _, err = execCmd(cmd)
-    if rc != 0:
-        log.error("Unable to read file '%s'", path)
-        raise se.MiscFileReadException(path)
-
     try:
-        # The statistics are located in the last line:
-        m = _readspeed_regex.match(err[-1])
-    except IndexError:
-        log.error("Unable to find dd statistics to parse")
-        raise se.MiscFileReadException(path)
-
-    if m is None:
-        log.error("Unable to parse dd output: '%s'", err[-1])
+        with fileUtils.DirectFile(path, "rd") as f:
+            start = utils.monotonic_time()
+            if buffersize:
+                data = f.pread(buffersize, 0)
+            else:
+                data = f.readall()
+            elapsed = utils.monotonic_time() - start
+    except (OSError, IOError) as e:
+        log.error("Unable to read file '%s': %s", path, e)
         raise se.MiscFileReadException(path)
 
     return {
-        'bytes': int(m.group('bytes')),
-        'seconds': float(m.group('seconds')),
+        'bytes': len(data),
+        'seconds': elapsed,
     }
 
 
@@ -229,31 +215,34 @@ def readblock(name, offset, size):
     '''
     Read (direct IO) the content of device 'name' at offset, size bytes
     '''
+    return readblocks(name, [(offset, size)])[0]
 
-    # direct io must be aligned on block size boundaries
-    if (size % 512) or (offset % 512):
-        raise se.MiscBlockReadException(name, offset, size)
 
-    left = size
-    ret = ""
-    baseoffset = offset
-
-    while left > 0:
-        (iounit, count, iooffset) = _alignData(left, offset)
+def readblocks(name, ranges):
+    '''
+    Read (direct IO) the content of device 'name' at a list of (offset, size)
+    ranges, returning the lines of every range. Nearby ranges are read
+    together, without running any process.
+    '''
+    # direct io must be aligned on block size boundaries
+    for offset, size in ranges:
+        if (size % 512) or (offset % 512):
+            raise se.MiscBlockReadException(name, offset, size)
 
-        cmd = [constants.EXT_DD, "iflag=%s" % DIRECTFLAG, "skip=%d" % iooffset,
-               "bs=%d" % iounit, "if=%s" % name, "count=%s" % count]
+    try:
+        with fileUtils.DirectFile(name, "rd") as f:
+            blocks = f.readRanges(ranges)
+    except OSError as e:
+        log.error("Cannot read %s: %s", name, e)
+        offset, size = ranges[0]
+        raise se.MiscBlockReadException(name, offset, size)
 
-        (rc, out, err) = execCmd(cmd, raw=True)
-        if rc:
-            raise se.MiscBlockReadException(name, offset, size)
-        if not validateDDBytes(err.splitlines(), iounit * count):
+    result = []
+    for (offset, size), block in zip(ranges, blocks):
+        if len(block) != size:
             raise se.MiscBlockReadIncomplete(name, offset, size)
-
-        ret += out
-        left = left % iounit
-        offset = baseoffset + size - left
-    return ret.splitlines()
+        result.append(block.splitlines())
+    return result
 
 
 def validateDDBytes(ddstderr, size):
@@ -18,11 +18,15 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import collections
 import logging
+import math
 import threading
 import time
 import weakref
 
+from vdsm import executor
+from vdsm import schedule
 from vdsm import utils
 from vdsm.config import config
 
@@ -30,6 +34,10 @@ from . import clusterlock
 from . import misc
 from .sdc import sdCache
 
+# Checks waiting for a worker; must be larger than the number of monitored
+# domains, since every domain has at most one queued check.
+MAX_CHECKS = 1000
+
 
 class Status(object):
     __slots__ = (
@@ -76,14 +84,85 @@ class FrozenStatus(Status):
     __delattr__ = __setattr__
 
 
+class LatencyHistory(object):
+    """
+    Bounded history of latency samples, reporting the percentiles and the
+    maximum of the samples in recent time windows.
+    """
+
+    def __init__(self, size, clock=utils.monotonic_time):
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def add(self, value):
+        with self._lock:
+            self._samples.append((self._clock(), value))
+
+    def info(self, windows):
+        """
+        Return a dict with the statistics of the samples taken in the last
+        seconds of every window, keyed by the window seconds.
+        """
+        now = self._clock()
+        with self._lock:
+            samples = list(self._samples)
+        res = {}
+        for window in windows:
+            values = sorted(value for sampleTime, value in samples
+                            if now - sampleTime <= window)
+            stats = {'count': len(values)}
+            if values:
+                stats.update({
+                    'p50': percentile(values, 50),
+                    'p95': percentile(values, 95),
+                    'p99': percentile(values, 99),
+                    'max': values[-1],
+                })
+            res[str(window)] = stats
+        return res
+
+
+def percentile(values, p):
+    """
+    Return the nearest rank percentile p of sorted values.
+    """
+    rank = int(math.ceil(len(values) * p / 100.0))
+    return values[max(rank, 1) - 1]
+
+
+def historyWindows():
+    return [int(w) for w in
+            config.get("irs", "monitor_history_windows").split(",")]
+
+
 class DomainMonitor(object):
+    """
+    Monitor storage domains using a single scheduler thread and a bounded
+    pool of workers running the domain checks.
+
+    A check blocked on inaccessible storage for more than the check timeout
+    is left behind by its worker, so other domains are not delayed. The
+    next check of that domain is scheduled only when the blocked check
+    returns.
+    """
     log = logging.getLogger('Storage.Monitor')
 
     def __init__(self, interval):
         self._monitors = {}
         self._interval = interval
+        self._timeout = config.getint("irs", "monitor_check_timeout")
         self.onDomainStateChange = misc.Event(
             "Storage.DomainMonitor.onDomainStateChange")
+        self._scheduler = schedule.Scheduler(
+            name="Storage.Monitor.Scheduler", clock=utils.monotonic_time)
+        self._executor = executor.Executor(
+            name="Storage.Monitor.Executor",
+            workers_count=config.getint("irs", "monitor_workers"),
+            max_tasks=MAX_CHECKS,
+            scheduler=self._scheduler)
+        self._scheduler.start()
+        self._executor.start()
 
     @property
     def domains(self):
@@ -102,8 +181,9 @@ class DomainMonitor(object):
             return
 
         self.log.info("Start monitoring %s", sdUUID)
-        monitor = MonitorThread(weakref.proxy(self), sdUUID, hostId,
-                                self._interval)
+        monitor = MonitorTask(weakref.proxy(self), sdUUID, hostId,
+                              self._interval, self._scheduler,
+                              self._executor, self._timeout)
         monitor.poolDomain = poolDomain
         monitor.start()
         # The domain should be added only after it succesfully started
@@ -119,6 +199,16 @@ class DomainMonitor(object):
         for sdUUID, monitor in self._monitors.items():
             yield sdUUID, monitor.getStatus()
 
+    def getDomainsLatency(self, windows=None):
+        """
+        Yield the read delay and selftest latency statistics of every
+        monitored domain, see LatencyHistory.info().
+        """
+        if windows is None:
+            windows = historyWindows()
+        for sdUUID, monitor in self._monitors.items():
+            yield sdUUID, monitor.getLatency(windows)
+
     def getHostStatus(self, domains):
         status = {}
         for sdUUID, hostId in domains.iteritems():
@@ -133,6 +223,8 @@ class DomainMonitor(object):
     def close(self):
         self.log.info("Stop monitoring all domains")
         self._stopMonitors(self._monitors.values())
+        self._executor.stop(wait=False)
+        self._scheduler.stop()
 
     def _stopMonitors(self, monitors):
         # The domain monitor issues events that might become raceful if
@@ -141,13 +233,13 @@ class DomainMonitor(object):
         # the host id is released. If the monitor didn't actually exit it
         # might respawn a new acquire host id.
 
-        # First stop monitor threads - this take no time, and make the process
+        # First stop monitors - this take no time, and make the process
         # about 7 times faster when stopping 30 monitors.
         for monitor in monitors:
             self.log.info("Stop monitoring %s", monitor.sdUUID)
             monitor.stop()
 
-        # Now wait for threads to finish - this takes about 10 seconds with 30
+        # Now wait for monitors to finish - this takes about 10 seconds with 30
         # monitors, most of the time spent waiting for sanlock.
         for monitor in monitors:
             self.log.debug("Waiting for monitor %s", monitor.sdUUID)
@@ -159,12 +251,19 @@ class DomainMonitor(object):
                                  monitor.sdUUID)
 
 
-class MonitorThread(object):
+class MonitorTask(object):
+    """
+    Check a single domain every interval seconds, running the checks in the
+    domain monitor executor. A domain is never checked concurrently; the
+    next check is scheduled when the previous one is done.
+
+    When stopped, the host id is released after the running check is done,
+    or immediately if no check is running.
+    """
     log = logging.getLogger('Storage.Monitor')
 
-    def __init__(self, domainMonitor, sdUUID, hostId, interval):
-        self.thread = threading.Thread(target=self._run)
-        self.thread.setDaemon(True)
+    def __init__(self, domainMonitor, sdUUID, hostId, interval, scheduler,
+                 executor, timeout):
         self.domainMonitor = domainMonitor
         self.stopEvent = threading.Event()
         self.domain = None
@@ -178,19 +277,43 @@ class MonitorThread(object):
         self.lastRefresh = time.time()
         self.refreshTime = \
             config.getint("irs", "repo_stats_cache_refresh_timeout")
+        self._scheduler = scheduler
+        self._executor = executor
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._call = None
+        self._done = threading.Event()
+        historySize = config.getint("irs", "monitor_history_size")
+        self.readDelayHistory = LatencyHistory(historySize)
+        self.selftestHistory = LatencyHistory(historySize)
 
     def start(self):
-        self.thread.start()
+        self.log.debug("Domain monitor for %s started", self.sdUUID)
+        self._dispatch()
 
     def stop(self):
         self.stopEvent.set()
+        with self._lock:
+            call = self._call
+            self._call = None
+        # If a check is queued or running, it will finish the monitor when
+        # it is done.
+        if call is not None:
+            call.cancel()
+            self._dispatch()
 
     def join(self):
-        self.thread.join()
+        self._done.wait()
 
     def getStatus(self):
         return self.status
 
+    def getLatency(self, windows):
+        return {
+            'readDelay': self.readDelayHistory.info(windows),
+            'selftest': self.selftestHistory.info(windows),
+        }
+
     def getHostStatus(self, hostId):
         if not self.domain:
             return clusterlock.HOST_STATUS_UNAVAILABLE
@@ -200,26 +323,54 @@ class MonitorThread(object):
         """ Accessed by methods decorated with @util.cancelpoint """
         return self.stopEvent.is_set()
 
-    @utils.traceback(on=log.name)
-    def _run(self):
-        self.log.debug("Domain monitor for %s started", self.sdUUID)
+    # Called on the scheduler thread, must not block
+
+    def _scheduled(self):
+        with self._lock:
+            if self._call is None:
+                return  # Stopped
+            self._call = None
+        self._dispatch()
+
+    def _dispatch(self):
         try:
-            self._monitorLoop()
-        finally:
-            self.log.debug("Domain monitor for %s stopped", self.sdUUID)
-            if self._shouldReleaseHostId():
-                self._releaseHostId()
+            self._executor.dispatch(self._run, self._timeout)
+        except executor.TooManyTasks:
+            self.log.warning("Too many domain checks, delaying check for "
+                             "domain %s", self.sdUUID)
+            self._schedule()
+        except executor.NotRunning:
+            self._finish()
+
+    def _schedule(self):
+        with self._lock:
+            if not self.stopEvent.is_set():
+                self._call = self._scheduler.schedule(self.interval,
+                                                      self._scheduled)
+                return
+        self._finish()
+
+    # Called on an executor worker
 
-    def _monitorLoop(self):
-        while not self.stopEvent.is_set():
+    def _run(self):
+        if not self.stopEvent.is_set():
             try:
                 self._monitorDomain()
             except utils.Canceled:
                 self.log.debug("Domain monitor for %s canceled", self.sdUUID)
-                return
             except:
                 self.log.exception("Domain monitor for %s failed", self.sdUUID)
-            self.stopEvent.wait(self.interval)
+        self._schedule()
+
+    def _finish(self):
+        if self._done.is_set():
+            return
+        try:
+            if self._shouldReleaseHostId():
+                self._releaseHostId()
+        finally:
+            self.log.debug("Domain monitor for %s stopped", self.sdUUID)
+            self._done.set()
 
     def _monitorDomain(self):
         self.nextStatus = Status()
@@ -310,13 +461,16 @@ class MonitorThread(object):
     def _performDomainSelftest(self):
         # This may trigger a refresh of lvm cache. We have seen this taking up
         # to 90 seconds on overloaded machines.
+        start = utils.monotonic_time()
         self.domain.selftest()
+        self.selftestHistory.add(utils.monotonic_time() - start)
 
     @utils.cancelpoint
     def _checkReadDelay(self):
         # This may block for long time if the storage server is not accessible.
         # On overloaded machines we have seen this take up to 15 seconds.
         self.nextStatus.readDelay = self.domain.getReadDelay()
+        self.readDelayHistory.add(self.nextStatus.readDelay)
 
     def _collectStatistics(self):
         stats = self.domain.getStats()
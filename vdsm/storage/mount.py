@@ -22,11 +22,13 @@ import errno
 from os.path import normpath
 import re
 import os
+import select
 import stat
 import threading
 
 from vdsm import cmdutils
 from vdsm import constants
+from vdsm import utils
 import misc
 
 # Common vfs types
@@ -40,6 +42,7 @@ MountRecord = namedtuple("MountRecord", "fs_spec fs_file fs_vfstype "
 
 _ETC_MTAB_PATH = '/etc/mtab'
 _PROC_MOUNTS_PATH = '/proc/mounts'
+_PROC_MOUNTINFO_PATH = '/proc/self/mountinfo'
 _SYS_DEV_BLOCK_PATH = '/sys/dev/block/'
 
 _RE_ESCAPE = re.compile(r"\\0\d\d")
@@ -148,14 +151,7 @@ def _iterKnownMounts():
 
 
 def _iterMountRecords():
-    for rec in _iterKnownMounts():
-        realSpec = _resolveLoopDevice(rec.fs_spec)
-        if rec.fs_spec == realSpec:
-            yield rec
-            continue
-
-        yield MountRecord(realSpec, rec.fs_file, rec.fs_vfstype,
-                          rec.fs_mntops, rec.fs_freq, rec.fs_passno)
+    return iter(_mountTable.records())
 
 
 def iterMounts():
@@ -176,20 +172,132 @@ def isMounted(target):
 
 def getMountFromTarget(target):
     target = normpath(target)
-    for rec in _iterMountRecords():
-        if rec.fs_file == target:
-            return Mount(rec.fs_spec, rec.fs_file)
+    records = _mountTable.lookupTarget(target)
+    if not records:
+        raise OSError(errno.ENOENT, 'Mount target %s not found' % target)
 
-    raise OSError(errno.ENOENT, 'Mount target %s not found' % target)
+    return Mount(records[0].fs_spec, records[0].fs_file)
 
 
 def getMountFromDevice(device):
     device = normpath(device)
-    for rec in _iterMountRecords():
-        if rec.fs_spec == device:
-            return Mount(rec.fs_spec, rec.fs_file)
+    records = _mountTable.lookupDevice(device)
+    if not records:
+        raise OSError(errno.ENOENT, 'device %s not mounted' % device)
+
+    return Mount(records[0].fs_spec, records[0].fs_file)
+
+
+class MountInfoWatcher(object):
+    """
+    Detect changes in the mount table without reading it.
+
+    The kernel reports POLLERR | POLLPRI on /proc/self/mountinfo after a
+    mount or umount, once for every open file.
+    """
+
+    def __init__(self, path=_PROC_MOUNTINFO_PATH):
+        self._lock = threading.Lock()
+        self._file = open(path)
+        self._poller = select.poll()
+        self._poller.register(self._file.fileno(),
+                              select.POLLERR | select.POLLPRI)
+
+    def changed(self):
+        """
+        Return True if the mount table changed since the watcher was created
+        or since the last call returning True.
+        """
+        with self._lock:
+            events = utils.NoIntrPoll(self._poller.poll, 0)
+        return any(event & (select.POLLERR | select.POLLPRI)
+                   for fd, event in events)
+
+    def close(self):
+        with self._lock:
+            self._poller.unregister(self._file.fileno())
+            self._file.close()
+
+
+class MountTable(object):
+    """
+    Cache of the mount table records, indexed by target (fs_file) and by
+    device (fs_spec), reloaded only when the mount table was changed.
+
+    Changes are detected with a MountInfoWatcher; if the watcher cannot be
+    created, the mount table is reloaded on every access. Safe to use from
+    multiple threads; readers get an immutable snapshot of the records.
+    """
+
+    def __init__(self, watcher=None):
+        self._lock = threading.Lock()
+        self._watcher = watcher
+        self._pid = os.getpid() if watcher is not None else None
+        self._records = None
+        self._byTarget = {}
+        self._byDevice = {}
+
+    def records(self):
+        return self._snapshot()[0]
+
+    def lookupTarget(self, target):
+        """
+        Return the records mounted on normalized path target, in mount
+        table order.
+        """
+        return self._snapshot()[1].get(target, ())
+
+    def lookupDevice(self, device):
+        """
+        Return the records of normalized device path device (with loop
+        devices resolved to the backing file), in mount table order.
+        """
+        return self._snapshot()[2].get(device, ())
+
+    def invalidate(self):
+        with self._lock:
+            self._records = None
+
+    def _snapshot(self):
+        with self._lock:
+            # The watcher file is shared with child processes after fork,
+            # and every event is reported to only one of them.
+            if self._pid != os.getpid():
+                self._startWatching()
+            if (self._records is None or self._watcher is None or
+                    self._watcher.changed()):
+                self._load()
+            return self._records, self._byTarget, self._byDevice
+
+    def _startWatching(self):
+        if self._watcher is not None:
+            self._watcher.close()
+        try:
+            self._watcher = MountInfoWatcher()
+        except (OSError, IOError, select.error):
+            self._watcher = None
+        self._pid = os.getpid()
+        self._records = None
+
+    def _load(self):
+        records = []
+        byTarget = {}
+        byDevice = {}
+        for rec in _iterKnownMounts():
+            realSpec = _resolveLoopDevice(rec.fs_spec)
+            if rec.fs_spec != realSpec:
+                rec = MountRecord(realSpec, rec.fs_file, rec.fs_vfstype,
+                                  rec.fs_mntops, rec.fs_freq, rec.fs_passno)
+            records.append(rec)
+            byTarget.setdefault(rec.fs_file, []).append(rec)
+            byDevice.setdefault(rec.fs_spec, []).append(rec)
+
+        self._records = tuple(records)
+        self._byTarget = dict((k, tuple(v)) for k, v in byTarget.iteritems())
+        self._byDevice = dict((k, tuple(v)) for k, v in byDevice.iteritems())
+
 
-    raise OSError(errno.ENOENT, 'device %s not mounted' % device)
+_mountTable = MountTable()
 
 
 class Mount(object):
@@ -276,8 +384,8 @@ class Mount(object):
         else:
             fs_specs = self.fs_spec, None
 
-        for record in _iterMountRecords():
-            if self.fs_file == record.fs_file and record.fs_spec in fs_specs:
+        for record in _mountTable.lookupTarget(self.fs_file):
+            if record.fs_spec in fs_specs:
                 return record
 
         raise OSError(errno.ENOENT,
@@ -27,6 +27,7 @@ import errno
 from glob import glob
 import logging
 import re
+import threading
 from collections import namedtuple
 
 from vdsm import constants
@@ -140,77 +141,271 @@ def getHBTL(physdev):
     return HBTL(*hbtl[0].split(":"))
 
 
-def pathListIter(filterGuids=None):
-    filteringOn = filterGuids is not None
-    filterLen = len(filterGuids) if filteringOn else -1
-    devsFound = 0
+class DeviceInventory(object):
+    """
+    Cache the information about multipath devices that does not change while
+    a device exists (serial, vendor, product, firmware revision and block
+    sizes) keyed by device guid, and the iSCSI sessions info, keyed by
+    session id. The information of uncached devices is collected by a
+    single supervdsm call.
+
+    The multipath devices and their paths are read from sysfs on every
+    query, so added or removed devices and paths are always reported. Udev
+    change and remove events for a multipath device drop its cached
+    information; removing a disk drops the cached sessions info.
+    """
+    log = logging.getLogger("Storage.Multipath.Inventory")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}  # {guid: info}
+        self._sessions = {}  # {sessionID: sessionInfo}
+        self._dmIds = {}  # {guid: dmId}
+        self._gen = 0
+        self._udevMonitor = None
+
+    def start(self):
+        """
+        Start listening to udev events, if not started yet.
+        """
+        with self._lock:
+            if self._udevMonitor is not None:
+                return
+            self._udevMonitor = udevadm.Monitor(self.handleUdevEvent,
+                                                subsystem="block")
+        self._udevMonitor.start()
+
+    def getDevices(self, filterGuids=None):
+        """
+        Return a list of (dmId, guid) of the multipath devices, or only of
+        the devices in filterGuids. Looking up known devices reads only
+        their sysfs entries.
+        """
+        if filterGuids is not None:
+            with self._lock:
+                dmIds = [(self._dmIds.get(guid), guid) for guid in filterGuids]
+            if all(_getMPDevGuid(dmId) == guid for dmId, guid in dmIds):
+                return dmIds
+
+        devices = list(getMPDevsIter())
+        with self._lock:
+            self._dmIds = dict((guid, dmId) for dmId, guid in devices)
+            if filterGuids is None:
+                for guid in set(self._devices) - set(self._dmIds):
+                    del self._devices[guid]
+
+        if filterGuids is not None:
+            devices = [(dmId, guid) for dmId, guid in devices
+                       if guid in filterGuids]
+        return devices
+
+    def getDevicesInfo(self, devices):
+        """
+        Return a dict {guid: info} of the devices (dmId, guid) pairs,
+        collecting the information of uncached devices concurrently.
+        """
+        with self._lock:
+            res = dict((guid, self._devices[guid]) for dmId, guid in devices
+                       if guid in self._devices)
+            gen = self._gen
+
+        missing = [(dmId, guid) for dmId, guid in devices if guid not in res]
+        if not missing:
+            return res
+
+        self.log.debug("Collecting information for %d devices",
+                       len(missing))
+        collected = self._collectDevicesInfo(missing)
+        for dmId, guid in missing:
+            info, complete = collected.get(dmId, (_emptyDeviceInfo(), False))
+            collected[dmId] = info
+            if complete:
+                res[guid] = info
+
+        with self._lock:
+            # Do not cache information collected while a device changed.
+            if self._gen == gen:
+                self._devices.update(res)
+
+        for dmId, guid in missing:
+            res.setdefault(guid, collected[dmId])
+        return res
+
+    def _collectDevicesInfo(self, devices):
+        return supervdsm.getProxy().getDevicesInfo(
+            [dmId for dmId, guid in devices])
+
+    def getSessionInfo(self, sessionID):
+        with self._lock:
+            sessionInfo = self._sessions.get(sessionID)
+        if sessionInfo is None:
+            sessionInfo = _collectSessionInfo(sessionID)
+            with self._lock:
+                self._sessions[sessionID] = sessionInfo
+        return sessionInfo
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+            self._sessions.clear()
+            self._gen += 1
+
+    def handleUdevEvent(self, event):
+        action = event.get("ACTION")
+        if action not in ("change", "remove"):
+            return
+
+        if event.get("DM_UUID", "").startswith("mpath-"):
+            guid = event.get("DM_NAME")
+            with self._lock:
+                self._gen += 1
+                if self._devices.pop(guid, None) is not None:
+                    self.log.debug("udev %s event for device %s", action,
+                                   guid)
+        elif action == "remove" and event.get("DEVTYPE") == "disk":
+            with self._lock:
+                self._gen += 1
+                self._sessions.clear()
+
+
+def _emptyDeviceInfo():
+    return {
+        "serial": "",
+        "vendor": "",
+        "product": "",
+        "fwrev": "",
+        "logicalblocksize": "",
+        "physicalblocksize": "",
+    }
+
+
+def getDeviceInfo(dmId):
+    """
+    Return the serial, vendor, product, firmware revision and block sizes
+    of multipath device dmId, and True if the information was collected
+    from a path of the device.
 
-    knownSessions = {}
+    Must run as root for reading the serial.
+    """
+    info = _emptyDeviceInfo()
+    info["serial"] = getScsiSerial(dmId)
+    complete = False
 
-    svdsm = supervdsm.getProxy()
-    pathStatuses = devicemapper.getPathsStatus()
+    for slave in devicemapper.getSlaves(dmId):
+        if not devicemapper.isBlockDevice(slave):
+            continue
 
-    for dmId, guid in getMPDevsIter():
-        if devsFound == filterLen:
-            break
+        complete = True
 
-        if filteringOn and guid not in filterGuids:
-            continue
+        if not info["vendor"]:
+            try:
+                info["vendor"] = getVendor(slave)
+            except Exception:
+                log.warn("Problem getting vendor from device `%s`",
+                         slave, exc_info=True)
+                complete = False
+
+        if not info["product"]:
+            try:
+                info["product"] = getModel(slave)
+            except Exception:
+                log.warn("Problem getting model name from device `%s`",
+                         slave, exc_info=True)
+                complete = False
+
+        if not info["fwrev"]:
+            try:
+                info["fwrev"] = getFwRev(slave)
+            except Exception:
+                log.warn("Problem getting fwrev from device `%s`",
+                         slave, exc_info=True)
+                complete = False
+
+        if (not info["logicalblocksize"] or
+                not info["physicalblocksize"]):
+            try:
+                logBlkSize, phyBlkSize = getDeviceBlockSizes(slave)
+                info["logicalblocksize"] = str(logBlkSize)
+                info["physicalblocksize"] = str(phyBlkSize)
+            except Exception:
+                log.warn("Problem getting blocksize from device `%s`",
+                         slave, exc_info=True)
+                complete = False
+
+    return info, complete
+
+
+def getDevicesInfo(dmIds, workers):
+    """
+    Return a dict {dmId: (info, complete)} with the getDeviceInfo() results
+    of multipath devices dmIds, collected concurrently by workers threads.
+    Devices that failed are not included.
+    """
+    def collect(dmId):
+        try:
+            return dmId, getDeviceInfo(dmId)
+        except Exception:
+            log.warning("Error collecting information for device %s", dmId,
+                        exc_info=True)
+            return dmId, None
+
+    res = {}
+    for dmId, result in misc.itmap(collect, dmIds, workers):
+        if result is not None:
+            res[dmId] = result
+    return res
 
-        devsFound += 1
 
+def _collectSessionInfo(sessionID):
+    # FIXME: This entire part is for BC. It should be moved to
+    # hsm and not preserved for new APIs. New APIs should keep
+    # numeric types and sane field names.
+    sess = iscsi.getSessionInfo(sessionID)
+    sessionInfo = {
+        "connection": sess.target.portal.hostname,
+        "port": str(sess.target.portal.port),
+        "iqn": sess.target.iqn,
+        "portal": str(sess.target.tpgt),
+        "initiatorname": sess.iface.name
+    }
+
+    # Note that credentials must be sent back in order for
+    # the engine to tell vdsm how to reconnect later
+    if sess.credentials:
+        cred = sess.credentials
+        sessionInfo['user'] = cred.username
+        sessionInfo['password'] = cred.password
+
+    return sessionInfo
+
+
+_inventory = DeviceInventory()
+
+
+def pathListIter(filterGuids=None):
+    _inventory.start()
+
+    pathStatuses = devicemapper.getPathsStatus()
+    devices = _inventory.getDevices(filterGuids)
+    devicesInfo = _inventory.getDevicesInfo(devices)
+
+    for dmId, guid in devices:
         devInfo = {
             "guid": guid,
             "dm": dmId,
             "capacity": str(getDeviceSize(dmId)),
-            "serial": svdsm.getScsiSerial(dmId),
             "paths": [],
             "connections": [],
             "devtypes": [],
             "devtype": "",
-            "vendor": "",
-            "product": "",
-            "fwrev": "",
-            "logicalblocksize": "",
-            "physicalblocksize": "",
         }
+        devInfo.update(devicesInfo[guid])
 
         for slave in devicemapper.getSlaves(dmId):
             if not devicemapper.isBlockDevice(slave):
                 log.warning("No such physdev '%s' is ignored" % slave)
                 continue
 
-            if not devInfo["vendor"]:
-                try:
-                    devInfo["vendor"] = getVendor(slave)
-                except Exception:
-                    log.warn("Problem getting vendor from device `%s`",
-                             slave, exc_info=True)
-
-            if not devInfo["product"]:
-                try:
-                    devInfo["product"] = getModel(slave)
-                except Exception:
-                    log.warn("Problem getting model name from device `%s`",
-                             slave, exc_info=True)
-
-            if not devInfo["fwrev"]:
-                try:
-                    devInfo["fwrev"] = getFwRev(slave)
-                except Exception:
-                    log.warn("Problem getting fwrev from device `%s`",
-                             slave, exc_info=True)
-
-            if (not devInfo["logicalblocksize"] or
-                    not devInfo["physicalblocksize"]):
-                try:
-                    logBlkSize, phyBlkSize = getDeviceBlockSizes(slave)
-                    devInfo["logicalblocksize"] = str(logBlkSize)
-                    devInfo["physicalblocksize"] = str(phyBlkSize)
-                except Exception:
-                    log.warn("Problem getting blocksize from device `%s`",
-                             slave, exc_info=True)
-
             pathInfo = {}
             pathInfo["physdev"] = slave
             pathInfo["state"] = pathStatuses.get(slave, "failed")
@@ -232,28 +427,8 @@ def pathListIter(filterGuids=None):
                 devInfo["devtypes"].append(DEV_ISCSI)
                 pathInfo["type"] = DEV_ISCSI
                 sessionID = iscsi.getiScsiSession(slave)
-                if sessionID not in knownSessions:
-                    # FIXME: This entire part is for BC. It should be moved to
-                    # hsm and not preserved for new APIs. New APIs should keep
-                    # numeric types and sane field names.
-                    sess = iscsi.getSessionInfo(sessionID)
-                    sessionInfo = {
-                        "connection": sess.target.portal.hostname,
-                        "port": str(sess.target.portal.port),
-                        "iqn": sess.target.iqn,
-                        "portal": str(sess.target.tpgt),
-                        "initiatorname": sess.iface.name
-                    }
-
-                    # Note that credentials must be sent back in order for
-                    # the engine to tell vdsm how to reconnect later
-                    if sess.credentials:
-                        cred = sess.credentials
-                        sessionInfo['user'] = cred.username
-                        sessionInfo['password'] = cred.password
-
-                    knownSessions[sessionID] = sessionInfo
-                devInfo["connections"].append(knownSessions[sessionID])
+                devInfo["connections"].append(
+                    _inventory.getSessionInfo(sessionID))
             else:
                 devInfo["devtypes"].append(DEV_FCP)
                 pathInfo["type"] = DEV_FCP
@@ -285,28 +460,43 @@ def getMPDevsIter():
     Return the list of device identifiers w/o "/dev/mapper" prefix
     """
     for dmInfoDir in glob("/sys/block/dm-*/dm/"):
-        uuidFile = os.path.join(dmInfoDir, "uuid")
-        try:
-            with open(uuidFile, "r") as uf:
-                uuid = uf.read().strip()
-        except (OSError, IOError):
-            continue
-
-        if not uuid.startswith("mpath-"):
-            continue
-
-        nameFile = os.path.join(dmInfoDir, "name")
-        try:
-            with open(nameFile, "r") as nf:
-                guid = nf.read().rstrip("\n")
-        except (OSError, IOError):
+        dmId = dmInfoDir.split("/")[3]
+        guid = _getMPDevGuid(dmId)
+        if guid is None:
             continue
 
         if TOXIC_REGEX.match(guid):
             log.info("Device with unsupported GUID %s discarded", guid)
             continue
 
-        yield dmInfoDir.split("/")[3], guid
+        yield dmId, guid
+
+
+def _getMPDevGuid(dmId):
+    """
+    Return the guid of multipath device dmId, or None if dmId is not a
+    multipath device.
+    """
+    if dmId is None:
+        return None
+
+    dmInfoDir = os.path.join("/sys/block", dmId, "dm")
+    uuidFile = os.path.join(dmInfoDir, "uuid")
+    try:
+        with open(uuidFile, "r") as uf:
+            uuid = uf.read().strip()
+    except (OSError, IOError):
+        return None
+
+    if not uuid.startswith("mpath-"):
+        return None
+
+    nameFile = os.path.join(dmInfoDir, "name")
+    try:
+        with open(nameFile, "r") as nf:
+            return nf.read().rstrip("\n")
+    except (OSError, IOError):
+        return None
 
 
 def devIsiSCSI(type):
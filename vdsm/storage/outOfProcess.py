@@ -69,6 +69,23 @@ def setDefaultImpl(impl):
         _oopImpl = RFH
 
 
+def appendsInPlace():
+    """
+    Return True if appendLines appends to the file in place. Otherwise it
+    rewrites the whole file, and appending costs as much as writing the file.
+    """
+    return _oopImpl != IOPROC
+
+
+def batchesBulkOperations():
+    """
+    Return True if the bulk operations (statMany, readLinesMany, globStat and
+    walkStat) access all the paths in one call. Otherwise they make one call
+    per path, and should not be used where a single glob would do.
+    """
+    return _oopImpl != IOPROC
+
+
 def cleanIdleIOProcesses(clientName):
     now = elapsed_time()
     for name, (eol, proc) in _procPool.items():
@@ -113,6 +130,19 @@ def getGlobalProcPool():
     return getProcessPool(GLOBAL)
 
 
+def getProcessPoolStats(clientName):
+    """
+    Return the statistics of the helpers of clientName's pool (see
+    RemoteFileHandlerPool.stats), or None if the implementation does not
+    keep statistics.
+    """
+    with _procPoolLock:
+        pool = _rfhPool.get(clientName)
+    if pool is None:
+        return None
+    return pool._procPool.stats()
+
+
 class _IOProcessGlob(object):
     def __init__(self, iop):
         self._iop = iop
@@ -364,6 +394,22 @@ def writeLines(ioproc, path, lines):
     return ioproc.writefile(path, data)
 
 
+def appendLines(ioproc, path, lines):
+    # ioprocess cannot append to a file, so we replace the file with a copy
+    # including the new lines.
+    try:
+        data = ioproc.readfile(path)
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+        data = ""
+    tmpPath = path + ".append"
+    ioproc.writefile(tmpPath, data + "".join(lines))
+    ioproc.fsyncPath(tmpPath)
+    ioproc.rename(tmpPath, path)
+    ioproc.fsyncPath(os.path.dirname(path))
+
+
 def simpleWalk(ioproc, path):
     files = []
     for f in ioproc.listdir(path):
@@ -377,6 +423,47 @@ def simpleWalk(ioproc, path):
     return files
 
 
+# ioprocess does not provide bulk operations, so these run one ioprocess
+# call per path.
+
+
+def statMany(ioproc, paths):
+    res = []
+    for path in paths:
+        try:
+            res.append(ioproc.stat(path))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            res.append(None)
+    return res
+
+
+def readLinesMany(ioproc, paths, direct=False):
+    read = partial(directReadLines, ioproc) if direct else ioproc.readlines
+    res = []
+    for path in paths:
+        try:
+            res.append(read(path))
+        except (OSError, IOError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            res.append(None)
+    return res
+
+
+def globStat(ioproc, pattern):
+    paths = ioproc.glob(pattern)
+    return [(path, st) for path, st in zip(paths, statMany(ioproc, paths))
+            if st is not None]
+
+
+def walkStat(ioproc, top):
+    paths = simpleWalk(ioproc, top)
+    return [(path, st) for path, st in zip(paths, statMany(ioproc, paths))
+            if st is not None]
+
+
 def truncateFile(ioproc, path, size, mode=None, creatExcl=False):
     ioproc.truncate(path, size, mode, creatExcl)
     if mode is not None:
@@ -396,9 +483,14 @@ class _IOProcWrapper(types.ModuleType):
         self.directReadLines = partial(directReadLines, ioproc)
         self.readLines = partial(readLines, ioproc)
         self.writeLines = partial(writeLines, ioproc)
+        self.appendLines = partial(appendLines, ioproc)
         self.simpleWalk = partial(simpleWalk, ioproc)
         self.directTouch = partial(directTouch, ioproc)
         self.truncateFile = partial(truncateFile, ioproc)
+        self.statMany = partial(statMany, ioproc)
+        self.readLinesMany = partial(readLinesMany, ioproc)
+        self.globStat = partial(globStat, ioproc)
+        self.walkStat = partial(walkStat, ioproc)
 
 
 class _ModuleWrapper(types.ModuleType):
@@ -29,11 +29,13 @@ from contextlib import contextmanager
 
 import storage_exception as se
 import threading
-from copy import deepcopy
 from itertools import ifilter
 
 SHA_CKSUM_TAG = "_SHA_CKSUM"
 
+# Marks keys added in a transaction in the change log
+_MISSING = object()
+
 
 def _preprocessLine(line):
     if not isinstance(line, unicode):
@@ -155,6 +157,13 @@ class PersistentDict(object):
 
     @contextmanager
     def transaction(self):
+        """
+        Flush the changes made in the transaction, or roll them back if the
+        transaction failed.
+
+        Instead of copying the metadata, the transaction keeps the original
+        value of every key modified in the transaction.
+        """
         with self._syncRoot:
             if self._inTransaction:
                 self.log.debug("Reusing active transaction")
@@ -165,11 +174,10 @@ class PersistentDict(object):
 
             with self._accessWrapper():
                 self.log.debug("Starting transaction")
-                backup = deepcopy(self._metadata)
+                self._changes = {}
                 try:
                     yield
-                    # TODO : check appropriateness
-                    if backup != self._metadata:
+                    if self._modified():
                         self.log.debug("Flushing changes")
                         self.flush(self._metadata)
                     self.log.debug("Finished transaction")
@@ -177,17 +185,37 @@ class PersistentDict(object):
                     self.log.warn("Error in transaction, rolling back changes",
                                   exc_info=True)
                     # TBD: Maybe check that the old MD is what I remember?
-                    self.flush(backup)
+                    self._rollback()
+                    self.flush(self._metadata)
                     raise
                 finally:
+                    self._changes = None
                     self._inTransaction = False
 
+    def _recordChange(self, key):
+        if key not in self._changes:
+            self._changes[key] = self._metadata.get(key, _MISSING)
+
+    def _modified(self):
+        return any(self._metadata.get(key, _MISSING) != value
+                   for key, value in self._changes.iteritems())
+
+    def _rollback(self):
+        for key, value in self._changes.iteritems():
+            if value is _MISSING:
+                self._metadata.pop(key, None)
+            else:
+                self._metadata[key] = value
+        self._changes.clear()
+
     def __init__(self, metaReaderWriter):
         self._syncRoot = threading.RLock()
         self._metadata = {}
         self._metaRW = metaReaderWriter
         self._isValid = False
         self._inTransaction = False
+        # {key: original value} of the keys modified in the transaction
+        self._changes = None
         self.log.debug("Created a persistent dict with %s backend",
                        self._metaRW.__class__.__name__)
 
@@ -203,14 +231,19 @@ class PersistentDict(object):
 
     def __setitem__(self, key, value):
         with self.transaction():
+            self._recordChange(key)
             self._metadata.__setitem__(key, value)
 
     def __delitem__(self, key):
         with self.transaction():
+            if key in self._metadata:
+                self._recordChange(key)
             self._metadata.__delitem__(key)
 
     def update(self, metadata):
         with self.transaction():
+            for key in metadata:
+                self._recordChange(key)
             self._metadata.update(metadata)
 
     def keys(self):
@@ -326,4 +359,6 @@ class PersistentDict(object):
 
     def clear(self):
         with self.transaction():
+            for key in self._metadata:
+                self._recordChange(key)
             self._metadata.clear()
@@ -19,7 +19,8 @@
 #
 
 from struct import unpack, pack, calcsize
-from threading import Lock
+import Queue
+from threading import Event, Lock, Thread
 from time import time, sleep
 import errno
 import glob
@@ -28,7 +29,6 @@ import os
 import signal
 import sys
 import select
-from contextlib import contextmanager
 
 if __name__ != "__main__":
     # The following modules are not used by the newly spawned child porcess.
@@ -52,8 +52,23 @@ from vdsm import utils
 
 
 # Crabs are known for their remote process calls
-LENGTH_STRUCT_FMT = "Q"
-LENGTH_STRUCT_LENGTH = calcsize(LENGTH_STRUCT_FMT)
+#
+# Every message is framed with a header holding the request id and the
+# length of the pickled payload. Requests are (name, args, kwargs) and
+# responses are (result, error). The server runs the requests concurrently
+# in worker threads, so a client may send more requests before receiving the
+# responses, and responses may arrive in any order.
+HEADER_STRUCT_FMT = "QQ"
+HEADER_STRUCT_LENGTH = calcsize(HEADER_STRUCT_FMT)
+
+READ_SIZE = 65536
+
+# Maximum number of outstanding requests sent to one handler
+MAX_REQUESTS_PER_HANDLER = 10
+
+# A handler with a request waiting longer than this (in seconds) is not sent
+# more requests, so fast calls are not queued behind a stuck handler.
+SLOW_REQUEST_THRESHOLD = 1.0
 
 
 class Timeout(RuntimeError):
@@ -68,6 +83,10 @@ class CrabRPCServer(object):
         self.wfile = os.fdopen(myWrite, "wa")
         self.registeredFunctions = {}
         self.registeredModules = {}
+        self._writeLock = Lock()
+        self._workersLock = Lock()
+        self._idleWorkers = 0
+        self._requests = Queue.Queue()
 
     def registerFunction(self, func, name=None):
         if name is None:
@@ -90,23 +109,58 @@ class CrabRPCServer(object):
                 return
 
     def serve_once(self):
-        rawLength = self.rfile.read(LENGTH_STRUCT_LENGTH)
-        length = unpack(LENGTH_STRUCT_FMT, rawLength)[0]
+        header = self.rfile.read(HEADER_STRUCT_LENGTH)
+        if len(header) < HEADER_STRUCT_LENGTH:
+            raise Exception("Pipe broke")
+
+        reqId, length = unpack(HEADER_STRUCT_FMT, header)
         pickledCall = self.rfile.read(length)
         if len(pickledCall) < length:
             raise Exception("Pipe broke")
 
-        name, args, kwargs = pickle.loads(pickledCall)
+        # Workers are started on demand, so their number is limited by the
+        # number of outstanding requests sent by the client.
+        with self._workersLock:
+            if self._idleWorkers > 0:
+                self._idleWorkers -= 1
+            else:
+                t = Thread(target=self._work)
+                t.daemon = True
+                t.start()
+        self._requests.put((reqId, pickledCall))
+
+    def _work(self):
+        while True:
+            reqId, pickledCall = self._requests.get()
+            try:
+                self._serveRequest(reqId, pickledCall)
+            finally:
+                with self._workersLock:
+                    self._idleWorkers += 1
+
+    def _serveRequest(self, reqId, pickledCall):
         err = res = None
         try:
+            name, args, kwargs = pickle.loads(pickledCall)
             res = self.callRegisteredFunction(name, args, kwargs)
         except Exception as ex:
             err = ex
 
-        resp = pickle.dumps((res, err))
-        self.wfile.write(pack(LENGTH_STRUCT_FMT, len(resp)))
-        self.wfile.write(resp)
-        self.wfile.flush()
+        try:
+            resp = pickle.dumps((res, err))
+        except Exception as ex:
+            resp = pickle.dumps((None, RuntimeError(
+                "Cannot pickle response: %s" % ex)))
+
+        with self._writeLock:
+            self.wfile.write(pack(HEADER_STRUCT_FMT, reqId, len(resp)))
+            self.wfile.write(resp)
+            self.wfile.flush()
+
+    def close(self):
+        with self._writeLock:
+            self.wfile.close()
+        self.rfile.close()
 
     def callRegisteredFunction(self, name, args, kwargs):
         if "." not in name:
@@ -121,7 +175,33 @@ class CrabRPCServer(object):
         return func(*args, **kwargs)
 
 
+class _Call(object):
+
+    def __init__(self):
+        self.started = time()
+        self.done = False
+        self.response = None
+        self.error = None
+        # Created only if the caller has to wait for another reader
+        self.wakeup = None
+
+
 class CrabRPCProxy(object):
+    """
+    Client side of the CrabRPC protocol. Multiple threads may call
+    functions concurrently, sending requests without waiting for the
+    responses of other calls.
+
+    There is no reader thread; one of the waiting callers reads responses
+    and delivers them to the other callers by request id. When it gets its
+    own response, it wakes up another caller to take over reading.
+
+    If the connection breaks, sending a request times out, or the proxy is
+    closed, the proxy cannot be used anymore, and all pending and new calls
+    raise Timeout. Closing the proxy wakes up the callers using the pipes,
+    and the pipes are closed by the last caller leaving, so a caller never
+    uses a closed (or reused) file descriptor.
+    """
     log = logging.getLogger("Storage.CrabRPCProxy")
 
     def __init__(self, myRead, myWrite):
@@ -129,89 +209,280 @@ class CrabRPCProxy(object):
         self._myRead = myRead
         filecontrol.set_non_blocking(self._myWrite)
         filecontrol.set_non_blocking(self._myRead)
-        self._poller = select.poll()
+        # The sender and the reader poll concurrently
+        self._sendPoller = select.poll()
+        self._sendPoller.register(self._myWrite, select.POLLOUT)
+        self._readPoller = select.poll()
+        self._readPoller.register(self._myRead,
+                                  select.POLLIN | select.POLLPRI)
+        # Written when the proxy breaks, waking up the sender and the reader
+        self._wakeRead, self._wakeWrite = os.pipe()
+        filecontrol.set_non_blocking(self._wakeWrite)
+        self._sendPoller.register(self._wakeRead, select.POLLIN)
+        self._readPoller.register(self._wakeRead, select.POLLIN)
+        self._sendLock = Lock()
+        self._lock = Lock()
+        self._pending = {}
+        self._nextId = 0
+        self._users = 0
+        self._reading = False
+        self._broken = False
+        # Partly received message, kept when a reader gives up
+        self._header = None
+        self._chunks = []
+        self._received = 0
+        # Statistics
+        self._calls = 0
+        self._timeouts = 0
+        self._maxPending = 0
+        self._totalLatency = 0.0
+        self._maxLatency = 0.0
+
+    def stats(self):
+        """
+        Return the number of pending calls, and the number and latency of
+        completed calls.
+        """
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "maxPending": self._maxPending,
+                "calls": self._calls,
+                "timeouts": self._timeouts,
+                "avgLatency": (self._totalLatency / self._calls
+                               if self._calls else 0.0),
+                "maxLatency": self._maxLatency,
+            }
+
+    def pendingAge(self):
+        """
+        Return the number of seconds the oldest pending call is waiting, or 0
+        if there are no pending calls.
+        """
+        with self._lock:
+            if not self._pending:
+                return 0
+            return time() - min(c.started for c in self._pending.itervalues())
+
+    def _poll(self, poller, timeout):
+        return misc.NoIntrPoll(poller.poll, timeout * 1000)
+
+    def _sendAll(self, data, deadline):
+        sent = 0
+        while sent < len(data):
+            try:
+                sent += os.write(self._myWrite, buffer(data, sent))
+                continue
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EINTR):
+                    raise
 
-    @contextmanager
-    def _poll(self, fd, events, timeout):
-        self._poller.register(fd, events)
-        try:
-            res = misc.NoIntrPoll(self._poller.poll, timeout)
-            for fd, event in res:
+            timeLeft = deadline - time()
+            if timeLeft <= 0 or self._broken:
+                raise Timeout()
+
+            for fd, event in self._poll(self._sendPoller, timeLeft):
                 if event & (select.POLLERR | select.POLLHUP):
                     raise Timeout()
-        finally:
-            self._poller.unregister(fd)
-
-    def _recvAll(self, length, timeout):
-        startTime = time()
-        rawResponse = ""
-        while len(rawResponse) < length:
-            timeLeft = timeout - (time() - startTime)
-            if timeLeft <= 0:
-                raise Timeout()
 
-            if not self._poll(self._myRead, select.POLLIN | select.POLLPRI,
-                              timeLeft):
-                raise Timeout()
+    def _recvMessage(self, deadline):
+        """
+        Return the next (reqId, response) message, or None if the deadline
+        passed. Raises EOFError if the server closed the connection.
+
+        Every part of the message is read into its own string, so a message
+        is copied only if it was received in several chunks.
+        """
+        while True:
+            if self._header is None:
+                length = HEADER_STRUCT_LENGTH
+            else:
+                length = self._header[1]
+
+            if self._received == length:
+                data = (self._chunks[0] if len(self._chunks) == 1
+                        else "".join(self._chunks))
+                self._chunks = []
+                self._received = 0
+                if self._header is None:
+                    self._header = unpack(HEADER_STRUCT_FMT, data)
+                    continue
+                reqId = self._header[0]
+                self._header = None
+                return reqId, data
 
             try:
-                rawResponse += os.read(self._myRead, length - len(rawResponse))
+                chunk = os.read(self._myRead,
+                                min(length - self._received, READ_SIZE))
             except OSError as e:
                 if e.errno not in (errno.EAGAIN, errno.EINTR):
                     raise
 
-        return rawResponse
+                timeLeft = deadline - time()
+                if timeLeft <= 0 or self._broken:
+                    return None
 
-    def _sendAll(self, data, timeout):
-        startTime = time()
-        l = 0
-        while l < len(data):
-            timeLeft = timeout - (time() - startTime)
-            if timeLeft <= 0:
-                raise Timeout()
+                # On POLLHUP, read the remaining data until EOF
+                self._poll(self._readPoller, timeLeft)
+                continue
 
-            if not self._poll(self._myWrite, select.POLLOUT,
-                              timeLeft):
-                raise Timeout()
+            if not chunk:
+                raise EOFError("Handler closed the connection")
+
+            self._chunks.append(chunk)
+            self._received += len(chunk)
 
-            l += os.write(self._myWrite, data[l:])
+    def _readResponses(self, call, deadline):
+        """
+        Read responses until call is done or the deadline passed.
+        """
+        while not call.done:
+            try:
+                msg = self._recvMessage(deadline)
+            except Exception:
+                # If for some reason the connection drops\gets out of sync we
+                # treat it as a timeout so we only have one error path
+                self.log.error("Problem with handler, treating as timeout",
+                               exc_info=True)
+                self._break()
+                return
+
+            if msg is None:
+                return
+
+            reqId, response = msg
+            with self._lock:
+                c = self._pending.get(reqId)
+            if c is None:
+                self.log.debug("Discarding response to request %d, caller "
+                               "gave up", reqId)
+                continue
+
+            self._complete(c, response=response)
+
+    def _complete(self, call, response=None, error=None):
+        with self._lock:
+            call.response = response
+            call.error = error
+            call.done = True
+            wakeup = call.wakeup
+        if wakeup is not None:
+            wakeup.set()
+
+    def _wait(self, call, deadline):
+        while True:
+            with self._lock:
+                if call.done:
+                    return
+                reader = not self._reading
+                if reader:
+                    self._reading = True
+                else:
+                    if call.wakeup is None:
+                        call.wakeup = Event()
+                    wakeup = call.wakeup
+                    wakeup.clear()
+
+            if reader:
+                try:
+                    self._readResponses(call, deadline)
+                finally:
+                    with self._lock:
+                        self._reading = False
+                        waiting = [c.wakeup for c in self._pending.itervalues()
+                                   if c.wakeup is not None and not c.done]
+                    # Let another caller take over reading
+                    if waiting:
+                        waiting[0].set()
+            else:
+                timeLeft = deadline - time()
+                if timeLeft > 0:
+                    wakeup.wait(timeLeft)
+
+            if not call.done and time() >= deadline:
+                raise Timeout()
 
     def callCrabRPCFunction(self, timeout, name, *args, **kwargs):
+        deadline = time() + timeout
         request = pickle.dumps((name, args, kwargs))
-        self._sendAll(pack(LENGTH_STRUCT_FMT, len(request)), timeout)
-        self._sendAll(request, timeout)
+        call = _Call()
+
+        with self._lock:
+            if self._broken:
+                raise Timeout()
+            reqId = self._nextId
+            self._nextId += 1
+            self._pending[reqId] = call
+            self._maxPending = max(self._maxPending, len(self._pending))
+            self._users += 1
 
         try:
-            rawLength = self._recvAll(LENGTH_STRUCT_LENGTH, timeout)
+            try:
+                with self._sendLock:
+                    self._sendAll(pack(HEADER_STRUCT_FMT, reqId,
+                                       len(request)), deadline)
+                    self._sendAll(request, deadline)
+            except:
+                # A partly sent request breaks the stream
+                self._break()
+                raise
 
-            length = unpack(LENGTH_STRUCT_FMT, rawLength)[0]
-            rawResponse = self._recvAll(length, timeout)
+            self._wait(call, deadline)
+            if call.error is not None:
+                raise call.error
         except Timeout:
+            with self._lock:
+                self._timeouts += 1
             raise
-        except:
-            # If for some reason the connection drops\gets out of sync we treat
-            # it as a timeout so we only have one error path
-            self.log.error("Problem with handler, treating as timeout",
-                           exc_info=True)
-            raise Timeout()
-
-        res, err = pickle.loads(rawResponse)
+        finally:
+            with self._lock:
+                del self._pending[reqId]
+                self._users -= 1
+                if self._broken and self._users == 0:
+                    self._closePipes()
+
+        elapsed = time() - call.started
+        with self._lock:
+            self._calls += 1
+            self._totalLatency += elapsed
+            self._maxLatency = max(self._maxLatency, elapsed)
+
+        res, err = pickle.loads(call.response)
         if err is not None:
             raise err
 
         return res
 
+    def _break(self):
+        """
+        Mark the proxy as broken, failing all pending calls with Timeout.
+        """
+        with self._lock:
+            if self._broken:
+                return
+            self._broken = True
+            calls = self._pending.values()
+            if self._users > 0:
+                os.write(self._wakeWrite, "x")
+        for c in calls:
+            self._complete(c, error=Timeout())
+
+    def _closePipes(self):
+        # Called with self._lock held when no caller uses the pipes
+        for name in ("_myWrite", "_myRead", "_wakeWrite", "_wakeRead"):
+            fd = getattr(self, name)
+            if fd is not None:
+                os.close(fd)
+                setattr(self, name, None)
+
     def close(self):
         if not os:
             return
 
-        if self._myWrite is not None:
-            os.close(self._myWrite)
-            self._myWrite = None
-
-        if self._myRead is not None:
-            os.close(self._myRead)
-            self._myRead = None
+        self._break()
+        with self._lock:
+            if self._users == 0:
+                self._closePipes()
 
     def __del__(self):
         self.close()
@@ -251,6 +522,8 @@ class PoolHandler(object):
         except:
             pass
 
+        self.proxy.close()
+
         self.process.poll()
         # Don't try to read if the process is in D state
         if (self.process.returncode is not None and
@@ -271,12 +544,30 @@ class PoolHandler(object):
 
 
 class RemoteFileHandlerPool(object):
+    """
+    Pool of up to numOfHandlers handler processes, each running up to
+    maxRequests concurrent requests.
+
+    Calls are sent to the handler with the fewest outstanding requests; a new
+    handler is started when all handlers are busy. A handler with a request
+    waiting longer than slowThreshold seconds is not sent more requests.
+
+    A handler that timed out is probably stuck on inaccessible storage. It is
+    retired, making room for a new handler, and stopped when its other
+    requests complete or time out, so they do not fail because of the
+    request that timed out.
+    """
     log = logging.getLogger("Storage.RemoteFileHandler")
 
-    def __init__(self, numOfHandlers):
+    def __init__(self, numOfHandlers, maxRequests=MAX_REQUESTS_PER_HANDLER,
+                 slowThreshold=SLOW_REQUEST_THRESHOLD):
         self._numOfHandlers = numOfHandlers
+        self._maxRequests = maxRequests
+        self._slowThreshold = slowThreshold
+        self._lock = Lock()
+        self._inflight = {}
+        self._retired = set()
         self.handlers = [None] * numOfHandlers
-        self.occupied = [Lock() for i in xrange(numOfHandlers)]
 
     def _isHandlerAvailable(self, poolHandler):
         if poolHandler is None:
@@ -284,36 +575,92 @@ class RemoteFileHandlerPool(object):
 
         return True
 
-    def callCrabRPCFunction(self, timeout, name, *args, **kwargs):
-        for i, isOccupied in enumerate(self.occupied):
-            if not isOccupied.acquire(False):
-                continue
-
-            try:
-                handler = self.handlers[i]
-                if not self._isHandlerAvailable(handler):
-                    handler = self.handlers[i] = PoolHandler()
+    def _acquireHandler(self):
+        with self._lock:
+            handler = None
+            handlers = [h for h in self.handlers
+                        if self._isHandlerAvailable(h) and
+                        h.proxy.pendingAge() < self._slowThreshold]
+            if handlers:
+                handler = min(handlers, key=self._inflight.get)
 
-                return handler.proxy.callCrabRPCFunction(timeout, name,
-                                                         *args, **kwargs)
-            except Timeout:
+            if handler is None or self._inflight[handler] > 0:
                 try:
-                    self.handlers[i] = None
-                    handler.stop()
-                except:
-                    self.log.error("Could not signal stuck handler (PID:%d)",
-                                   handler.process.pid, exc_info=True)
-
-                self.handlers[i] = None
-                raise
+                    i = self.handlers.index(None)
+                except ValueError:
+                    pass
+                else:
+                    handler = self.handlers[i] = PoolHandler()
+                    self._inflight[handler] = 0
+
+            if handler is None or self._inflight[handler] >= self._maxRequests:
+                raise Exception("No free file handlers in pool")
+
+            self._inflight[handler] += 1
+            return handler
+
+    def _releaseHandler(self, handler):
+        """
+        Return True if handler was retired and this was its last request.
+        """
+        with self._lock:
+            self._inflight[handler] -= 1
+            if handler in self._retired and self._inflight[handler] == 0:
+                self._retired.remove(handler)
+                del self._inflight[handler]
+                return True
+            return False
 
-            finally:
-                isOccupied.release()
+    def _retireHandler(self, handler):
+        with self._lock:
+            try:
+                i = self.handlers.index(handler)
+            except ValueError:
+                return False
+            self.handlers[i] = None
+            self._retired.add(handler)
+            return True
+
+    def _stopHandler(self, handler):
+        self.log.warning("Stopping stuck handler (PID: %d) %s",
+                         handler.process.pid, handler.proxy.stats())
+        try:
+            handler.stop()
+        except:
+            self.log.error("Could not signal stuck handler (PID:%d)",
+                           handler.process.pid, exc_info=True)
 
-        raise Exception("No free file handlers in pool")
+    def callCrabRPCFunction(self, timeout, name, *args, **kwargs):
+        handler = self._acquireHandler()
+        try:
+            return handler.proxy.callCrabRPCFunction(timeout, name,
+                                                     *args, **kwargs)
+        except Timeout:
+            if self._retireHandler(handler):
+                self.log.warning("Retiring stuck handler (PID: %d)",
+                                 handler.process.pid)
+            raise
+        finally:
+            if self._releaseHandler(handler):
+                self._stopHandler(handler)
+
+    def stats(self):
+        """
+        Return a list of the statistics of the running handlers (see
+        CrabRPCProxy.stats).
+        """
+        with self._lock:
+            handlers = [h for h in self.handlers
+                        if self._isHandlerAvailable(h)]
+        res = []
+        for handler in handlers:
+            stats = handler.proxy.stats()
+            stats["pid"] = handler.process.pid
+            res.append(stats)
+        return res
 
     def close(self):
-        for handler in self.handlers:
+        for handler in self.handlers + list(self._retired):
             if not self._isHandlerAvailable(handler):
                 continue
 
@@ -333,6 +680,58 @@ def simpleWalk(top, topdown=True, onerror=None, followlinks=False):
     return filesList
 
 
+def statMany(paths):
+    """
+    Return a list with the stat of every path, or None if the path does not
+    exist.
+    """
+    res = []
+    for path in paths:
+        try:
+            res.append(os.stat(path))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            res.append(None)
+    return res
+
+
+def readLinesMany(paths, direct=False):
+    """
+    Return a list with the lines of every file, or None if the file does not
+    exist. If direct is True, the files are read using direct I/O.
+    """
+    read = directReadLines if direct else readLines
+    res = []
+    for path in paths:
+        try:
+            res.append(read(path))
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            res.append(None)
+    return res
+
+
+def globStat(pattern):
+    """
+    Return a list of (path, stat) tuples for the paths matching pattern.
+    """
+    paths = glob.glob(pattern)
+    return [(path, st) for path, st in zip(paths, statMany(paths))
+            if st is not None]
+
+
+def walkStat(top):
+    """
+    Return a list of (path, stat) tuples for the files under top, like
+    simpleWalk.
+    """
+    paths = simpleWalk(top)
+    return [(path, st) for path, st in zip(paths, statMany(paths))
+            if st is not None]
+
+
 def directReadLines(path):
     with fileUtils.open_ex(path, "dr") as f:
         return f.readlines()
@@ -373,6 +772,22 @@ def writeLines(path, lines):
         return f.writelines(lines)
 
 
+def appendLines(path, lines):
+    """
+    Append lines to path, creating it if needed, and wait until the lines
+    are on storage.
+    """
+    data = "".join(lines)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def echo(data):
     """Echo data, used for testing"""
     return data
@@ -421,7 +836,8 @@ if __name__ == "__main__":
         try:
             server = CrabRPCServer(myRead, myWrite)
             for func in (writeLines, readLines, truncateFile, echo, sleep,
-                         directReadLines, simpleWalk, directTouch):
+                         directReadLines, simpleWalk, directTouch, statMany,
+                         readLinesMany, globStat, walkStat, appendLines):
 
                 server.registerFunction(func)
 
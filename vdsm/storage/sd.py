@@ -405,6 +405,30 @@ class StorageDomain(object):
         """
         pass
 
+    def getVolumesInfo(self, imgUUID=None):
+        """
+        Return dict {volUUID: info} of the volumes of the image imgUUID, or of
+        all the volumes of the domain if imgUUID is None, where info is the
+        volume info returned by Volume.getInfo().
+        """
+        volImgs = {}
+        for volUUID, (imgUUIDs, parent) in self.getAllVolumes().iteritems():
+            if imgUUID is None:
+                # The first image of a template volume is its own image
+                volImgs[volUUID] = imgUUIDs[0]
+            elif imgUUID in imgUUIDs:
+                volImgs[volUUID] = imgUUID
+        return self._getVolumesInfo(volImgs)
+
+    def _getVolumesInfo(self, volImgs):
+        """
+        Return dict {volUUID: info} of the volumes in dict volImgs
+        {volUUID: imgUUID}. Domains override this to read the metadata of
+        all the volumes at once.
+        """
+        return dict((volUUID, self.produceVolume(imgUUID, volUUID).getInfo())
+                    for volUUID, imgUUID in volImgs.iteritems())
+
     def validateCreateVolumeParams(self, volFormat, srcVolUUID,
                                    preallocate=None):
         """
@@ -23,7 +23,9 @@ Cache module provides general purpose (more or less) cache infrastructure
 for keeping storage related data that is expensive to harvest, but needed often
 """
 import logging
+import Queue
 import threading
+from vdsm import utils
 from vdsm.config import config
 
 import multipath
@@ -71,10 +73,18 @@ class StorageDomainCache:
         self.__staleStatus = self.STORAGE_STALE
         self.storage_repo = storage_repo
         self.knownSDs = {}  # {sdUUID: mod.findDomain}
+        # Where unfetched domains were found, kept when storage is
+        # invalidated, since domains rarely move to another backend.
+        self._hints = {}  # {sdUUID: mod.findDomain}
+        # Domains not found by any backend {sdUUID: expiry time}
+        self._missing = {}
+        self._missingTTL = config.getint('irs', 'sd_missing_cache_ttl')
 
     def invalidateStorage(self):
         with self._syncroot:
             self.__staleStatus = self.STORAGE_STALE
+            # New storage may make missing domains visible
+            self._missing.clear()
 
     @misc.samplingmethod
     def refreshStorage(self):
@@ -146,30 +156,94 @@ class StorageDomainCache:
             return dom
 
     def _findUnfetchedDomain(self, sdUUID):
-        import blockSD
-        import glusterSD
-        import localFsSD
-        import nfsSD
-
         self.log.error("looking for domain %s", sdUUID)
 
-        # The order is somewhat important, it's ordered
-        # by how quickly get can find the domain. For instance
-        # if an nfs mount is unavailable we will get stuck
-        # until it times out, this should affect fetching
-        # of block\local domains. If for any case in the future
-        # this changes, please update the order.
-        for mod in (blockSD, glusterSD, localFsSD, nfsSD):
+        with self._syncroot:
+            findMethod = self._hints.get(sdUUID)
+
+        if findMethod is not None:
             try:
-                return mod.findDomain(sdUUID)
+                return findMethod(sdUUID)
             except se.StorageDomainDoesNotExist:
-                pass
+                self.log.info("domain %s not found in %s, looking in all "
+                              "backends", sdUUID, findMethod.__module__)
+                with self._syncroot:
+                    self._hints.pop(sdUUID, None)
+            except Exception:
+                self.log.error("Error while looking for domain %s in %s, "
+                               "looking in all backends", sdUUID,
+                               findMethod.__module__, exc_info=True)
+                with self._syncroot:
+                    self._hints.pop(sdUUID, None)
+
+        if self._isMissing(sdUUID):
+            self.log.debug("domain %s was recently missing", sdUUID)
+            raise se.StorageDomainDoesNotExist(sdUUID)
+
+        return self._findInAllBackends(sdUUID)
+
+    def _findInAllBackends(self, sdUUID):
+        """
+        Look for the domain in all backends concurrently, so a backend
+        blocked on inaccessible storage (e.g. a hung nfs mount) does not
+        delay finding the domain in other backends. Returns the first
+        domain found.
+        """
+        modules = self._backends()
+        results = Queue.Queue()
+
+        def find(mod):
+            try:
+                results.put((mod, mod.findDomain(sdUUID), False))
+            except se.StorageDomainDoesNotExist:
+                results.put((mod, None, False))
             except Exception:
                 self.log.error("Error while looking for domain `%s`", sdUUID,
                                exc_info=True)
+                results.put((mod, None, True))
+
+        for mod in modules:
+            t = threading.Thread(target=find, args=(mod,),
+                                 name="sdc.find-%s" % mod.__name__)
+            t.daemon = True
+            t.start()
+
+        failed = False
+        for _ in modules:
+            mod, domain, error = results.get()
+            if domain is not None:
+                with self._syncroot:
+                    self._hints[sdUUID] = mod.findDomain
+                return domain
+            failed |= error
 
+        # If a backend failed the domain may exist there; look again next
+        # time.
+        if not failed:
+            self._setMissing(sdUUID)
         raise se.StorageDomainDoesNotExist(sdUUID)
 
+    def _backends(self):
+        import blockSD
+        import glusterSD
+        import localFsSD
+        import nfsSD
+        return (blockSD, glusterSD, localFsSD, nfsSD)
+
+    def _isMissing(self, sdUUID):
+        with self._syncroot:
+            expires = self._missing.get(sdUUID)
+            if expires is None:
+                return False
+            if utils.monotonic_time() < expires:
+                return True
+            del self._missing[sdUUID]
+            return False
+
+    def _setMissing(self, sdUUID):
+        with self._syncroot:
+            self._missing[sdUUID] = utils.monotonic_time() + self._missingTTL
+
     def getUUIDs(self):
         import blockSD
         import fileSD
@@ -184,10 +258,12 @@ class StorageDomainCache:
         with self._syncroot:
             lvm.invalidateCache()
             self.__domainCache.clear()
+            self._missing.clear()
 
     def manuallyAddDomain(self, domain):
         with self._syncroot:
             self.__domainCache[domain.sdUUID] = domain
+            self._missing.pop(domain.sdUUID, None)
 
     def manuallyRemoveDomain(self, sdUUID):
         with self._syncroot:
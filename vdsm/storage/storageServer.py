@@ -17,6 +17,7 @@
 #
 # Refer to the README and COPYING files for full details of the license
 #
+import Queue
 import errno
 import logging
 from os.path import normpath, basename, splitext
@@ -32,6 +33,7 @@ import sys
 
 from vdsm.compat import pickle
 from vdsm.config import config
+from vdsm import concurrent
 from vdsm import udevadm
 
 import mount
@@ -662,6 +664,71 @@ class ConnectionFactory(object):
         return ctor(**params)
 
 
+def groupConnections(connections):
+    """
+    Group the connections that should be connected one after another, and
+    return the groups as lists of indexes into connections.
+
+    iSCSI logins are serialized by iscsiadm, so logins using the same
+    interface are grouped in one group instead of blocking several workers
+    waiting for iscsiadm. Other connections are independent.
+    """
+    groups = []
+    ifaces = {}
+    for i, con in enumerate(connections):
+        if isinstance(con, IscsiConnection):
+            if con.iface.name not in ifaces:
+                ifaces[con.iface.name] = []
+                groups.append(ifaces[con.iface.name])
+            ifaces[con.iface.name].append(i)
+        else:
+            groups.append([i])
+    return groups
+
+
+def connectAll(jobs, workers):
+    """
+    Run connect jobs, a list of (connection, func) tuples, calling func()
+    to connect the connection. Up to workers groups of connections (see
+    groupConnections) are connected concurrently.
+
+    Every connection keeps its own timeouts (e.g. NFS timeo and retrans,
+    iSCSI login timeout); we wait until all jobs have returned.
+
+    Returns a list of concurrent.Result, in the order of jobs.
+    """
+    connections = [con for con, func in jobs]
+    results = [None] * len(jobs)
+    groups = Queue.Queue()
+    for group in groupConnections(connections):
+        groups.put(group)
+
+    def worker():
+        while True:
+            try:
+                group = groups.get_nowait()
+            except Queue.Empty:
+                return
+            for i in group:
+                func = jobs[i][1]
+                try:
+                    results[i] = concurrent.Result(True, func())
+                except Exception as e:
+                    results[i] = concurrent.Result(False, e)
+
+    threads = []
+    for i in range(min(max(workers, 1), groups.qsize())):
+        t = Thread(target=worker, name="connect/%d" % i)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+
+    return results
+
+
 class ConnectionMonitor(object):
     _log = logging.getLogger("Storage.ConnectionMonitor")
 
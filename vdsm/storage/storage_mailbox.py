@@ -31,6 +31,7 @@ import uuid
 from vdsm.config import config
 import sd
 import misc
+import fileUtils
 import task
 from threadPool import ThreadPool
 from storage_exception import InvalidParameterException
@@ -84,6 +85,172 @@ def _mboxExecCmd(*args, **kwargs):
     return misc.execCmd(*args, **kwargs)
 
 
+class DDMailboxFile(object):
+    """
+    Read and write mailboxes in a mailbox file by running dd.
+
+    Offsets and sizes must be multiples of MAILBOX_SIZE.
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    def read(self, offset, size):
+        cmd = [constants.EXT_DD,
+               'if=' + str(self._path),
+               'iflag=direct,fullblock',
+               'bs=' + str(MAILBOX_SIZE),
+               'count=' + str(size / MAILBOX_SIZE),
+               'skip=' + str(offset / MAILBOX_SIZE)]
+        (rc, out, err) = _mboxExecCmd(cmd, raw=True)
+        if rc:
+            raise IOError(errno.EIO, "Could not read mailbox %s: dd failed "
+                          "rc=%s" % (self._path, rc))
+        return out
+
+    def write(self, offset, data):
+        cmd = [constants.EXT_DD,
+               'of=' + str(self._path),
+               'iflag=fullblock',
+               'oflag=direct',
+               'conv=notrunc',
+               'bs=' + str(MAILBOX_SIZE),
+               'seek=' + str(offset / MAILBOX_SIZE)]
+        (rc, out, err) = _mboxExecCmd(cmd, data=data)
+        if rc:
+            raise IOError(errno.EIO, "Could not write mailbox %s: dd failed "
+                          "rc=%s" % (self._path, rc))
+
+    def close(self):
+        pass
+
+
+class DirectMailboxFile(object):
+    """
+    Read and write mailboxes in a mailbox file using direct I/O on a
+    persistent file descriptor.
+
+    The file is reopened after an I/O error, since the underlying device may
+    have been replaced (e.g. the LV was deactivated and activated again).
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def read(self, offset, size):
+        with self._lock:
+            return self._io(lambda f: f.pread(size, offset))
+
+    def write(self, offset, data):
+        with self._lock:
+            self._io(lambda f: f.pwrite(data, offset))
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _io(self, func):
+        if self._file is None:
+            self._file = fileUtils.DirectFile(self._path, "r+d")
+        try:
+            return func(self._file)
+        except OSError:
+            self._close()
+            raise
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def openMailboxFile(path):
+    if config.getboolean('irs', 'mailbox_direct_io'):
+        return DirectMailboxFile(path)
+    return DDMailboxFile(path)
+
+
+def _dirtyRuns(mailboxes):
+    """
+    Group dirty mailbox indexes into runs of adjacent mailboxes, returning a
+    list of (first, count) tuples.
+    """
+    runs = []
+    for index in sorted(mailboxes):
+        if runs and runs[-1][0] + runs[-1][1] == index:
+            runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+        else:
+            runs.append((index, 1))
+    return runs
+
+
+class PollInterval(object):
+    """
+    Mailbox polling interval, starting at the maximum interval. After
+    activity the interval drops to the minimum, and it is doubled on every
+    idle poll, up to the maximum.
+    """
+
+    def __init__(self, minimum, maximum):
+        self._minimum = min(minimum, maximum)
+        self._maximum = maximum
+        self._current = maximum
+
+    def reset(self):
+        self._current = self._minimum
+
+    def next(self):
+        interval = self._current
+        self._current = min(self._current * 2, self._maximum)
+        return interval
+
+
+class LatencyStats(object):
+    """
+    Per host request counters and request to reply latency.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def requested(self, host):
+        with self._lock:
+            self._host(host)["requests"] += 1
+
+    def replied(self, host, elapsed):
+        with self._lock:
+            stats = self._host(host)
+            stats["replies"] += 1
+            stats["totalLatency"] += elapsed
+            stats["maxLatency"] = max(stats["maxLatency"], elapsed)
+            stats["lastLatency"] = elapsed
+
+    def info(self):
+        with self._lock:
+            res = {}
+            for host, stats in self._hosts.iteritems():
+                replies = stats["replies"]
+                res[host] = {
+                    "requests": stats["requests"],
+                    "replies": replies,
+                    "avgLatency": (stats["totalLatency"] / replies
+                                   if replies else 0.0),
+                    "maxLatency": stats["maxLatency"],
+                    "lastLatency": stats["lastLatency"],
+                }
+            return res
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = {"requests": 0, "replies": 0,
+                                 "totalLatency": 0.0, "maxLatency": 0.0,
+                                 "lastLatency": 0.0}
+        return self._hosts[host]
+
+
 class SPM_Extend_Message:
 
     log = logging.getLogger('Storage.SPM.Messages.Extend')
@@ -125,6 +292,12 @@ class SPM_Extend_Message:
     def __getitem__(self, index):
         return self.payload[index]
 
+    def volumeKey(self):
+        return (self.volumeData['domainID'], self.volumeData['volumeID'])
+
+    def size(self):
+        return int(self.newSize, 16)
+
     def checkReply(self, reply):
         # Sanity check - Make sure reply is for current message
         sizeOffset = 5 + 2 * PACKED_UUID_SIZE
@@ -211,6 +384,14 @@ class HSM_Mailbox:
         if str(msg.pool) != self._poolID:
             raise ValueError('PoolID does not correspond to Mailbox pool')
         self._queue.put(msg)
+        self._mailman.wakeup()
+
+    def getStats(self):
+        """
+        Return the request counter and request to reply latency of this
+        host.
+        """
+        return self._mailman.getStats()
 
     def stop(self):
         if self._mailman:
@@ -244,25 +425,22 @@ class HSM_MailMonitor(threading.Thread):
         self._monitorInterval = monitorInterval
         self._hostID = int(hostID)
         self._used_slots_array = [0] * MESSAGES_PER_MAILBOX
+        # Messages coalesced into an active message, by slot
+        self._waiters = {}
+        # Slots modified since the outgoing mail was written
+        self._unsent = set()
+        self._requestTimes = {}
+        self._stats = LatencyStats()
+        self._pollInterval = PollInterval(
+            config.getfloat('irs', 'mailbox_min_interval'), monitorInterval)
+        self._wakeupEvent = threading.Event()
         self._outgoingMail = EMPTYMAILBOX
         self._incomingMail = EMPTYMAILBOX
         # TODO: add support for multiple paths (multiple mailboxes)
         self._spmStorageDir = config.get('irs', 'repository')
-        self._inCmd = [constants.EXT_DD,
-                       'if=' + str(inbox),
-                       'iflag=direct,fullblock',
-                       'bs=' + str(BLOCK_SIZE),
-                       'count=' + str(BLOCKS_PER_MAILBOX),
-                       'skip=' + str(self._hostID * BLOCKS_PER_MAILBOX)
-                       ]
-        self._outCmd = [constants.EXT_DD,
-                        'of=' + str(outbox),
-                        'iflag=fullblock',
-                        'oflag=direct',
-                        'conv=notrunc',
-                        'bs=' + str(BLOCK_SIZE),
-                        'seek=' + str(self._hostID * BLOCKS_PER_MAILBOX)
-                        ]
+        self._mailboxOffset = self._hostID * MAILBOX_SIZE
+        self._inFile = openMailboxFile(inbox)
+        self._outFile = openMailboxFile(outbox)
         self._init = False
         self._initMailbox()  # Read initial mailbox state
         self._msgCounter = 0
@@ -274,20 +452,35 @@ class HSM_MailMonitor(threading.Thread):
 
     def _initMailbox(self):
         # Sync initial incoming mail state with storage view
-        (rc, out, err) = _mboxExecCmd(self._inCmd, raw=True)
-        if rc == 0:
-            self._incomingMail = out
+        try:
+            self._incomingMail = self._inFile.read(self._mailboxOffset,
+                                                   MAILBOX_SIZE)
             self._init = True
-        else:
+        except EnvironmentError as e:
             self.log.warning("HSM_MailboxMonitor - Could not initialize "
                              "mailbox, will not accept requests until init "
-                             "succeeds")
+                             "succeeds: %s", e)
 
     def immStop(self):
         self._stop = True
+        self.wakeup()
 
     def immFlush(self):
         self._flush = True
+        self.wakeup()
+
+    def wakeup(self):
+        """
+        Wake up the monitor waiting for replies, to send new messages.
+        """
+        self._wakeupEvent.set()
+
+    def getStats(self):
+        return self._stats.info().get(self._hostID, {})
+
+    def _wait(self, timeout):
+        self._wakeupEvent.wait(timeout)
+        self._wakeupEvent.clear()
 
     def _handleResponses(self, newMsgs):
         rc = False
@@ -336,24 +529,19 @@ class HSM_MailMonitor(threading.Thread):
             self._activeMessages[i] = CLEAN_MESSAGE
             self._outgoingMail = self._outgoingMail[0:start] + \
                 CLEAN_MESSAGE + self._outgoingMail[start + MESSAGE_SIZE:]
+            waiters = self._waiters.pop(i, [])
+            requestTime = self._requestTimes.pop(i, None)
+            if requestTime is not None:
+                self._stats.replied(self._hostID,
+                                    utils.monotonic_time() - requestTime)
 
             try:
                 self.log.debug("HSM_MailboxMonitor(%s/%s) - Checking reply: "
                                "%s", self._msgCounter, MESSAGES_PER_MAILBOX,
                                repr(newMsg))
                 msg.checkReply(newMsg)
-                if msg.callback:
-                    try:
-                        id = str(uuid.uuid4())
-                        if not self.tp.queueTask(id, runTask, (msg.callback,
-                                                 msg.volumeData)):
-                            raise Exception()
-                    except:
-                        self.log.error("HSM_MailMonitor: exception caught "
-                                       "while running msg callback, for "
-                                       "message: %s, callback function: %s",
-                                       repr(msg.payload), msg.callback,
-                                       exc_info=True)
+                for m in [msg] + waiters:
+                    self._runCallback(m)
             except RuntimeError as e:
                 self.log.error("HSM_MailMonitor: exception: %s caught while "
                                "checking reply for message: %s, reply: %s",
@@ -368,13 +556,28 @@ class HSM_MailMonitor(threading.Thread):
         self._incomingMail = newMsgs
         return rc
 
+    def _runCallback(self, msg):
+        if not msg.callback:
+            return
+        try:
+            id = str(uuid.uuid4())
+            if not self.tp.queueTask(id, runTask, (msg.callback,
+                                     msg.volumeData)):
+                raise Exception()
+        except:
+            self.log.error("HSM_MailMonitor: exception caught "
+                           "while running msg callback, for "
+                           "message: %s, callback function: %s",
+                           repr(msg.payload), msg.callback,
+                           exc_info=True)
+
     def _checkForMail(self):
         # self.log.debug("HSM_MailMonitor - checking for mail")
-        # self.log.debug("Running command: " + str(self._inCmd))
-        (rc, in_mail, err) = misc.execCmd(self._inCmd, raw=True)
-        if rc:
-            raise RuntimeError("_handleResponses.Could not read mailbox - rc "
-                               "%s" % rc)
+        try:
+            in_mail = self._inFile.read(self._mailboxOffset, MAILBOX_SIZE)
+        except EnvironmentError as e:
+            raise RuntimeError("_handleResponses.Could not read mailbox - %s"
+                               % e)
         if (len(in_mail) != MAILBOX_SIZE):
             raise RuntimeError("_handleResponses.Could not read mailbox - len "
                                "%s != %s" % (len(in_mail), MAILBOX_SIZE))
@@ -382,18 +585,59 @@ class HSM_MailMonitor(threading.Thread):
         return self._handleResponses(in_mail)
 
     def _sendMail(self):
-        self.log.info("HSM_MailMonitor sending mail to SPM - " +
-                      str(self._outCmd))
+        self.log.info("HSM_MailMonitor sending mail to SPM - mailbox %s",
+                      self._hostID)
         chk = misc.checksum(
             self._outgoingMail[0:MAILBOX_SIZE - CHECKSUM_BYTES],
             CHECKSUM_BYTES)
         pChk = struct.pack('<l', chk)  # Assumes CHECKSUM_BYTES equals 4!!!
         self._outgoingMail = \
             self._outgoingMail[0:MAILBOX_SIZE - CHECKSUM_BYTES] + pChk
-        _mboxExecCmd(self._outCmd, data=self._outgoingMail)
+        try:
+            self._outFile.write(self._mailboxOffset, self._outgoingMail)
+        except EnvironmentError as e:
+            self.log.error("HSM_MailMonitor - Could not send mail: %s", e)
+        else:
+            self._unsent.clear()
+
+    def _coalesce(self, message):
+        """
+        Merge an extend message with an active message for the same volume.
+        If the active message requests at least the same size, the new
+        message waits for its reply. If the active message requests a
+        smaller size and was not sent yet, the new message replaces it.
+
+        Returns True if the message was merged.
+        """
+        key = message.volumeKey()
+        for i, active in self._activeMessages.items():
+            if (not isinstance(active, SPM_Extend_Message) or
+                    active.volumeKey() != key):
+                continue
+            if active.size() >= message.size():
+                self.log.debug("HSM_MailMonitor - message %r waits for "
+                               "active message in slot %s", message.payload,
+                               i)
+                self._waiters.setdefault(i, []).append(message)
+                return True
+            if i in self._unsent:
+                self.log.debug("HSM_MailMonitor - message %r replaces unsent "
+                               "message in slot %s", message.payload, i)
+                self._activeMessages[i] = message
+                self._waiters.setdefault(i, []).append(active)
+                start = i * MESSAGE_SIZE
+                self._outgoingMail = self._outgoingMail[0:start] + \
+                    message.payload + \
+                    self._outgoingMail[start + MESSAGE_SIZE:]
+                return True
+        return False
 
     def _handleMessage(self, message):
         # TODO: add support for multiple mailboxes
+        self._stats.requested(self._hostID)
+        if self._coalesce(message):
+            return
+
         freeSlot = False
         for i in range(0, MESSAGES_PER_MAILBOX):
             if self._used_slots_array[i] == 0:
@@ -416,6 +660,8 @@ class HSM_MailMonitor(threading.Thread):
         self._msgCounter += 1
         self._used_slots_array[freeSlot] = 1
         self._activeMessages[freeSlot] = message
+        self._unsent.add(freeSlot)
+        self._requestTimes[freeSlot] = utils.monotonic_time()
         start = freeSlot * MESSAGE_SIZE
         end = start + MESSAGE_SIZE
         self._outgoingMail = self._outgoingMail[0:start] + message.payload + \
@@ -493,16 +739,19 @@ class HSM_MailMonitor(threading.Thread):
 
                     if sendMail:
                         self._sendMail()
+                        # Poll quickly while the SPM is handling our requests
+                        self._pollInterval.reset()
 
                     # If there are active messages waiting for SPM reply, wait
-                    # a few seconds before performing another IO op
+                    # before performing another IO op, unless new messages
+                    # arrive.
                     if self._activeMessages and not self._stop:
                         # If recurring failures then sleep for one minute
                         # before retrying
                         if (failures > 9):
-                            time.sleep(60)
+                            self._wait(60)
                         else:
-                            time.sleep(self._monitorInterval)
+                            self._wait(self._pollInterval.next())
 
                 except:
                     self.log.error("HSM_MailboxMonitor - Incoming mail"
@@ -513,6 +762,8 @@ class HSM_MailMonitor(threading.Thread):
                           "thread stopped, clearing outgoing mail")
             self._outgoingMail = EMPTYMAILBOX
             self._sendMail()  # Clear outgoing mailbox
+            self._inFile.close()
+            self._outFile.close()
 
 
 class SPM_MailMonitor:
@@ -558,28 +809,26 @@ class SPM_MailMonitor:
         # TODO: add support for multiple paths (multiple mailboxes)
         self._outgoingMail = self._outMailLen * "\0"
         self._incomingMail = self._outgoingMail
-        self._inCmd = ['dd',
-                       'if=' + str(self._inbox),
-                       'iflag=direct,fullblock',
-                       'count=1'
-                       ]
-        self._outCmd = ['dd',
-                        'of=' + str(self._outbox),
-                        'oflag=direct',
-                        'iflag=fullblock',
-                        'conv=notrunc',
-                        'count=1'
-                        ]
+        self._inFile = openMailboxFile(self._inbox)
+        self._outFile = openMailboxFile(self._outbox)
+        # Outgoing mailboxes modified since the last write
+        self._dirtyMailboxes = set()
         self._outLock = threading.Lock()
         self._inLock = threading.Lock()
+        self._pollInterval = PollInterval(
+            config.getfloat('irs', 'mailbox_min_interval'), monitorInterval)
+        self._wakeupEvent = threading.Event()
+        self._stats = LatencyStats()
+        # Requests being processed and waiting for a reply, by message id
+        self._requestsLock = threading.Lock()
+        self._requestTimes = {}
         # Clear outgoing mail
-        self.log.debug("SPM_MailMonitor - clearing outgoing mail, command is: "
-                       "%s", self._outCmd)
-        cmd = self._outCmd + ['bs=' + str(self._outMailLen)]
-        (rc, out, err) = _mboxExecCmd(cmd, data=self._outgoingMail)
-        if rc:
-            self.log.warning("SPM_MailMonitor couldn't clear outgoing mail, "
-                             "dd failed")
+        self.log.debug("SPM_MailMonitor - clearing outgoing mail")
+        try:
+            self._outFile.write(0, self._outgoingMail)
+        except EnvironmentError as e:
+            self.log.warning("SPM_MailMonitor couldn't clear outgoing mail: "
+                             "%s", e)
 
         t = threading.Thread(target=self.run)
         t.daemon = True
@@ -589,10 +838,17 @@ class SPM_MailMonitor:
 
     def stop(self):
         self._stop = True
+        self._wakeupEvent.set()
 
     def isStopped(self):
         return self._stopped
 
+    def getStats(self):
+        """
+        Return per host request counters and request to reply latency.
+        """
+        return self._stats.info()
+
     def getMaxHostID(self):
         return self._numHosts
 
@@ -608,6 +864,8 @@ class SPM_MailMonitor:
                     delta = MAILBOX_SIZE * diff
                     self._outgoingMail = self._outgoingMail[:-delta]
                     self._incomingMail = self._incomingMail[:-delta]
+                    self._dirtyMailboxes.difference_update(
+                        range(newMaxId, self._numHosts))
                 self._numHosts = newMaxId
                 self._outMailLen = MAILBOX_SIZE * self._numHosts
 
@@ -627,6 +885,9 @@ class SPM_MailMonitor:
     def _handleRequests(self, newMail):
 
         send = False
+        # Requests rewritten by the host while the previous request in the
+        # same slot is still processed, handled on the next poll.
+        deferred = []
 
         # run through all messages and check if new messages have arrived
         # (since last read)
@@ -673,6 +934,7 @@ class SPM_MailMonitor:
                             self._outgoingMail[0:msgOffset] + CLEAN_MESSAGE + \
                             self._outgoingMail[msgOffset + MESSAGE_SIZE:
                                                self._outMailLen]
+                        self._dirtyMailboxes.add(host)
                     finally:
                         self._outLock.release()
                     send = True
@@ -691,23 +953,32 @@ class SPM_MailMonitor:
                     continue
 
                 # We only get here if there is a novel request
+                if not self._startRequest(msgId):
+                    self.log.debug("SPM_MailMonitor: request %s is still "
+                                   "processed, deferring new request", msgId)
+                    deferred.append(msgStart)
+                    continue
+
                 try:
                     msgType = newMail[msgStart + 1:msgStart + 5]
                     if msgType in self._messageTypes:
                         # Use message class to process request according to
-                        # message specific logic
+                        # message specific logic. Requests in different slots
+                        # are processed in parallel by the thread pool.
                         id = str(uuid.uuid4())
                         self.log.debug("SPM_MailMonitor: processing request: "
                                        "%s" % repr(newMail[
                                            msgStart:msgStart + MESSAGE_SIZE]))
                         res = self.tp.queueTask(
-                            id, runTask, (self._messageTypes[msgType], msgId,
-                                          newMail[msgStart:
-                                                  msgStart + MESSAGE_SIZE])
+                            id, self._processRequest,
+                            (self._messageTypes[msgType], msgId,
+                             newMail[msgStart:msgStart + MESSAGE_SIZE])
                         )
                         if not res:
+                            self._endRequest(msgId)
                             raise Exception()
                     else:
+                        self._endRequest(msgId)
                         self.log.error("SPM_MailMonitor: unknown message type "
                                        "encountered: %s", msgType)
                 except RuntimeError as e:
@@ -720,44 +991,89 @@ class SPM_MailMonitor:
                                    newMail[msgStart:msgStart + MESSAGE_SIZE],
                                    exc_info=True)
 
+        for msgStart in deferred:
+            newMail = newMail[:msgStart] + \
+                self._incomingMail[msgStart:msgStart + MESSAGE_SIZE] + \
+                newMail[msgStart + MESSAGE_SIZE:]
         self._incomingMail = newMail
         return send
 
+    def _startRequest(self, msgId):
+        with self._requestsLock:
+            if msgId in self._requestTimes:
+                return False
+            self._requestTimes[msgId] = utils.monotonic_time()
+        self._stats.requested(msgId / SLOTS_PER_MAILBOX)
+        return True
+
+    def _endRequest(self, msgId):
+        with self._requestsLock:
+            requestTime = self._requestTimes.pop(msgId, None)
+        if requestTime is not None:
+            self._stats.replied(msgId / SLOTS_PER_MAILBOX,
+                                utils.monotonic_time() - requestTime)
+
+    def _hasPendingRequests(self):
+        with self._requestsLock:
+            return len(self._requestTimes) > 0
+
+    def _processRequest(self, args):
+        callback, msgId, payload = args
+        try:
+            runTask((callback, msgId, payload))
+        finally:
+            # Normally the request ended when sending the reply
+            self._endRequest(msgId)
+
     def _checkForMail(self):
         # Lock is acquired in order to make sure that neither _numHosts nor
         # incomingMail are changed during checkForMail
         self._inLock.acquire()
         try:
             # self.log.debug("SPM_MailMonitor -_checking for mail")
-            cmd = self._inCmd + ['bs=' + str(self._outMailLen)]
-            # self.log.debug("SPM_MailMonitor - reading incoming mail, "
-            #               "command: " + str(cmd))
-            (rc, in_mail, err) = misc.execCmd(cmd, raw=True)
-            if rc:
+            try:
+                in_mail = self._inFile.read(0, self._outMailLen)
+            except EnvironmentError as e:
                 raise IOError(errno.EIO, "_handleRequests._checkForMail - "
-                              "Could not read mailbox: %s" % self._inbox)
+                              "Could not read mailbox: %s: %s" %
+                              (self._inbox, e))
 
             if (len(in_mail) != (self._outMailLen)):
-                self.log.error('SPM_MailMonitor: _checkForMail - dd succeeded '
-                               'but read %d bytes instead of %d, cannot check '
-                               'mail.  Read mail contains: %s', len(in_mail),
-                               self._outMailLen, repr(in_mail[:80]))
+                self.log.error('SPM_MailMonitor: _checkForMail - read '
+                               'succeeded but read %d bytes instead of %d, '
+                               'cannot check mail.  Read mail contains: %s',
+                               len(in_mail), self._outMailLen,
+                               repr(in_mail[:80]))
                 raise RuntimeError("_handleRequests._checkForMail - Could not "
                                    "read mailbox")
             # self.log.debug("Parsing inbox content: %s", in_mail)
-            if self._handleRequests(in_mail):
+            send = self._handleRequests(in_mail)
+            if send:
                 self._outLock.acquire()
                 try:
-                    cmd = self._outCmd + ['bs=' + str(self._outMailLen)]
-                    (rc, out, err) = _mboxExecCmd(cmd,
-                                                  data=self._outgoingMail)
-                    if rc:
-                        self.log.warning("SPM_MailMonitor couldn't write "
-                                         "outgoing mail, dd failed")
+                    self._writeDirtyMailboxes()
                 finally:
                     self._outLock.release()
         finally:
             self._inLock.release()
+        return send or self._hasPendingRequests()
+
+    def _writeDirtyMailboxes(self):
+        """
+        Write only the outgoing mailboxes modified since the last write.
+        Must be called with self._outLock held.
+        """
+        for first, count in _dirtyRuns(self._dirtyMailboxes):
+            start = first * MAILBOX_SIZE
+            end = start + count * MAILBOX_SIZE
+            try:
+                self._outFile.write(start, self._outgoingMail[start:end])
+            except EnvironmentError as e:
+                self.log.warning("SPM_MailMonitor couldn't write outgoing "
+                                 "mail: %s", e)
+                return
+            self._dirtyMailboxes.difference_update(
+                range(first, first + count))
 
     def sendReply(self, msgID, msg):
         # Lock is acquired in order to make sure that neither _numHosts nor
@@ -768,19 +1084,11 @@ class SPM_MailMonitor:
             self._outgoingMail = \
                 self._outgoingMail[0:msgOffset] + msg.payload + \
                 self._outgoingMail[msgOffset + MESSAGE_SIZE:self._outMailLen]
-            mailboxOffset = (msgID / SLOTS_PER_MAILBOX) * MAILBOX_SIZE
-            mailbox = self._outgoingMail[mailboxOffset:
-                                         mailboxOffset + MAILBOX_SIZE]
-            cmd = self._outCmd + ['bs=' + str(MAILBOX_SIZE),
-                                  'seek=' + str(mailboxOffset / MAILBOX_SIZE)]
-            # self.log.debug("Running command: %s, for message id: %s",
-            #               str(cmd), str(msgID))
-            (rc, out, err) = _mboxExecCmd(cmd, data=mailbox)
-            if rc:
-                self.log.error("SPM_MailMonitor: sendReply - couldn't send "
-                               "reply, dd failed")
+            self._dirtyMailboxes.add(msgID / SLOTS_PER_MAILBOX)
+            self._writeDirtyMailboxes()
         finally:
             self._outLock.release()
+        self._endRequest(msgID)
 
     @utils.traceback(on=log.name,
                      msg="Unhandled exception in SPM_MailMonitor thread")
@@ -788,12 +1096,16 @@ class SPM_MailMonitor:
         try:
             while not self._stop:
                 try:
-                    self._checkForMail()
+                    # Poll quickly while requests are in flight
+                    if self._checkForMail():
+                        self._pollInterval.reset()
                 except:
                     self.log.error("Error checking for mail", exc_info=True)
-                time.sleep(self._monitorInterval)
+                self._wakeupEvent.wait(self._pollInterval.next())
         finally:
             self._stopped = True
+            self._inFile.close()
+            self._outFile.close()
             self.tp.joinAll(waitForTasks=False)
             self.log.info("SPM_MailMonitor - Incoming mail monitoring thread "
                           "stopped")
@@ -60,6 +60,7 @@ from threadLocal import vars
 from weakref import proxy
 from vdsm.config import config
 import outOfProcess as oop
+import taskJournal
 from logUtils import SimpleLogAdapter
 
 
@@ -479,6 +480,7 @@ class Task:
         self.persistPolicy = TaskPersistType.none
         self.cleanPolicy = TaskCleanType.auto
         self.store = None
+        self._journal = None
         self.defaultException = None
 
         self.state = State(State.init)
@@ -502,19 +504,24 @@ class Task:
         self.log = SimpleLogAdapter(self.log, {"Task": self.id})
 
     def __del__(self):
-        def finalize(log, owner, taskDir):
+        def finalize(log, owner, taskDir, journal, taskID):
             log.warn("Task was autocleaned")
             owner.releaseAll()
-            if taskDir is not None:
+            if journal is not None:
+                journal.remove(taskID)
+            elif taskDir is not None:
                 getProcPool().fileUtils.cleanupdir(taskDir)
 
         if not self.state.isDone():
             taskDir = None
+            journal = None
             if (self.cleanPolicy == TaskCleanType.auto and
                     self.store is not None):
                 taskDir = os.path.join(self.store, self.id)
+                journal = self._journal
             threading.Thread(target=finalize,
-                             args=(self.log, self.resOwner, taskDir)).start()
+                             args=(self.log, self.resOwner, taskDir, journal,
+                                   self.id)).start()
 
     def _done(self):
         self.resOwner.releaseAll()
@@ -621,7 +628,16 @@ class Task:
     @classmethod
     def _loadMetaFile(cls, filename, obj, fields):
         try:
-            for line in getProcPool().readLines(filename):
+            lines = getProcPool().readLines(filename)
+        except Exception:
+            cls.log.error("Unexpected error", exc_info=True)
+            raise se.TaskMetaDataLoadError(filename)
+        cls._loadMetaLines(filename, lines, obj, fields)
+
+    @classmethod
+    def _loadMetaLines(cls, filename, lines, obj, fields):
+        try:
+            for line in lines:
                 # process current line
                 line = line.encode('utf8')
                 if line.find(KEY_SEPARATOR) < 0:
@@ -667,48 +683,56 @@ class Task:
         return lines
 
     @classmethod
-    def _saveMetaFile(cls, filename, obj, fields):
+    def _saveMetaFile(cls, filename, lines):
         try:
             getProcPool().writeLines(filename,
                                      [l.encode('utf8') + "\n"
-                                      for l in cls._dump(obj, fields)])
+                                      for l in lines])
         except Exception:
             cls.log.error("Unexpected error", exc_info=True)
             raise se.TaskMetaDataSaveError(filename)
 
-    def _loadTaskMetaFile(self, taskDir):
-        taskFile = os.path.join(taskDir, self.id + TASK_EXT)
-        self._loadMetaFile(taskFile, self, Task.fields)
-
-    def _saveTaskMetaFile(self, taskDir):
-        taskFile = os.path.join(taskDir, self.id + TASK_EXT)
-        self._saveMetaFile(taskFile, self, Task.fields)
-
-    def _loadJobMetaFile(self, taskDir, n):
-        taskFile = os.path.join(taskDir, self.id + JOB_EXT + NUM_SEP + str(n))
-        self._loadMetaFile(taskFile, self.jobs[n], Job.fields)
-
-    def _saveJobMetaFile(self, taskDir, n):
-        taskFile = os.path.join(taskDir, self.id + JOB_EXT + NUM_SEP + str(n))
-        self._saveMetaFile(taskFile, self.jobs[n], Job.fields)
-
-    def _loadRecoveryMetaFile(self, taskDir, n):
-        taskFile = os.path.join(taskDir,
-                                self.id + RECOVER_EXT + NUM_SEP + str(n))
-        self._loadMetaFile(taskFile, self.recoveries[n], Recovery.fields)
-
-    def _saveRecoveryMetaFile(self, taskDir, n):
-        taskFile = os.path.join(taskDir,
-                                self.id + RECOVER_EXT + NUM_SEP + str(n))
-        self._saveMetaFile(taskFile, self.recoveries[n], Recovery.fields)
-
-    def _loadTaskResultMetaFile(self, taskDir):
-        taskFile = os.path.join(taskDir, self.id + RESULT_EXT)
-        self._loadMetaFile(taskFile, self.result, TaskResult.fields)
+    def _dumpParts(self):
+        """
+        Return dict {extension: lines} of the task metadata parts. When the
+        task is persisted in a directory, every part is kept in a file named
+        by the task id and the part extension.
+        """
+        self.njobs = len(self.jobs)
+        self.nrecoveries = len(self.recoveries)
+        parts = {TASK_EXT: self._dump(self, Task.fields)}
+        if self.state == State.finished:
+            parts[RESULT_EXT] = self._dump(self.result, TaskResult.fields)
+        for jn in range(self.njobs):
+            parts[JOB_EXT + NUM_SEP + str(jn)] = self._dump(self.jobs[jn],
+                                                            Job.fields)
+        for rn in range(self.nrecoveries):
+            parts[RECOVER_EXT + NUM_SEP + str(rn)] = self._dump(
+                self.recoveries[rn], Recovery.fields)
+        return parts
 
-    def _saveTaskResultMetaFile(self, taskDir):
-        taskFile = os.path.join(taskDir, self.id + RESULT_EXT)
-        self._saveMetaFile(taskFile, self.result, TaskResult.fields)
+    def _loadParts(self, loadPart):
+        """
+        Load the task metadata parts using loadPart(ext, obj, fields).
+        """
+        oldid = self.id
+        loadPart(TASK_EXT, self, Task.fields)
+        if self.id != oldid:
+            raise se.TaskMetaDataLoadError("task %s: loaded file do not match"
+                                           " id (%s != %s)" %
+                                           (self, self.id, oldid))
+        if self.state == State.finished:
+            loadPart(RESULT_EXT, self.result, TaskResult.fields)
+        for jn in range(self.njobs):
+            self.jobs.append(Job("load", None))
+            loadPart(JOB_EXT + NUM_SEP + str(jn), self.jobs[jn], Job.fields)
+            self.jobs[jn].setOwnerTask(self)
+        for rn in range(self.nrecoveries):
+            self.recoveries.append(Recovery("load", "load",
+                                            "load", "load", ""))
+            loadPart(RECOVER_EXT + NUM_SEP + str(rn), self.recoveries[rn],
+                     Recovery.fields)
+            self.recoveries[rn].setOwnerTask(self)
 
     def _getResourcesKeyList(self, taskDir):
         keys = []
@@ -726,23 +750,27 @@ class Task:
         taskDir = os.path.join(storPath, str(self.id) + str(ext))
         if not getProcPool().os.path.exists(taskDir):
             raise se.TaskDirError("load: no such task dir '%s'" % taskDir)
-        oldid = self.id
-        self._loadTaskMetaFile(taskDir)
-        if self.id != oldid:
-            raise se.TaskMetaDataLoadError("task %s: loaded file do not match"
-                                           " id (%s != %s)" %
-                                           (self, self.id, oldid))
-        if self.state == State.finished:
-            self._loadTaskResultMetaFile(taskDir)
-        for jn in range(self.njobs):
-            self.jobs.append(Job("load", None))
-            self._loadJobMetaFile(taskDir, jn)
-            self.jobs[jn].setOwnerTask(self)
-        for rn in range(self.nrecoveries):
-            self.recoveries.append(Recovery("load", "load",
-                                            "load", "load", ""))
-            self._loadRecoveryMetaFile(taskDir, rn)
-            self.recoveries[rn].setOwnerTask(self)
+
+        def loadPart(partExt, obj, fields):
+            self._loadMetaFile(os.path.join(taskDir, self.id + partExt), obj,
+                               fields)
+
+        self._loadParts(loadPart)
+
+    def _loadJournalParts(self, parts):
+        self.log.debug("%s: load from journal", self)
+        if self.state != State.init:
+            raise se.TaskMetaDataLoadError("task %s - can't load self: "
+                                           "not in init state" % self)
+
+        def loadPart(partExt, obj, fields):
+            name = self.id + partExt
+            if partExt not in parts:
+                raise se.TaskMetaDataLoadError("%s: not found in journal" %
+                                               name)
+            self._loadMetaLines(name, parts[partExt], obj, fields)
+
+        self._loadParts(loadPart)
 
     def _save(self, storPath):
         origTaskDir = os.path.join(storPath, self.id)
@@ -754,15 +782,9 @@ class Task:
             getProcPool().fileUtils.cleanupdir(taskDir)
         getProcPool().os.mkdir(taskDir)
         try:
-            self.njobs = len(self.jobs)
-            self.nrecoveries = len(self.recoveries)
-            self._saveTaskMetaFile(taskDir)
-            if self.state == State.finished:
-                self._saveTaskResultMetaFile(taskDir)
-            for jn in range(self.njobs):
-                self._saveJobMetaFile(taskDir, jn)
-            for rn in range(self.nrecoveries):
-                self._saveRecoveryMetaFile(taskDir, rn)
+            for ext, lines in self._dumpParts().iteritems():
+                self._saveMetaFile(os.path.join(taskDir, self.id + ext),
+                                   lines)
         except Exception as e:
             self.log.error("Unexpected error", exc_info=True)
             try:
@@ -777,7 +799,17 @@ class Task:
         getProcPool().fileUtils.cleanupdir(origTaskDir + BACKUP_EXT)
         getProcPool().fileUtils.fsyncPath(origTaskDir)
 
+    def _saveJournal(self):
+        try:
+            self._journal.save(self.id, self._dumpParts())
+        except Exception as e:
+            self.log.error("Unexpected error", exc_info=True)
+            raise se.TaskPersistError("%s persist failed: %s" % (self, e))
+
     def _clean(self, storPath):
+        if self._journal is not None:
+            self._journal.remove(self.id)
+            return
         taskDir = os.path.join(storPath, self.id)
         getProcPool().fileUtils.cleanupdir(taskDir)
 
@@ -1100,13 +1132,17 @@ class Task:
         self.setCleanPolicy(cleanPolicy)
         if self.persistPolicy != TaskPersistType.none and not self.store:
             raise se.TaskPersistError("no store defined")
-        taskDir = os.path.join(self.store, self.id)
-        try:
-            getProcPool().fileUtils.createdir(taskDir)
-        except Exception as e:
-            self.log.error("Unexpected error", exc_info=True)
-            raise se.TaskPersistError("%s: cannot access/create taskdir"
-                                      " %s: %s" % (self, taskDir, e))
+        if taskJournal.enabled():
+            self._journal = taskJournal.getJournal(self.store)
+        else:
+            self._journal = None
+            taskDir = os.path.join(self.store, self.id)
+            try:
+                getProcPool().fileUtils.createdir(taskDir)
+            except Exception as e:
+                self.log.error("Unexpected error", exc_info=True)
+                raise se.TaskPersistError("%s: cannot access/create taskdir"
+                                          " %s: %s" % (self, taskDir, e))
         if (self.persistPolicy == TaskPersistType.auto and
                 self.state != State.init):
             self.persist()
@@ -1131,7 +1167,10 @@ class Task:
             raise se.TaskPersistError("no store defined")
         if self.state == State.init:
             raise se.TaskStateError("can't persist in state %s" % self.state)
-        self._save(self.store)
+        if self._journal is not None:
+            self._saveJournal()
+        else:
+            self._save(self.store)
 
     @classmethod
     def loadTask(cls, store, taskid):
@@ -1152,6 +1191,15 @@ class Task:
         t._load(store, ext)
         return t
 
+    @classmethod
+    def loadJournalTask(cls, taskid, parts):
+        """
+        Load a task from its metadata parts stored in a task journal.
+        """
+        t = Task(taskid)
+        t._loadJournalParts(parts)
+        return t
+
     @threadlocal_task
     def prepare(self, func, *args, **kwargs):
         message = self.error
@@ -0,0 +1,199 @@
+#
+# Copyright 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Append-only journal of persistent tasks
+
+Persisting a task appends one record holding all the task metadata parts to
+the journal, instead of writing a directory of files for the task. Removing a
+task appends a record marking the task as removed. When the journal is
+loaded, the last record of every task wins.
+
+When the journal holds many more records than tasks, it is compacted by
+writing the records of the current tasks to a new journal replacing the old
+one.
+
+The journal is used only if the out of process implementation can append
+to a file in place (see enabled()). With ioprocess, appending rewrites the
+whole journal, so tasks are persisted in task directories, and the journal
+is only read to move its tasks to task directories. Such updates compact the
+journal instead of appending, writing only the current tasks.
+"""
+
+import errno
+import json
+import logging
+import os
+import threading
+
+from vdsm.config import config
+
+import outOfProcess as oop
+
+JOURNAL_NAME = "tasks.journal"
+COMPACT_EXT = ".compact"
+
+# Compact the journal when it has more than COMPACT_RATIO records per task,
+# and more than COMPACT_MIN_RECORDS records.
+COMPACT_RATIO = 4
+COMPACT_MIN_RECORDS = 100
+
+getProcPool = oop.getGlobalProcPool
+
+_journalsLock = threading.Lock()
+_journals = {}
+
+
+def enabled():
+    """
+    Return True if tasks are persisted in the journal (irs:task_journal),
+    and the out of process implementation appends to the journal in place.
+    """
+    return config.getboolean('irs', 'task_journal') and oop.appendsInPlace()
+
+
+def isJournalFile(name):
+    """
+    Return True if name is a journal file name in the tasks directory.
+    """
+    return name.startswith(JOURNAL_NAME)
+
+
+def getJournal(store):
+    """
+    Return the journal of the tasks directory store.
+    """
+    with _journalsLock:
+        journal = _journals.get(store)
+        if journal is None:
+            journal = _journals[store] = TaskJournal(store)
+        return journal
+
+
+class TaskJournal(object):
+    log = logging.getLogger("Storage.TaskManager.Journal")
+
+    def __init__(self, store):
+        self._store = store
+        self._path = os.path.join(store, JOURNAL_NAME)
+        self._lock = threading.Lock()
+        self._tasks = None  # {taskID: parts}, read on first use
+        self._records = 0
+        # Set if the journal may end with a partly written record
+        self._needCompaction = False
+
+    def load(self):
+        """
+        Read the journal from storage and return dict {taskID: parts} of the
+        tasks in the journal, where parts is dict {extension: lines} of the
+        task metadata parts.
+        """
+        with self._lock:
+            self._read()
+            return dict(self._tasks)
+
+    def save(self, taskID, parts):
+        with self._lock:
+            self._update(taskID, parts)
+
+    def remove(self, taskID):
+        with self._lock:
+            if self._tasks is None:
+                self._read()
+            if taskID in self._tasks:
+                self._update(taskID, None)
+
+    def _update(self, taskID, parts):
+        if self._tasks is None:
+            self._read()
+
+        old = self._tasks.get(taskID)
+        if parts is None:
+            del self._tasks[taskID]
+            record = {"id": taskID, "removed": True}
+        else:
+            self._tasks[taskID] = parts
+            record = {"id": taskID, "parts": parts}
+        self._records += 1
+
+        try:
+            if (self._needCompaction or not oop.appendsInPlace() or
+                    self._records > max(COMPACT_MIN_RECORDS,
+                                        COMPACT_RATIO * len(self._tasks))):
+                self._compact()
+            else:
+                getProcPool().appendLines(self._path,
+                                          [json.dumps(record) + "\n"])
+        except Exception:
+            # We don't know what was written, compact on the next update
+            self._needCompaction = True
+            if old is None:
+                self._tasks.pop(taskID, None)
+            else:
+                self._tasks[taskID] = old
+            raise
+
+    def _compact(self):
+        self.log.debug("Compacting journal %s (%d records, %d tasks)",
+                       self._path, self._records, len(self._tasks))
+        lines = [json.dumps({"id": taskID, "parts": parts}) + "\n"
+                 for taskID, parts in self._tasks.iteritems()]
+        tmpPath = self._path + COMPACT_EXT
+        procPool = getProcPool()
+        procPool.writeLines(tmpPath, lines)
+        procPool.fileUtils.fsyncPath(tmpPath)
+        procPool.os.rename(tmpPath, self._path)
+        procPool.fileUtils.fsyncPath(self._store)
+        self._records = len(self._tasks)
+        self._needCompaction = False
+
+    def _read(self):
+        try:
+            # Unlike readLines, directReadLines keeps the line endings with
+            # all the implementations, so we can detect a partly written
+            # record. It also bypasses the page cache, so we see the records
+            # written by the previous SPM on another host.
+            lines = getProcPool().directReadLines(self._path)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            lines = []
+
+        self._tasks = {}
+        self._records = 0
+        self._needCompaction = False
+
+        for line in lines:
+            try:
+                if not line.endswith("\n"):
+                    raise ValueError("Partly written record")
+                record = json.loads(line)
+                taskID = record["id"]
+                if record.get("removed"):
+                    self._tasks.pop(taskID, None)
+                else:
+                    self._tasks[taskID] = record["parts"]
+            except (ValueError, KeyError, TypeError) as e:
+                self.log.warning("Ignoring invalid record %r in journal %s: "
+                                 "%s", line, self._path, e)
+                # Drop the invalid record before appending new records
+                self._needCompaction = True
+                continue
+            self._records += 1
@@ -24,7 +24,9 @@ import threading
 
 from vdsm.config import config
 import storage_exception as se
-from task import Task, Job, TaskCleanType
+import taskJournal
+from task import Task, Job, TaskCleanType, TaskPersistType, getProcPool
+from task import TEMP_EXT, BACKUP_EXT
 from threadPool import ThreadPool
 
 
@@ -203,18 +205,42 @@ class TaskManager:
         return subRes
 
     def loadDumpedTasks(self, store):
+        """
+        Load the tasks persisted in store, in task directories or in the task
+        journal. Tasks found in the store not used by this host (see
+        taskJournal.enabled) are moved to the store used by this host.
+        """
         if not os.path.exists(store):
             self.log.debug("task dump path %s does not exist.", store)
             return
+        useJournal = taskJournal.enabled()
+        journal = taskJournal.getJournal(store)
+        try:
+            journalTasks = journal.load()
+        except Exception:
+            self.log.error("taskManager: Cannot read task journal in %s",
+                           store, exc_info=True)
+            journalTasks = {}
         # taskID is the root part of each (root.ext) entry in the dump task dir
-        tasksIDs = set(os.path.splitext(tid)[0] for tid in os.listdir(store))
-        for taskID in tasksIDs:
+        dirTaskIDs = set(os.path.splitext(tid)[0] for tid in os.listdir(store)
+                         if not taskJournal.isJournalFile(tid))
+        for taskID in dirTaskIDs.union(journalTasks):
+            # If moving a task was interrupted, the task may be in both
+            # stores, and the store used by this host is up to date.
+            fromJournal = (taskID in journalTasks and
+                           (useJournal or taskID not in dirTaskIDs))
             self.log.debug("Loading dumped task %s", taskID)
             try:
-                t = Task.loadTask(store, taskID)
+                if fromJournal:
+                    t = Task.loadJournalTask(taskID, journalTasks[taskID])
+                else:
+                    t = Task.loadTask(store, taskID)
                 t.setPersistence(store,
                                  str(t.persistPolicy),
                                  str(t.cleanPolicy))
+                if (fromJournal != useJournal and
+                        t.persistPolicy != TaskPersistType.none):
+                    self._moveTask(t, store, journal, fromJournal)
                 self._unqueuedTasks.append(t)
             except Exception:
                 self.log.error("taskManager: Skipping directory: %s",
@@ -222,6 +248,21 @@ class TaskManager:
                                exc_info=True)
                 continue
 
+    def _moveTask(self, task, store, journal, fromJournal):
+        """
+        Remove a task from the store it was loaded from, after persisting it
+        in the store used by this host.
+        """
+        self.log.debug("Moving task %s from %s", task.id,
+                       "journal" if fromJournal else "task directory")
+        task.persist()
+        if fromJournal:
+            journal.remove(task.id)
+        else:
+            for ext in ("", TEMP_EXT, BACKUP_EXT):
+                getProcPool().fileUtils.cleanupdir(
+                    os.path.join(store, task.id + ext))
+
     def recoverDumpedTasks(self):
         for task in self._unqueuedTasks[:]:
             self.queueRecovery(task)
@@ -121,6 +121,64 @@ def getBackingVolumePath(imgUUID, volUUID):
     return os.path.join('..', imgUUID, volUUID)
 
 
+def parseMetadata(lines):
+    """
+    Return dict of the key=value metadata lines, up to the EOF line.
+    """
+    out = {}
+    for l in lines:
+        if l.startswith("EOF"):
+            return out
+        if l.find("=") < 0:
+            continue
+        key, value = l.split("=")
+        out[key.strip()] = value.strip()
+    return out
+
+
+def metadata2info(volUUID, meta, parent, image):
+    return {
+        "uuid": volUUID,
+        "type": meta.get(TYPE, ""),
+        "format": meta.get(FORMAT, ""),
+        "disktype": meta.get(DISKTYPE, ""),
+        "voltype": meta.get(VOLTYPE, ""),
+        "size": int(meta.get(SIZE, "0")),
+        "parent": parent,
+        "description": meta.get(DESCRIPTION, ""),
+        "pool": meta.get(sd.DMDK_POOLS, ""),
+        "domain": meta.get(DOMAIN, ""),
+        "image": image,
+        "ctime": meta.get(CTIME, ""),
+        "mtime": "0",
+        "legality": meta.get(LEGALITY, ""),
+    }
+
+
+def makeInfo(volUUID, meta, parent, image, apparentsize, truesize):
+    """
+    Return the volume info returned by Volume.getInfo(), using metadata and
+    sizes read in bulk by the domain. meta is None if the metadata could not
+    be read, and the sizes are None if the volume could not be found.
+    """
+    info = {}
+    if meta is not None:
+        info = metadata2info(volUUID, meta, parent, image)
+        info["capacity"] = str(info.pop("size") * BLOCK_SIZE)
+    if meta is None or apparentsize is None:
+        info['apparentsize'] = "0"
+        info['truesize'] = "0"
+        info['status'] = "INVALID"
+    else:
+        info['apparentsize'] = str(apparentsize)
+        info['truesize'] = str(truesize)
+        info['status'] = "OK"
+    info['children'] = []
+    if info.get('legality', None) == ILLEGAL_VOL:
+        info['status'] = ILLEGAL_VOL
+    return info
+
+
 class VmVolumeInfo(object):
     TYPE_PATH = "path"
     TYPE_NETWORK = "network"
@@ -800,22 +858,8 @@ class Volume(object):
         pass
 
     def metadata2info(self, meta):
-        return {
-            "uuid": self.volUUID,
-            "type": meta.get(TYPE, ""),
-            "format": meta.get(FORMAT, ""),
-            "disktype": meta.get(DISKTYPE, ""),
-            "voltype": meta.get(VOLTYPE, ""),
-            "size": int(meta.get(SIZE, "0")),
-            "parent": self.getParent(),
-            "description": meta.get(DESCRIPTION, ""),
-            "pool": meta.get(sd.DMDK_POOLS, ""),
-            "domain": meta.get(DOMAIN, ""),
-            "image": self.getImage(),
-            "ctime": meta.get(CTIME, ""),
-            "mtime": "0",
-            "legality": meta.get(LEGALITY, ""),
-        }
+        return metadata2info(self.volUUID, meta, self.getParent(),
+                             self.getImage())
 
     @classmethod
     def newMetadata(cls, metaId, sdUUID, imgUUID, puuid, size, format, type,